@@ -0,0 +1,81 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+# ======== CONTROLLO DI AMMISSIONE ========
+# Secchi di gettoni (token bucket) per le richieste che scrivono: ogni secchio
+# si riempie di `al_secondo` gettoni al secondo fino a `raffica` e ogni
+# richiesta ne consuma uno. C'è un secchio per chiave (utente o indirizzo) e
+# uno globale, più un tetto alle scritture in corso: con gevent le richieste
+# in attesa del lock di una collezione altrimenti si accumulano senza limite.
+# Chi non passa riceve subito i secondi da aspettare (per Retry-After) invece
+# di restare in coda. I valori sono per processo, come le metriche.
+class SecchioGettoni:
+    def __init__(self, al_secondo, raffica, adesso=None):
+        self.al_secondo = al_secondo
+        self.raffica = raffica
+        self.gettoni = float(raffica)
+        self.aggiornato = time.monotonic() if adesso is None else adesso
+
+    def attesa(self, adesso):
+        """Secondi prima che ci sia un gettone; 0 se c'è già."""
+        if adesso > self.aggiornato:
+            self.gettoni = min(self.raffica, self.gettoni + (adesso - self.aggiornato) * self.al_secondo)
+            self.aggiornato = adesso
+        if self.gettoni >= 1:
+            return 0.0
+        return (1 - self.gettoni) / self.al_secondo
+
+    def preleva(self):
+        self.gettoni -= 1
+
+
+class ControlloAmmissione:
+    def __init__(self, al_secondo, raffica, al_secondo_chiave, raffica_chiave, max_in_corso, max_chiavi=10000):
+        self.globale = SecchioGettoni(al_secondo, raffica)
+        self.al_secondo_chiave = al_secondo_chiave
+        self.raffica_chiave = raffica_chiave
+        self.max_in_corso = max_in_corso
+        self.max_chiavi = max_chiavi
+        self.secchi = OrderedDict()  # chiave -> SecchioGettoni, dal meno recente
+        self.in_corso = 0
+        self.lock = threading.Lock()
+
+    def _secchio(self, chiave, adesso):
+        secchio = self.secchi.get(chiave)
+        if secchio is None:
+            secchio = self.secchi[chiave] = SecchioGettoni(self.al_secondo_chiave, self.raffica_chiave, adesso)
+            if len(self.secchi) > self.max_chiavi:
+                # Il meno recente è quasi certamente di nuovo pieno
+                self.secchi.popitem(last=False)
+        else:
+            self.secchi.move_to_end(chiave)
+        return secchio
+
+    def ammetti(self, chiave, prioritaria=False):
+        """None se la richiesta passa (poi va chiamato termina), altrimenti (motivo, secondi di attesa).
+
+        Le richieste prioritarie hanno solo il limite della loro chiave: non
+        consumano il secchio globale e superano il tetto delle scritture in corso.
+        """
+        adesso = time.monotonic()
+        with self.lock:
+            if not prioritaria and self.in_corso >= self.max_in_corso:
+                return "in_corso", 1.0
+            secchio = self._secchio(chiave, adesso)
+            attesa = secchio.attesa(adesso)
+            if attesa:
+                return "chiave", attesa
+            if not prioritaria:
+                attesa = self.globale.attesa(adesso)
+                if attesa:
+                    return "globale", attesa
+                self.globale.preleva()
+            secchio.preleva()
+            self.in_corso += 1
+            return None
+
+    def termina(self):
+        with self.lock:
+            self.in_corso -= 1
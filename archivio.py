@@ -0,0 +1,1898 @@
+import bisect
+import copy
+import hashlib
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import case, cast, func, select, tuple_, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm.attributes import flag_modified
+
+from codec import CodecJSON, CodecNonDisponibile, carica_json, crea_codec, decodifica
+from metriche import registra_io
+from traccia import span, span_concluso, tracciato
+
+db = SQLAlchemy()
+
+
+# ======== CACHE JSON ========
+# Cache in memoria delle collezioni già lette: ogni voce è validata con os.stat
+# (mtime + dimensione + inode), quindi un file non modificato non viene mai
+# ri-parsato. Le scritture fatte da scrivi_json aggiornano direttamente la cache.
+# Ogni voce ha un numero di generazione: cambia a ogni nuova lettura o scrittura
+# e permette agli indici costruiti sopra la cache di capire se sono ancora validi.
+_cache_json = {}
+_cache_json_lock = threading.Lock()
+_generazione_cache = [0]
+statistiche_cache = {"hit": 0, "miss": 0}
+# Codec con cui si scrivono file e snapshot (vedi codec.py); si legge ogni formato
+_codec = [CodecJSON()]
+
+
+def imposta_codec(nome):
+    """Sceglie il formato delle prossime scritture: "json", "orjson" o "msgpack"."""
+    _codec[0] = crea_codec(nome)
+
+
+def codec_attivo():
+    return _codec[0]
+
+
+def _misura_io(path, operazione, byte, inizio):
+    """Metriche e span di traccia per una lettura/scrittura di file iniziata a `inizio`."""
+    durata = time.perf_counter() - inizio
+    registra_io(path, operazione, byte, durata)
+    span_concluso(f"file.{operazione}", inizio, durata, file=os.path.basename(path), byte=byte)
+
+
+def _firma_file(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+
+def _copia_collezione(dati):
+    # Copia superficiale record per record: i chiamanti possono modificare i campi
+    # dei record senza toccare la cache (le liste annidate restano condivise).
+    if isinstance(dati, list):
+        return [dict(r) if isinstance(r, dict) else r for r in dati]
+    if isinstance(dati, dict):
+        return dict(dati)
+    return dati
+
+
+def _salva_in_cache(path, firma, dati):
+    # Da chiamare con _cache_json_lock acquisito
+    _generazione_cache[0] += 1
+    _cache_json[path] = (firma, dati, _generazione_cache[0])
+    return _generazione_cache[0]
+
+
+def leggi_json_con_generazione(path, copia=True):
+    firma = _firma_file(path)
+    if firma is None:
+        return [], 0
+    with _cache_json_lock:
+        voce = _cache_json.get(path)
+        if voce is not None and voce[0] == firma:
+            statistiche_cache["hit"] += 1
+            return (_copia_collezione(voce[1]) if copia else voce[1]), voce[2]
+        statistiche_cache["miss"] += 1
+    inizio = time.perf_counter()
+    with open(path, "rb") as f:
+        contenuto = f.read()
+    try:
+        dati = decodifica(contenuto)
+    except CodecNonDisponibile:
+        # Meglio un errore che una collezione vuota riscritta sopra i dati
+        raise
+    except Exception:
+        dati = []
+    _misura_io(path, "lettura", len(contenuto), inizio)
+    with _cache_json_lock:
+        generazione = _salva_in_cache(path, firma, dati)
+    return (_copia_collezione(dati) if copia else dati), generazione
+
+
+def leggi_json(path, copia=True):
+    """Legge una collezione JSON passando dalla cache.
+
+    Con copia=False restituisce l'oggetto in cache: da usare solo in lettura.
+    """
+    return leggi_json_con_generazione(path, copia)[0]
+
+
+def scrivi_json(path, dati):
+    # File temporaneo + os.replace: chi legge, anche da un altro processo, vede
+    # sempre il file vecchio o quello nuovo, mai uno scritto a metà. Ogni
+    # scrittura cambia inode, quindi la firma in cache cambia sempre.
+    temporaneo = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    inizio = time.perf_counter()
+    contenuto = _codec[0].codifica(dati)
+    with open(temporaneo, "wb") as f:
+        f.write(contenuto)
+        f.flush()
+        os.fsync(f.fileno())
+        st = os.fstat(f.fileno())
+    os.replace(temporaneo, path)
+    _misura_io(path, "scrittura", len(contenuto), inizio)
+    firma = (st.st_mtime_ns, st.st_size, st.st_ino)
+    with _cache_json_lock:
+        return _salva_in_cache(path, firma, _copia_collezione(dati))
+
+
+def svuota_cache_json(path=None):
+    with _cache_json_lock:
+        if path is None:
+            _cache_json.clear()
+        else:
+            _cache_json.pop(path, None)
+
+
+def statistiche_cache_json():
+    with _cache_json_lock:
+        totale = statistiche_cache["hit"] + statistiche_cache["miss"]
+        return {
+            "hit": statistiche_cache["hit"],
+            "miss": statistiche_cache["miss"],
+            "hit_ratio": round(statistiche_cache["hit"] / totale, 4) if totale else 0,
+            "collezioni": [os.path.basename(p) for p in _cache_json]
+        }
+
+
+# ======== LOCK TRA PROCESSI ========
+# Con più worker gunicorn i lock in memoria non bastano: ogni transazione su una
+# collezione prende anche un lock esclusivo sul file "<collezione>.lock"
+# (flock su POSIX, msvcrt.locking su Windows). Il file di lock viene aperto a
+# ogni acquisizione, così un fork non eredita un lock già preso.
+def _blocca_file(fd, blocca):
+    if fcntl is not None:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | (0 if blocca else fcntl.LOCK_NB))
+        except BlockingIOError:
+            return False
+        return True
+    while True:
+        try:
+            msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+            return True
+        except OSError:
+            if not blocca:
+                return False
+            time.sleep(0.005)
+
+
+def _sblocca_file(fd):
+    if fcntl is not None:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+    else:
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+
+
+class LockFile:
+    """Lock esclusivo tra processi e tra thread, rientrante nello stesso thread."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.RLock()
+        self._livello = 0
+        self._fd = None
+
+    def acquisisci(self, blocca=True):
+        if not self._lock.acquire(blocking=blocca):
+            return False
+        if self._livello == 0:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                bloccato = _blocca_file(fd, blocca)
+            except BaseException:
+                os.close(fd)
+                self._lock.release()
+                raise
+            if not bloccato:
+                os.close(fd)
+                self._lock.release()
+                return False
+            self._fd = fd
+        self._livello += 1
+        return True
+
+    def rilascia(self):
+        self._livello -= 1
+        if self._livello == 0:
+            fd, self._fd = self._fd, None
+            try:
+                _sblocca_file(fd)
+            finally:
+                os.close(fd)
+        self._lock.release()
+
+    def __enter__(self):
+        self.acquisisci()
+        return self
+
+    def __exit__(self, *eccezione):
+        self.rilascia()
+
+
+# ======== VERSIONI ========
+# Ogni collezione ha un contatore di versione in "<file>.versione" che cresce a
+# ogni scrittura: si incrementa con il lock della collezione acquisito, dopo
+# aver scritto i dati, quindi chi legge la versione N legge poi dati almeno
+# aggiornati alla N. Serve per gli ETag senza leggere la collezione.
+_cache_contatori = {}
+
+
+def _leggi_contatore(file, predefinito=0):
+    firma = _firma_file(file)
+    if firma is None:
+        return predefinito
+    voce = _cache_contatori.get(file)
+    if voce is not None and voce[0] == firma:
+        return voce[1]
+    try:
+        with open(file, "r", encoding="utf-8") as f:
+            valore = int(f.read() or 0)
+    except (OSError, ValueError):
+        return predefinito
+    _cache_contatori[file] = (firma, valore)
+    return valore
+
+
+def _scrivi_contatore(file, valore):
+    temporaneo = f"{file}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temporaneo, "w", encoding="utf-8") as f:
+        f.write(str(valore))
+    os.replace(temporaneo, file)
+
+
+def leggi_versione(path):
+    return _leggi_contatore(path + ".versione")
+
+
+def incrementa_versione(path):
+    # Da chiamare con il lock della collezione acquisito
+    versione = leggi_versione(path) + 1
+    _scrivi_contatore(path + ".versione", versione)
+    return versione
+
+
+# ======== ID ========
+# Gli id numerici si assegnano da un contatore in "<file>.id", incrementato con
+# il lock della collezione: due worker non danno mai lo stesso id e un id non
+# torna libero dopo un'eliminazione. Alla prima allocazione il contatore parte
+# dall'id più alto già presente; i record inseriti con il loro id (importazioni,
+# migrazioni) lo spostano oltre quegli id.
+def id_massimo(record):
+    return max((r["id"] for r in record if type(r.get("id")) is int), default=0)
+
+
+def _da_rinumerare(record):
+    # Posizioni dei record senza id intero o con un id già visto prima
+    visti, posizioni = set(), []
+    for posizione, r in enumerate(record):
+        valore = r.get("id")
+        if type(valore) is not int or valore in visti:
+            posizioni.append(posizione)
+        else:
+            visti.add(valore)
+    return posizioni
+
+
+def alloca_id(path, record, quanti=1, oltre=0):
+    # Da chiamare con il lock della collezione acquisito. Riserva `quanti` id
+    # consecutivi dopo `oltre` e restituisce il primo.
+    ultimo = _leggi_contatore(path + ".id", None)
+    if ultimo is None:
+        ultimo = id_massimo(record)
+    ultimo = max(ultimo, oltre)
+    _scrivi_contatore(path + ".id", ultimo + quanti)
+    return ultimo + 1
+
+
+# ======== MODIFICHE A UNA COLLEZIONE ========
+class _Modifiche:
+    """Raccoglie le operazioni fatte su una collezione durante una transazione.
+
+    Con applica=True le operazioni modificano subito la lista (file JSON
+    riscritto per intero); con applica=False la lista resta intatta e le
+    operazioni finiscono nel journal. In `variazioni` restano le terne
+    (posizione, vecchio, nuovo) già applicate, per aggiornare le viste.
+    Modifiche ed eliminazioni portano, oltre alla posizione, il valore del
+    campo `chiave` del record (vedi _posizione_operazione).
+    """
+
+    def __init__(self, record, generazione, applica=True, chiave="id"):
+        self.record = record
+        self.generazione = generazione
+        self.applica = applica
+        self.chiave = chiave
+        self.operazioni = []
+        self.variazioni = []
+
+    def _dove(self, operazione, indice):
+        valore = self.record[indice].get(self.chiave)
+        if valore is not None:
+            operazione["dove"] = {self.chiave: valore}
+        return operazione
+
+    def aggiungi(self, record):
+        if self.applica:
+            self.record.append(record)
+            self.variazioni.append((len(self.record) - 1, None, record))
+        self.operazioni.append({"op": "inserisci", "record": record})
+
+    def sostituisci(self, indice, record):
+        self.operazioni.append(self._dove({"op": "modifica", "indice": indice, "record": record}, indice))
+        if self.applica:
+            self.variazioni.append((indice, self.record[indice], record))
+            self.record[indice] = record
+
+    def rimuovi(self, indice):
+        self.operazioni.append(self._dove({"op": "elimina", "indice": indice}, indice))
+        if self.applica:
+            self.variazioni.append((indice, self.record.pop(indice), None))
+
+
+# ======== VISTE DERIVATE ========
+# Una vista è un dato calcolato da una collezione (conteggi, medie, ...) e
+# aggiornato record per record: applica(None, nuovo) per un inserimento,
+# applica(vecchio, None) per un'eliminazione, applica(vecchio, nuovo) per una
+# modifica. Se la collezione cambia in modo non tracciato (file riscritto da un
+# altro processo, journal ricostruito) la vista viene ricalcolata da zero.
+# Il backend SQL non ha un flusso di modifiche: usa interroga() se la vista la
+# implementa con delle query, altrimenti ricalcola la vista a ogni lettura.
+# interroga() restituisce NON_INTERROGABILE quando non ha una query per quegli
+# argomenti (la versione di base non ne ha mai).
+NON_INTERROGABILE = object()
+
+
+class Vista:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.generazione = None
+
+    def azzera(self):
+        raise NotImplementedError
+
+    def aggiungi(self, record):
+        raise NotImplementedError
+
+    def togli(self, record):
+        raise NotImplementedError
+
+    def risultato(self, *argomenti):
+        raise NotImplementedError
+
+    def interroga(self, archivio, nome, *argomenti):
+        return NON_INTERROGABILE
+
+    def applica(self, vecchio, nuovo):
+        if vecchio is not None:
+            self.togli(vecchio)
+        if nuovo is not None:
+            self.aggiungi(nuovo)
+
+    def applica_in(self, posizione, vecchio, nuovo):
+        # Solo le viste che tengono posizioni (IndicePerCampo) la ridefiniscono
+        self.applica(vecchio, nuovo)
+
+    def ricostruisci(self, record):
+        self.azzera()
+        for r in record:
+            self.aggiungi(r)
+
+
+class ConteggioPerCampo(Vista):
+    """Numero di record per valore di un campo (es. voti per utente)."""
+
+    def __init__(self, campo):
+        super().__init__()
+        self.campo = campo
+
+    def azzera(self):
+        self.conteggi = {}
+
+    def aggiungi(self, record):
+        try:
+            self.conteggi[record.get(self.campo)] = self.conteggi.get(record.get(self.campo), 0) + 1
+        except TypeError:
+            pass
+
+    def togli(self, record):
+        valore = record.get(self.campo)
+        try:
+            if self.conteggi.get(valore, 0) > 1:
+                self.conteggi[valore] -= 1
+            else:
+                self.conteggi.pop(valore, None)
+        except TypeError:
+            pass
+
+    def risultato(self, valore=None):
+        # Senza valore: tutti i conteggi; con un valore: il suo conteggio
+        if valore is None:
+            return dict(self.conteggi)
+        return self.conteggi.get(valore, 0)
+
+    def interroga(self, archivio, nome, valore=None):
+        if valore is None:
+            return archivio.conta_per(nome, self.campo)
+        return archivio.conta(nome, **{self.campo: valore})
+
+
+class MappaPerCampo(Vista):
+    """Valore di un campo per ogni valore di un altro (es. username -> ruolo)."""
+
+    def __init__(self, chiave, campo, predefinito=None):
+        super().__init__()
+        self.chiave = chiave
+        self.campo = campo
+        self.predefinito = predefinito
+
+    def azzera(self):
+        self.mappa = {}
+
+    def aggiungi(self, record):
+        try:
+            self.mappa[record.get(self.chiave)] = record.get(self.campo, self.predefinito)
+        except TypeError:
+            pass
+
+    def togli(self, record):
+        try:
+            if self.mappa.get(record.get(self.chiave)) == record.get(self.campo, self.predefinito):
+                del self.mappa[record.get(self.chiave)]
+        except (TypeError, KeyError):
+            pass
+
+    def risultato(self, chiave=None):
+        if chiave is None:
+            return dict(self.mappa)
+        return self.mappa.get(chiave, self.predefinito)
+
+    def interroga(self, archivio, nome, chiave=None):
+        if chiave is None:
+            return NON_INTERROGABILE
+        record = archivio.trova(nome, **{self.chiave: chiave})
+        return record.get(self.campo, self.predefinito) if record else self.predefinito
+
+
+class IndicePerCampo(Vista):
+    """Posizioni dei record per valore di un campo (es. id -> posizione).
+
+    L'indice non tiene le posizioni ma uno slot per record che non cambia
+    mai: un'eliminazione toglie lo slot solo dal suo gruppo e lo annota tra
+    i rimossi, e la posizione è lo slot meno gli slot rimossi prima di lui.
+    Così inserimenti, modifiche ed eliminazioni costano O(log n) più la
+    dimensione del gruppo; dopo MAX_RIMOSSI eliminazioni gli slot vengono
+    rinumerati. I record nuovi si aggiungono sempre in fondo alla collezione.
+    """
+    MAX_RIMOSSI = 4096
+
+    def __init__(self, campo):
+        super().__init__()
+        self.campo = campo
+        self.azzera()
+
+    def azzera(self):
+        self.slot = {}  # valore -> slot in ordine crescente
+        self.rimossi = []  # slot eliminati, in ordine crescente
+        self.prossimo = 0  # slot del prossimo record aggiunto
+
+    def _slot_in(self, posizione):
+        # Il più piccolo slot s con posizione + 1 slot vivi in [0, s]
+        basso, alto = posizione, posizione + len(self.rimossi)
+        while basso < alto:
+            medio = (basso + alto) // 2
+            if medio + 1 - bisect.bisect_right(self.rimossi, medio) > posizione:
+                alto = medio
+            else:
+                basso = medio + 1
+        return basso
+
+    def _aggiungi_slot(self, slot, record):
+        try:
+            bisect.insort(self.slot.setdefault(record.get(self.campo), []), slot)
+        except TypeError:
+            pass
+
+    def _togli_slot(self, slot, record):
+        try:
+            lista = self.slot.get(record.get(self.campo))
+        except TypeError:
+            return
+        if lista:
+            i = bisect.bisect_left(lista, slot)
+            if i < len(lista) and lista[i] == slot:
+                del lista[i]
+            if not lista:
+                del self.slot[record.get(self.campo)]
+
+    def _rinumera(self):
+        for lista in self.slot.values():
+            lista[:] = [s - bisect.bisect_left(self.rimossi, s) for s in lista]
+        self.prossimo -= len(self.rimossi)
+        self.rimossi = []
+
+    def applica_in(self, posizione, vecchio, nuovo):
+        if vecchio is None and nuovo is not None:
+            self._aggiungi_slot(self.prossimo, nuovo)
+            self.prossimo += 1
+        elif vecchio is not None and nuovo is not None:
+            if vecchio.get(self.campo) != nuovo.get(self.campo):
+                slot = self._slot_in(posizione)
+                self._togli_slot(slot, vecchio)
+                self._aggiungi_slot(slot, nuovo)
+        elif vecchio is not None:
+            slot = self._slot_in(posizione)
+            self._togli_slot(slot, vecchio)
+            bisect.insort(self.rimossi, slot)
+            if len(self.rimossi) > self.MAX_RIMOSSI:
+                self._rinumera()
+
+    def ricostruisci(self, record):
+        self.azzera()
+        for posizione, r in enumerate(record):
+            try:
+                self.slot.setdefault(r.get(self.campo), []).append(posizione)
+            except TypeError:
+                pass
+        self.prossimo = len(record)
+
+    def risultato(self, valore):
+        lista = self.slot.get(valore, ())
+        if not self.rimossi:
+            return list(lista)
+        return [s - bisect.bisect_left(self.rimossi, s) for s in lista]
+
+
+# ======== JOURNAL ========
+# Ogni inserimento/modifica/eliminazione è una riga appesa al journal (NDJSON)
+# invece di una riscrittura dello snapshot. Lo stato si ricostruisce da
+# snapshot + journal; oltre la soglia in byte un thread in background ripiega
+# il journal nello snapshot.
+#
+# Compattazione: il journal viene rinominato nel file di compattazione (le
+# nuove scritture ripartono da un journal vuoto), si scrive il checkpoint con
+# l'hash del nuovo snapshot, si sostituisce lo snapshot e infine si cancellano
+# compattazione e checkpoint. Se il processo muore a metà, il checkpoint dice
+# se lo snapshot contiene già le operazioni del file di compattazione.
+#
+# Tra processi: le transazioni tengono il lock sul file "<journal>.lock", una
+# sola compattazione alla volta gira grazie a "<compattazione>.lock" e chi
+# legge riparte da capo se un file sparisce o cambia durante la lettura.
+#
+# Durabilità: ogni transazione fa flush e fsync del journal prima di
+# rilasciare il lock, come scrivi_json e la compattazione per i loro file;
+# una scrittura confermata sopravvive a un crash della macchina.
+#
+# Righe: {"op": "inserisci", "record": ...}, {"op": "modifica", "indice": i,
+# "dove": {"id": ...}, "record": ...} (il record intero, che sostituisce il
+# vecchio) e {"op": "elimina", "indice": i, "dove": {"id": ...}}. Le righe
+# scritte prima di "dove" (modifica con "campi", da unire al record) si
+# applicano ancora per posizione.
+def _posizione_operazione(record, operazione):
+    indice = operazione.get("indice", -1)
+    dove = operazione.get("dove")
+    if not dove:
+        return indice if 0 <= indice < len(record) else None
+    (campo, valore), = dove.items()
+    if 0 <= indice < len(record) and record[indice].get(campo) == valore:
+        return indice
+    # Lo stato non corrisponde alle posizioni di chi ha scritto la riga: si
+    # cerca il record per chiave invece di toccarne un altro
+    for posizione, r in enumerate(record):
+        if r.get(campo) == valore:
+            return posizione
+    return None
+
+
+def _applica_operazione(record, operazione):
+    # Restituisce la variazione (posizione, vecchio, nuovo), None se l'operazione non ha effetto
+    tipo = operazione.get("op")
+    if tipo == "inserisci":
+        # "voto" è la chiave usata dal primo journal dei voti
+        nuovo = operazione.get("record", operazione.get("voto"))
+        record.append(nuovo)
+        return len(record) - 1, None, nuovo
+    indice = _posizione_operazione(record, operazione)
+    if indice is None:
+        return None
+    if tipo == "modifica":
+        vecchio = record[indice]
+        if "record" in operazione:
+            record[indice] = operazione["record"]
+        else:
+            record[indice] = dict(vecchio, **operazione["campi"])
+        return indice, vecchio, record[indice]
+    if tipo == "elimina":
+        return indice, record.pop(indice), None
+    return None
+
+
+def _applica_righe_journal(record, contenuto, variazioni=None):
+    # Restituisce i byte consumati: una riga incompleta (scrittura in corso)
+    # viene lasciata per la lettura successiva.
+    fine = contenuto.rfind(b"\n") + 1
+    for riga in contenuto[:fine].splitlines():
+        if riga.strip():
+            variazione = _applica_operazione(record, carica_json(riga))
+            if variazioni is not None and variazione is not None:
+                variazioni.append(variazione)
+    return fine
+
+
+class JournalCollezione:
+    def __init__(self, snapshot, journal, compattazione, checkpoint, soglia, chiave="id"):
+        # chiave: campo che identifica un record nelle righe del journal
+        self.chiave = chiave
+        self.snapshot = snapshot
+        self.journal = journal
+        self.compattazione = compattazione
+        self.checkpoint = checkpoint
+        self.soglia = soglia
+        self.lock = threading.Lock()
+        self.lock_file = LockFile(journal + ".lock")
+        self.lock_compattazione = LockFile(compattazione + ".lock")
+        self.stato = {"base": None, "inode": None, "offset": 0, "record": [], "generazione": 0}
+        self.viste = []
+        self.compattazione_attiva = threading.Event()
+
+    def _leggi_snapshot(self):
+        inizio = time.perf_counter()
+        try:
+            with open(self.snapshot, "rb") as f:
+                contenuto = f.read()
+        except OSError:
+            return b""
+        _misura_io(self.snapshot, "lettura", len(contenuto), inizio)
+        return contenuto
+
+    def _compattazione_gia_applicata(self, snapshot):
+        # snapshot: i byte letti insieme allo stato da ricostruire
+        if not os.path.exists(self.checkpoint):
+            return False
+        try:
+            with open(self.checkpoint, "r", encoding="utf-8") as f:
+                return hashlib.sha1(snapshot).hexdigest() == json.load(f).get("sha1")
+        except (OSError, ValueError):
+            return False
+
+    def _aggiorna(self):
+        # Da chiamare con self.lock acquisito
+        while True:
+            base = (_firma_file(self.snapshot), _firma_file(self.compattazione))
+            try:
+                journal = open(self.journal, "rb")
+            except FileNotFoundError:
+                journal = None
+            try:
+                # Una compattazione di un altro processo tra le due stat: si riprova
+                if base != (_firma_file(self.snapshot), _firma_file(self.compattazione)):
+                    continue
+                return self._aggiorna_da(base, journal)
+            except FileNotFoundError:
+                continue
+            finally:
+                if journal is not None:
+                    journal.close()
+
+    def _aggiorna_da(self, base, journal):
+        stato = self.stato
+        generazione_iniziale = stato["generazione"]
+        variazioni = [] if self.viste else None
+        firma_journal = os.fstat(journal.fileno()) if journal is not None else None
+        inode = firma_journal.st_ino if firma_journal else None
+        dimensione = firma_journal.st_size if firma_journal else 0
+        if stato["inode"] is None and stato["offset"] == 0:
+            # Journal appena creato (o ruotato da compatta): si legge dall'inizio
+            stato["inode"] = inode
+        if stato["base"] != base or stato["inode"] != inode or dimensione < stato["offset"]:
+            # Lo snapshot può essere sostituito da una compattazione in corso: va
+            # letto una volta sola e confrontato col checkpoint sugli stessi byte.
+            snapshot = self._leggi_snapshot()
+            try:
+                record = decodifica(snapshot) if snapshot.strip() else []
+            except ValueError:
+                record = []
+            if base[1] is not None and not self._compattazione_gia_applicata(snapshot):
+                with open(self.compattazione, "rb") as f:
+                    _applica_righe_journal(record, f.read())
+            stato.update(base=base, inode=inode, offset=0, record=record)
+            stato["generazione"] += 1
+            # Le variazioni valgono solo per una vista allineata allo stato precedente
+            generazione_iniziale = None
+        if dimensione > stato["offset"]:
+            inizio = time.perf_counter()
+            journal.seek(stato["offset"])
+            contenuto = journal.read(dimensione - stato["offset"])
+            stato["offset"] += _applica_righe_journal(stato["record"], contenuto, variazioni)
+            stato["generazione"] += 1
+            _misura_io(self.journal, "lettura", len(contenuto), inizio)
+        for vista in self.viste:
+            with vista.lock:
+                if vista.generazione == stato["generazione"]:
+                    continue
+                if vista.generazione is not None and vista.generazione == generazione_iniziale:
+                    for posizione, vecchio, nuovo in variazioni:
+                        vista.applica_in(posizione, vecchio, nuovo)
+                else:
+                    vista.ricostruisci(stato["record"])
+                vista.generazione = stato["generazione"]
+        return dimensione
+
+    def sincronizza(self):
+        """Applica le nuove righe del journal (e quindi aggiorna le viste)."""
+        with self.lock:
+            self._aggiorna()
+
+    def aggiungi_vista(self, vista):
+        with self.lock:
+            self.viste.append(vista)
+
+    def leggi_con_generazione(self, copia=True):
+        # copia=False copia solo la lista (i record non vengono mai modificati
+        # sul posto): per chi scorre tutta la collezione fuori dal lock
+        with self.lock:
+            self._aggiorna()
+            record = self.stato["record"]
+            return (_copia_collezione(record) if copia else list(record)), self.stato["generazione"]
+
+    @contextmanager
+    def lettura(self):
+        """(record, generazione) aggiornati, sotto il lock.
+
+        La lista è quella viva: va solo letta e non va tenuta oltre il blocco.
+        Le ricerche copiano così solo i record trovati, non tutta la collezione.
+        """
+        with self.lock:
+            self._aggiorna()
+            yield self.stato["record"], self.stato["generazione"]
+
+    def leggi(self, copia=True):
+        return self.leggi_con_generazione(copia)[0]
+
+    def transazione(self, calcola):
+        attesa = time.perf_counter()
+        with self.lock_file, self.lock:
+            span_concluso("archivio.attesa_lock", attesa, time.perf_counter() - attesa,
+                          file=os.path.basename(self.journal))
+            self._aggiorna()
+            modifiche = _Modifiche(self.stato["record"], self.stato["generazione"], applica=False, chiave=self.chiave)
+            risultato = calcola(modifiche)
+            if modifiche.operazioni:
+                inizio = time.perf_counter()
+                righe = "".join(json.dumps(op, ensure_ascii=False) + "\n" for op in modifiche.operazioni)
+                righe = righe.encode("utf-8")
+                with open(self.journal, "ab") as f:
+                    f.write(righe)
+                    f.flush()
+                    os.fsync(f.fileno())
+                _misura_io(self.journal, "scrittura", len(righe), inizio)
+                incrementa_versione(self.snapshot)
+            dimensione = self._aggiorna()
+        if dimensione > self.soglia and not self.compattazione_attiva.is_set():
+            self.compattazione_attiva.set()
+            threading.Thread(target=self.compatta, daemon=True).start()
+        return risultato
+
+    def compatta(self):
+        if not self.lock_compattazione.acquisisci(blocca=False):
+            # Un altro processo sta già compattando
+            self.compattazione_attiva.clear()
+            return
+        try:
+            with self.lock_file, self.lock:
+                self._aggiorna()
+                if os.path.exists(self.compattazione):
+                    # Compattazione precedente interrotta
+                    if self._compattazione_gia_applicata(self._leggi_snapshot()):
+                        os.remove(self.compattazione)
+                    elif os.path.exists(self.journal):
+                        with open(self.journal, "rb") as src, open(self.compattazione, "ab") as dst:
+                            dst.write(src.read())
+                        os.remove(self.journal)
+                if os.path.exists(self.journal):
+                    os.replace(self.journal, self.compattazione)
+                if not os.path.exists(self.compattazione):
+                    return
+                # Lo stato in memoria non cambia: evita una ricostruzione inutile
+                self.stato.update(base=(_firma_file(self.snapshot), _firma_file(self.compattazione)),
+                                  inode=None, offset=0)
+                snapshot = list(self.stato["record"])
+            inizio = time.perf_counter()
+            contenuto = _codec[0].codifica(snapshot)
+            with open(self.checkpoint, "w", encoding="utf-8") as f:
+                json.dump({"sha1": hashlib.sha1(contenuto).hexdigest()}, f)
+            temporaneo = self.snapshot + ".tmp"
+            with open(temporaneo, "wb") as f:
+                f.write(contenuto)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temporaneo, self.snapshot)
+            _misura_io(self.snapshot, "compattazione", len(contenuto), inizio)
+            with self.lock_file, self.lock:
+                os.remove(self.compattazione)
+                os.remove(self.checkpoint)
+                if self.stato["base"][1] is not None:
+                    self.stato["base"] = (_firma_file(self.snapshot), None)
+        finally:
+            self.lock_compattazione.rilascia()
+            self.compattazione_attiva.clear()
+
+
+# ======== FILTRI ========
+# I filtri sono coppie campo=valore (uguaglianza) oppure campo__operatore=valore,
+# sia per il backend JSON sia per quello SQL.
+def _confronta(operatore, valore, atteso):
+    if operatore == "":
+        return valore == atteso
+    if operatore == "ne":
+        return valore != atteso
+    if operatore == "in":
+        return valore in atteso
+    if valore is None:
+        return False
+    try:
+        if operatore == "lt":
+            return valore < atteso
+        if operatore == "lte":
+            return valore <= atteso
+        if operatore == "gt":
+            return valore > atteso
+        if operatore == "gte":
+            return valore >= atteso
+    except TypeError:
+        return False
+    raise ValueError(f"Operatore di filtro sconosciuto: {operatore}")
+
+
+def corrisponde(record, filtri):
+    for chiave, atteso in filtri.items():
+        campo, _, operatore = chiave.partition("__")
+        if not _confronta(operatore, record.get(campo), atteso):
+            return False
+    return True
+
+
+# ======== ORDINAMENTO E PAGINE ========
+# pagina() restituisce i record in ordine stabile (campi di `ordine`, poi
+# posizione/chiave primaria) a partire da un cursore: la chiave dell'ultimo
+# record della pagina precedente. Il cursore è una lista serializzabile in JSON.
+def _ordinabile(valore):
+    # Valori mancanti o di tipo diverso non sono confrontabili tra loro
+    if valore is None:
+        return (0, 0)
+    if isinstance(valore, (int, float)):
+        return (1, valore)
+    return (2, str(valore))
+
+
+def _chiave_da_cursore(cursore, campi):
+    if not isinstance(cursore, list) or len(cursore) != campi + 1:
+        raise ValueError("Cursore non valido")
+    chiave = []
+    for valore in cursore[:-1]:
+        if not isinstance(valore, list) or len(valore) != 2 or valore[0] not in (0, 1, 2):
+            raise ValueError("Cursore non valido")
+        tipo = {0: int, 1: (int, float), 2: str}[valore[0]]
+        if not isinstance(valore[1], tipo):
+            raise ValueError("Cursore non valido")
+        chiave.append(tuple(valore))
+    if not isinstance(cursore[-1], int):
+        raise ValueError("Cursore non valido")
+    return tuple(chiave) + (cursore[-1],)
+
+
+# ======== ASCOLTATORI ========
+# Funzioni chiamate dopo ogni scrittura andata a buon fine con (collezione,
+# record toccati): i record nuovi o modificati, oppure quelli eliminati.
+class _Ascoltabile:
+    def aggiungi_ascoltatore(self, funzione):
+        self.ascoltatori.append(funzione)
+
+    def _avvisa(self, nome, record):
+        if not record:
+            return
+        for funzione in self.ascoltatori:
+            try:
+                funzione(nome, record)
+            except Exception as e:
+                print(f"❌ Errore ascoltatore {nome}: {e}")
+
+
+# ======== BACKEND JSON ========
+class ArchivioJSON(_Ascoltabile):
+    """Collezioni salvate come liste in file JSON (o snapshot + journal).
+
+    Le ricerche per uguaglianza usano indici hash campo -> posizioni, costruiti
+    alla prima richiesta e validi finché la collezione in cache non cambia;
+    quelli registrati con aggiungi_indice (es. sull'id) seguono invece le
+    scritture una per una. Le collezioni in `con_id` ricevono un id dal
+    contatore a ogni inserimento. Le scritture sono transazioni
+    leggi-modifica-scrivi sotto LockFile, quindi sicure anche con più worker e
+    più thread.
+    """
+
+    def __init__(self, percorsi, journal=None, con_id=()):
+        self.percorsi = percorsi
+        self.journal = journal or {}
+        self.con_id = set(con_id)
+        self._lock = {nome: LockFile(path + ".lock") for nome, path in percorsi.items()}
+        self._viste = {nome: [] for nome in percorsi}
+        self._indici = {}
+        self._indici_lock = threading.Lock()
+        self._indici_aggiornati = {}
+        self.ascoltatori = []
+
+    def inizializza(self):
+        for nome, path in self.percorsi.items():
+            if nome in self.journal:
+                continue
+            with self._lock[nome]:
+                if not os.path.exists(path):
+                    scrivi_json(path, [])
+
+    def _leggi(self, nome, copia=True):
+        if nome in self.journal:
+            return self.journal[nome].leggi_con_generazione(copia)
+        return leggi_json_con_generazione(self.percorsi[nome], copia)
+
+    @contextmanager
+    def _lettura(self, nome):
+        # (record, generazione) senza copie, da usare solo dentro il blocco:
+        # per i file JSON l'oggetto in cache (sostituito, mai modificato, a
+        # ogni scrittura), per i journal la lista viva sotto il loro lock
+        if nome in self.journal:
+            with self.journal[nome].lettura() as letto:
+                yield letto
+        else:
+            yield leggi_json_con_generazione(self.percorsi[nome], copia=False)
+
+    def _indice(self, nome, campo, record, generazione):
+        chiave = (nome, campo)
+        with self._indici_lock:
+            voce = self._indici.get(chiave)
+            if voce is not None and voce[0] == generazione:
+                return voce[1]
+        indice = {}
+        with span("indice.costruzione", collezione=nome, campo=campo, record=len(record)):
+            for posizione, r in enumerate(record):
+                try:
+                    indice.setdefault(r.get(campo), []).append(posizione)
+                except TypeError:
+                    pass
+        with self._indici_lock:
+            self._indici[chiave] = (generazione, indice)
+        return indice
+
+    def _coda_cursore(self, nome, r, posizione):
+        # Ultimo elemento della chiave di paginazione: l'id per le collezioni
+        # che lo hanno (non cambia quando si eliminano i record precedenti),
+        # altrimenti la posizione
+        if nome in self.con_id:
+            return (r.get("id") if type(r.get("id")) is int else 0, posizione)
+        return (posizione,)
+
+    def _indice_ordinato(self, nome, ordine, gruppo, record, generazione):
+        # Chiavi (campi di ordine..., [id,] posizione) ordinate, divise per valore di `gruppo`
+        chiave = (nome, ordine, gruppo)
+        with self._indici_lock:
+            voce = self._indici.get(chiave)
+            if voce is not None and voce[0] == generazione:
+                return voce[1]
+        gruppi = {}
+        with span("indice.costruzione", collezione=nome, ordine=list(ordine), gruppo=gruppo, record=len(record)):
+            for posizione, r in enumerate(record):
+                try:
+                    lista = gruppi.setdefault(r.get(gruppo) if gruppo else None, [])
+                except TypeError:
+                    continue
+                lista.append(tuple(_ordinabile(r.get(c)) for c in ordine) + self._coda_cursore(nome, r, posizione))
+            for lista in gruppi.values():
+                lista.sort()
+        with self._indici_lock:
+            self._indici[chiave] = (generazione, gruppi)
+        return gruppi
+
+    def _da_indice_aggiornato(self, nome, indice, record, generazione, valore):
+        # None se l'indice non è allineato a questa lettura della collezione
+        with indice.lock:
+            if indice.generazione != generazione:
+                if nome in self.journal:
+                    # Lo aggiorna il journal: un'altra scrittura è già passata
+                    return None
+                indice.ricostruisci(record)
+                indice.generazione = generazione
+            return indice.risultato(valore)
+
+    def _posizioni(self, nome, record, generazione, filtri):
+        uguaglianze = [k for k in filtri if "__" not in k]
+        campo = uguaglianze[0] if uguaglianze else None
+        # Senza uguaglianze (campo None) si scorre tutta la collezione
+        with span("indice.ricerca", collezione=nome, campo=campo):
+            candidati = range(len(record))
+            if campo is not None:
+                try:
+                    indice = self._indici_aggiornati.get((nome, campo))
+                    posizioni = None
+                    if indice is not None:
+                        posizioni = self._da_indice_aggiornato(nome, indice, record, generazione, filtri[campo])
+                    if posizioni is None:
+                        posizioni = self._indice(nome, campo, record, generazione).get(filtri[campo], [])
+                    candidati = posizioni
+                except TypeError:
+                    pass
+            return [p for p in candidati if corrisponde(record[p], filtri)]
+
+    def _transazione(self, nome, calcola):
+        if nome in self.journal:
+            return self.journal[nome].transazione(calcola)
+        attesa = time.perf_counter()
+        with self._lock[nome]:
+            span_concluso("archivio.attesa_lock", attesa, time.perf_counter() - attesa,
+                          file=os.path.basename(self.percorsi[nome]))
+            record, generazione = leggi_json_con_generazione(self.percorsi[nome])
+            modifiche = _Modifiche(record, generazione)
+            risultato = calcola(modifiche)
+            if modifiche.operazioni:
+                nuova_generazione = scrivi_json(self.percorsi[nome], modifiche.record)
+                incrementa_versione(self.percorsi[nome])
+                for vista in self._viste[nome]:
+                    with vista.lock:
+                        if vista.generazione == generazione:
+                            for posizione, vecchio, nuovo in modifiche.variazioni:
+                                vista.applica_in(posizione, vecchio, nuovo)
+                            vista.generazione = nuova_generazione
+            return risultato
+
+    def _seleziona(self, nome, modifiche, indice, filtri):
+        if indice is not None:
+            return [indice] if 0 <= indice < len(modifiche.record) else []
+        return self._posizioni(nome, modifiche.record, modifiche.generazione, filtri)
+
+    # ---- letture ----
+    @tracciato("archivio.versione")
+    def versione(self, nome):
+        if nome in self.journal:
+            return leggi_versione(self.journal[nome].snapshot)
+        return leggi_versione(self.percorsi[nome])
+
+    @tracciato("archivio.tutti")
+    def tutti(self, nome, copia=True):
+        return self._leggi(nome, copia)[0]
+
+    @tracciato("archivio.cerca")
+    def cerca(self, nome, copia=True, **filtri):
+        with self._lettura(nome) as (record, generazione):
+            trovati = [record[p] for p in self._posizioni(nome, record, generazione, filtri)]
+        return _copia_collezione(trovati) if copia else trovati
+
+    @tracciato("archivio.trova")
+    def trova(self, nome, **filtri):
+        with self._lettura(nome) as (record, generazione):
+            posizioni = self._posizioni(nome, record, generazione, filtri)
+            return dict(record[posizioni[0]]) if posizioni else None
+
+    @tracciato("archivio.conta")
+    def conta(self, nome, **filtri):
+        with self._lettura(nome) as (record, generazione):
+            if not filtri:
+                return len(record)
+            return len(self._posizioni(nome, record, generazione, filtri))
+
+    @tracciato("archivio.conta_per")
+    def conta_per(self, nome, campo, *altri):
+        """{valore: numero di record}; con più campi le chiavi sono tuple di valori."""
+        if altri:
+            campi = (campo,) + altri
+            conteggi = {}
+            with self._lettura(nome) as (record, _):
+                for r in record:
+                    chiave = tuple(r.get(c) for c in campi)
+                    try:
+                        conteggi[chiave] = conteggi.get(chiave, 0) + 1
+                    except TypeError:
+                        pass
+            return conteggi
+        with self._lettura(nome) as (record, generazione):
+            indice = self._indice(nome, campo, record, generazione)
+        return {valore: len(posizioni) for valore, posizioni in indice.items()}
+
+    @tracciato("archivio.in_posizione")
+    def in_posizione(self, nome, indice):
+        with self._lettura(nome) as (record, _):
+            return dict(record[indice]) if 0 <= indice < len(record) else None
+
+    @tracciato("archivio.pagina")
+    def pagina(self, nome, limite, cursore=None, ordine=(), discendente=False, con_posizioni=False, **filtri):
+        """Restituisce ([(posizione, record), ...], cursore della pagina successiva).
+
+        limite=None restituisce tutti i record nell'ordine richiesto; il
+        cursore successivo è None quando non ci sono altri record. A parità
+        di `ordine` decide l'id (se la collezione lo ha), così una pagina non
+        salta record quando se ne eliminano di precedenti. La posizione è
+        None se non si chiede con_posizioni.
+        """
+        if limite is not None and limite < 1:
+            return [], None
+        with self._lettura(nome) as (record, generazione):
+            ordine = tuple(ordine)
+            gruppo = next((k for k in filtri if "__" not in k), None)
+            chiavi = None
+            if not ordine and (nome, gruppo) in self._indici_aggiornati:
+                # In ordine di inserimento bastano le posizioni dell'indice aggiornato
+                try:
+                    posizioni = self._da_indice_aggiornato(
+                        nome, self._indici_aggiornati[(nome, gruppo)], record, generazione, filtri[gruppo])
+                except TypeError:
+                    posizioni = None
+                if posizioni is not None:
+                    chiavi = sorted(self._coda_cursore(nome, record[p], p) for p in posizioni)
+            if chiavi is None:
+                try:
+                    chiavi = self._indice_ordinato(nome, ordine, gruppo, record, generazione).get(
+                        filtri[gruppo] if gruppo else None, [])
+                except TypeError:
+                    chiavi = self._indice_ordinato(nome, ordine, None, record, generazione).get(None, [])
+            if cursore is None:
+                inizio = len(chiavi) if discendente else 0
+            else:
+                dopo = _chiave_da_cursore(cursore, len(ordine))
+                if nome in self.con_id:
+                    # Le chiavi hanno anche la posizione: si salta ogni chiave con questo id
+                    inizio = bisect.bisect_left(chiavi, dopo) if discendente else \
+                        bisect.bisect_right(chiavi, dopo + (float("inf"),))
+                else:
+                    inizio = bisect.bisect_left(chiavi, dopo) if discendente else bisect.bisect_right(chiavi, dopo)
+            sequenza = range(inizio - 1, -1, -1) if discendente else range(inizio, len(chiavi))
+            voci = []
+            for i in sequenza:
+                posizione = chiavi[i][-1]
+                if not corrisponde(record[posizione], filtri):
+                    continue
+                if limite is not None and len(voci) == limite:
+                    return voci, [list(v) for v in ultima[:len(ordine)]] + [ultima[len(ordine)]]
+                voci.append((posizione if con_posizioni else None, dict(record[posizione])))
+                ultima = chiavi[i]
+            return voci, None
+
+    def scorri(self, nome, **filtri):
+        """Generatore dei record selezionati, senza copiare la collezione (per le esportazioni)."""
+        record, generazione = self._leggi(nome, copia=False)
+        posizioni = self._posizioni(nome, record, generazione, filtri) if filtri else range(len(record))
+        for posizione in posizioni:
+            yield record[posizione]
+
+    # ---- id ----
+    @tracciato("archivio.nuovo_id")
+    def nuovo_id(self, nome):
+        """Prossimo id della collezione, unico anche tra più worker."""
+        lock = self.journal[nome].lock_file if nome in self.journal else self._lock[nome]
+        with lock:
+            return alloca_id(self.percorsi[nome], self._leggi(nome, copia=False)[0])
+
+    @tracciato("archivio.assegna_id")
+    def assegna_id(self, nome):
+        """Dà un id nuovo ai record senza id o con l'id di un record precedente.
+
+        Restituisce quanti record sono stati rinumerati.
+        """
+        if not _da_rinumerare(self._leggi(nome, copia=False)[0]):
+            return 0
+
+        def calcola(modifiche):
+            posizioni = _da_rinumerare(modifiche.record)
+            for posizione in posizioni:
+                record = dict(modifiche.record[posizione])
+                record["id"] = alloca_id(self.percorsi[nome], modifiche.record)
+                modifiche.sostituisci(posizione, record)
+            return len(posizioni)
+        return self._transazione(nome, calcola)
+
+    def aggiungi_indice(self, nome, campo):
+        """Indice campo -> posizioni aggiornato a ogni scrittura invece che ricostruito."""
+        indice = IndicePerCampo(campo)
+        self._indici_aggiornati[(nome, campo)] = indice
+        self.aggiungi_vista(nome, indice)
+
+    # ---- viste ----
+    def aggiungi_vista(self, nome, vista):
+        if nome in self.journal:
+            self.journal[nome].aggiungi_vista(vista)
+        else:
+            self._viste[nome].append(vista)
+
+    @tracciato("archivio.leggi_vista")
+    def leggi_vista(self, nome, vista, *argomenti):
+        if nome in self.journal:
+            self.journal[nome].sincronizza()
+            with vista.lock:
+                return vista.risultato(*argomenti)
+        with vista.lock:
+            record, generazione = leggi_json_con_generazione(self.percorsi[nome], copia=False)
+            if vista.generazione != generazione:
+                with span("vista.ricostruzione", collezione=nome, vista=type(vista).__name__):
+                    vista.ricostruisci(record)
+                vista.generazione = generazione
+            return vista.risultato(*argomenti)
+
+    # ---- scritture ----
+    @tracciato("archivio.inserisci")
+    def inserisci(self, nome, record):
+        """Aggiunge un record; nelle collezioni con id l'id è sempre del contatore.
+
+        Un id già presente nel record (es. mandato dal client) viene
+        sostituito: solo inserisci_molti tiene quelli esistenti.
+        """
+        def calcola(modifiche):
+            if nome in self.con_id:
+                record["id"] = alloca_id(self.percorsi[nome], modifiche.record)
+            modifiche.aggiungi(record)
+        self._transazione(nome, calcola)
+        self._avvisa(nome, [record])
+        return record
+
+    @tracciato("archivio.inserisci_molti")
+    def inserisci_molti(self, nome, record):
+        """Inserisce una lista di record con una sola transazione.
+
+        Una sola riscrittura del file (o un'unica append al journal) e un solo
+        avviso agli ascoltatori; gli id mancanti sono riservati in blocco,
+        quelli presenti restano (importazioni e migrazioni di dati con id).
+        """
+        def calcola(modifiche):
+            senza_id = [r for r in record if r.get("id") is None] if nome in self.con_id else []
+            presenti = id_massimo(record) if nome in self.con_id else 0
+            if senza_id or presenti:
+                primo = alloca_id(self.percorsi[nome], modifiche.record, len(senza_id), presenti)
+                for i, r in enumerate(senza_id):
+                    r["id"] = primo + i
+            for r in record:
+                modifiche.aggiungi(r)
+        if record:
+            self._transazione(nome, calcola)
+            self._avvisa(nome, record)
+        return record
+
+    @tracciato("archivio.modifica")
+    def modifica(self, nome, funzione, indice=None, **filtri):
+        """Applica funzione(record) al primo record selezionato e lo salva.
+
+        Restituisce il record aggiornato, None se non esiste.
+        """
+        def calcola(modifiche):
+            posizioni = self._seleziona(nome, modifiche, indice, filtri)
+            if not posizioni:
+                return None
+            record = copy.deepcopy(modifiche.record[posizioni[0]])
+            funzione(record)
+            modifiche.sostituisci(posizioni[0], record)
+            return record
+        record = self._transazione(nome, calcola)
+        if record is not None:
+            self._avvisa(nome, [record])
+        return record
+
+    @tracciato("archivio.modifica_tutti")
+    def modifica_tutti(self, nome, funzione, **filtri):
+        def calcola(modifiche):
+            modificati = []
+            for posizione in self._seleziona(nome, modifiche, None, filtri):
+                record = copy.deepcopy(modifiche.record[posizione])
+                funzione(record)
+                modifiche.sostituisci(posizione, record)
+                modificati.append(record)
+            return modificati
+        modificati = self._transazione(nome, calcola)
+        self._avvisa(nome, modificati)
+        return len(modificati)
+
+    @tracciato("archivio.elimina")
+    def elimina(self, nome, indice=None, **filtri):
+        def calcola(modifiche):
+            posizioni = self._seleziona(nome, modifiche, indice, filtri)
+            eliminati = [modifiche.record[p] for p in posizioni]
+            # In ordine decrescente le posizioni restanti non scorrono
+            for posizione in sorted(posizioni, reverse=True):
+                modifiche.rimuovi(posizione)
+            return eliminati
+        eliminati = self._transazione(nome, calcola)
+        self._avvisa(nome, eliminati)
+        return len(eliminati)
+
+
+# ======== MODELLI SQLALCHEMY ========
+class _Collezione:
+    """Colonne comuni e conversione riga <-> record (dict).
+
+    I campi senza una colonna dedicata finiscono in `extra`, così i record
+    arbitrari (es. professori aggiornati con request.json) non perdono dati.
+    """
+    pk = db.Column(db.Integer, primary_key=True)
+    extra = db.Column(db.JSON)
+
+    @classmethod
+    def campi(cls):
+        return [c.name for c in cls.__table__.columns if c.name not in ("pk", "extra")]
+
+    @classmethod
+    def da_record(cls, record):
+        riga = cls()
+        riga.aggiorna_da(record)
+        return riga
+
+    def aggiorna_da(self, record):
+        campi = self.campi()
+        for campo in campi:
+            setattr(self, campo, record.get(campo))
+            if isinstance(self.__table__.columns[campo].type, db.JSON):
+                flag_modified(self, campo)
+        self.extra = {k: v for k, v in record.items() if k not in campi} or None
+
+    def a_record(self):
+        record = {}
+        for campo in self.campi():
+            valore = getattr(self, campo)
+            if valore is not None:
+                record[campo] = copy.deepcopy(valore) if isinstance(valore, (list, dict)) else valore
+        if self.extra:
+            record.update(copy.deepcopy(self.extra))
+        return record
+
+
+class Utente(_Collezione, db.Model):
+    __tablename__ = "utenti"
+    id = db.Column(db.Integer, index=True)
+    username = db.Column(db.String(80), index=True)
+    password = db.Column(db.String(200))
+    email = db.Column(db.String(200), index=True)
+    nome_cognome = db.Column(db.String(200))
+    scuola = db.Column(db.String(200), index=True)
+    role = db.Column(db.String(20), index=True)
+    stato = db.Column(db.String(20))
+    account_status = db.Column(db.String(20))
+    created_at = db.Column(db.String(19))
+    telefono = db.Column(db.String(40))
+    data_nascita = db.Column(db.String(20))
+    indirizzo = db.Column(db.String(200))
+    citta = db.Column(db.String(100))
+    cap = db.Column(db.String(10))
+    admin_note = db.Column(db.Text)
+
+
+class Voto(_Collezione, db.Model):
+    __tablename__ = "voti"
+    id = db.Column(db.Integer, index=True)
+    user = db.Column(db.String(80), index=True)
+    nomeProf = db.Column(db.String(200), index=True)
+    materia = db.Column(db.String(200), index=True)
+    scuola = db.Column(db.String(200), index=True)
+    voto = db.Column(db.JSON)
+    timestamp = db.Column(db.String(19))
+
+
+class Recensione(_Collezione, db.Model):
+    __tablename__ = "recensioni"
+    id = db.Column(db.Integer, index=True)
+    user = db.Column(db.String(80), index=True)
+    nomeProfRec = db.Column(db.String(200), index=True)
+    scuola = db.Column(db.String(200), index=True)
+    recensione = db.Column(db.Text)
+    timestamp = db.Column(db.String(19))
+    # Reazioni e commenti ora stanno in Reazione e Commento: queste colonne
+    # servono solo a migrarli
+    likes = db.Column(db.Integer)
+    dislikes = db.Column(db.Integer)
+    user_likes = db.Column(db.JSON)
+    user_dislikes = db.Column(db.JSON)
+    commenti = db.Column(db.JSON)
+
+
+class Professore(_Collezione, db.Model):
+    __tablename__ = "professori"
+    id = db.Column(db.Integer, index=True)
+    nome = db.Column(db.String(200), index=True)
+    materia = db.Column(db.String(200), index=True)
+    scuola = db.Column(db.String(200), index=True)
+
+
+class Sessione(_Collezione, db.Model):
+    __tablename__ = "sessioni"
+    id = db.Column(db.Integer, index=True)
+    session_id = db.Column(db.String(64), index=True)
+    username = db.Column(db.String(80), index=True)
+    ip = db.Column(db.String(64))
+    login_time = db.Column(db.String(19))
+    last_activity = db.Column(db.String(19), index=True)
+    user_agent = db.Column(db.String(200))
+
+
+class Segnalazione(_Collezione, db.Model):
+    __tablename__ = "segnalazioni"
+    id = db.Column(db.Integer, index=True)
+    tipo = db.Column(db.String(40))
+    indice = db.Column(db.JSON)
+    motivo = db.Column(db.Text)
+    segnalatore = db.Column(db.String(80), index=True)
+    data = db.Column(db.String(19))
+    stato = db.Column(db.String(20))
+    admin_note = db.Column(db.Text)
+    data_chiusura = db.Column(db.String(19))
+
+
+class Registrazione(_Collezione, db.Model):
+    __tablename__ = "registrazioni"
+    id = db.Column(db.Integer, index=True)
+    username = db.Column(db.String(80), index=True)
+    password = db.Column(db.String(200))
+    email = db.Column(db.String(200))
+    nome_cognome = db.Column(db.String(200))
+    scuola = db.Column(db.String(200), index=True)
+    data_registrazione = db.Column(db.String(19))
+    stato = db.Column(db.String(20))
+    admin_note = db.Column(db.Text)
+    data_approvazione = db.Column(db.String(19))
+
+
+class Avviso(_Collezione, db.Model):
+    __tablename__ = "avvisi"
+    id = db.Column(db.Integer, index=True)
+    titolo = db.Column(db.String(200))
+    messaggio = db.Column(db.Text)
+    priorita = db.Column(db.String(20))
+    attivo = db.Column(db.Boolean)
+    data = db.Column(db.String(19))
+
+
+class Ticket(_Collezione, db.Model):
+    __tablename__ = "ticket"
+    id = db.Column(db.Integer, index=True)
+    utente = db.Column(db.String(80), index=True)
+    oggetto = db.Column(db.String(200))
+    messaggio = db.Column(db.Text)
+    priorita = db.Column(db.String(20))
+    stato = db.Column(db.String(20))
+    data_apertura = db.Column(db.String(19))
+    data_chiusura = db.Column(db.String(19))
+    admin_assegnato = db.Column(db.String(80))
+    risposte = db.Column(db.JSON)
+
+
+class Notifica(_Collezione, db.Model):
+    __tablename__ = "notifiche"
+    id = db.Column(db.Integer, index=True)
+    utente = db.Column(db.String(80), index=True)
+    tipo = db.Column(db.String(40))
+    titolo = db.Column(db.String(200))
+    messaggio = db.Column(db.Text)
+    link = db.Column(db.String(200))
+    letta = db.Column(db.Boolean)
+    data = db.Column(db.String(19), index=True)
+    data_lettura = db.Column(db.String(19))
+
+
+class Recupero(_Collezione, db.Model):
+    __tablename__ = "recupero_password"
+    id = db.Column(db.Integer, index=True)
+    username = db.Column(db.String(80), index=True)
+    codice = db.Column(db.String(10))
+    data_richiesta = db.Column(db.String(19))
+    usato = db.Column(db.Boolean)
+
+
+class Email(_Collezione, db.Model):
+    __tablename__ = "email"
+    id = db.Column(db.Integer, index=True)
+    destinatario = db.Column(db.String(200))
+    oggetto = db.Column(db.String(300))
+    html = db.Column(db.Text)
+    stato = db.Column(db.String(20), index=True)
+    tentativi = db.Column(db.Integer)
+    prossimo_tentativo = db.Column(db.Float, index=True)
+    errore = db.Column(db.Text)
+    data = db.Column(db.String(19))
+
+
+class Commento(_Collezione, db.Model):
+    __tablename__ = "commenti"
+    id = db.Column(db.Integer, index=True)
+    recensione_id = db.Column(db.Integer, index=True)
+    utente = db.Column(db.String(80))
+    ruolo = db.Column(db.String(20))
+    testo = db.Column(db.Text)
+    data = db.Column(db.String(19))
+
+
+class Reazione(_Collezione, db.Model):
+    __tablename__ = "reazioni"
+    chiave = db.Column(db.String(300), index=True)
+    elemento = db.Column(db.String(120), index=True)
+    utente = db.Column(db.String(80))
+    azione = db.Column(db.String(10))
+
+
+class VersioneCollezione(db.Model):
+    """Contatore di versione per collezione, aggiornato nella stessa transazione dei dati."""
+    __tablename__ = "versioni_collezioni"
+    nome = db.Column(db.String(50), primary_key=True)
+    versione = db.Column(db.Integer, nullable=False, default=0)
+
+
+class ContatoreId(db.Model):
+    """Ultimo id assegnato per collezione (vedi ArchivioSQL.nuovo_id)."""
+    __tablename__ = "contatori_id"
+    nome = db.Column(db.String(50), primary_key=True)
+    ultimo = db.Column(db.Integer, nullable=False, default=0)
+
+
+MODELLI = {
+    "utenti": Utente,
+    "voti": Voto,
+    "recensioni": Recensione,
+    "professori": Professore,
+    "sessioni": Sessione,
+    "segnalazioni": Segnalazione,
+    "registrazioni": Registrazione,
+    "avvisi": Avviso,
+    "ticket": Ticket,
+    "notifiche": Notifica,
+    "recupero": Recupero,
+    "email": Email,
+    "commenti": Commento,
+    "reazioni": Reazione,
+}
+
+
+# ======== BACKEND SQL ========
+_OPERATORI_SQL = {
+    "": lambda c, v: c == v,
+    "ne": lambda c, v: c != v,
+    "lt": lambda c, v: c < v,
+    "lte": lambda c, v: c <= v,
+    "gt": lambda c, v: c > v,
+    "gte": lambda c, v: c >= v,
+    "in": lambda c, v: c.in_(list(v)),
+}
+
+
+def _controlla_cursore_sql(cursore, colonne):
+    # Il cursore arriva dal client: un valore per colonna, del tipo della
+    # colonna (None solo nei campi di ordine, la chiave primaria è un intero)
+    if not isinstance(cursore, list) or len(cursore) != len(colonne):
+        raise ValueError("Cursore non valido")
+    for i, (colonna, valore) in enumerate(zip(colonne, cursore)):
+        if valore is None and i < len(colonne) - 1:
+            continue
+        try:
+            tipo = colonna.type.python_type
+        except NotImplementedError:
+            tipo = object
+        if tipo is float:
+            tipo = (int, float)
+        if isinstance(valore, (bool, list, dict)) or not isinstance(valore, tipo):
+            raise ValueError("Cursore non valido")
+
+
+def _insert_se_manca(modello):
+    # INSERT ... ON CONFLICT DO NOTHING: stessa sintassi nei due database supportati
+    dialetto = postgresql if db.session.get_bind().dialect.name == "postgresql" else sqlite
+    return dialetto.insert(modello)
+
+
+class ArchivioSQL(_Ascoltabile):
+    """Stessa interfaccia di ArchivioJSON sulle tabelle SQLAlchemy.
+
+    I filtri sulle colonne indicizzate diventano clausole WHERE; quelli su campi
+    senza colonna (salvati in `extra`) vengono applicati in Python.
+    """
+
+    def __init__(self, modelli=MODELLI, con_id=()):
+        self.modelli = modelli
+        self.con_id = set(con_id)
+        self.ascoltatori = []
+
+    def inizializza(self):
+        db.create_all()
+        presenti = {v.nome for v in VersioneCollezione.query}
+        db.session.add_all(VersioneCollezione(nome=nome, versione=0) for nome in self.modelli if nome not in presenti)
+        db.session.commit()
+
+    @tracciato("archivio.versione")
+    def versione(self, nome):
+        return db.session.execute(
+            select(VersioneCollezione.versione).where(VersioneCollezione.nome == nome)
+        ).scalar() or 0
+
+    def _incrementa_versione(self, nome):
+        # Nella transazione della scrittura: il commit rende visibili insieme dati e versione
+        aggiornate = db.session.execute(
+            update(VersioneCollezione).where(VersioneCollezione.nome == nome)
+            .values(versione=VersioneCollezione.versione + 1)
+        ).rowcount
+        if not aggiornate:
+            db.session.add(VersioneCollezione(nome=nome, versione=1))
+
+    def _query(self, nome, filtri):
+        modello = self.modelli[nome]
+        query = modello.query
+        residui = {}
+        for chiave, valore in filtri.items():
+            campo, _, operatore = chiave.partition("__")
+            if campo in ("pk", "extra") or campo not in modello.__table__.columns:
+                residui[chiave] = valore
+                continue
+            query = query.filter(_OPERATORI_SQL[operatore](getattr(modello, campo), valore))
+        return query.order_by(modello.pk), residui
+
+    def _righe(self, nome, filtri, per_modifica=False):
+        query, residui = self._query(nome, filtri)
+        if per_modifica:
+            query = query.with_for_update()
+        if not residui:
+            return query.all()
+        return [r for r in query.all() if corrisponde(r.a_record(), residui)]
+
+    def _riga(self, nome, indice, filtri, per_modifica=False):
+        if indice is not None:
+            if indice < 0:
+                return None
+            query, residui = self._query(nome, {})
+            query = query.offset(indice)
+        else:
+            query, residui = self._query(nome, filtri)
+        if per_modifica:
+            # SELECT ... FOR UPDATE dove il database lo supporta (SQLite lo ignora)
+            query = query.with_for_update()
+        if not residui:
+            return query.first()
+        return next((r for r in query if corrisponde(r.a_record(), residui)), None)
+
+    # ---- letture ----
+    @tracciato("archivio.tutti")
+    def tutti(self, nome, copia=True):
+        modello = self.modelli[nome]
+        return [r.a_record() for r in modello.query.order_by(modello.pk)]
+
+    @tracciato("archivio.cerca")
+    def cerca(self, nome, copia=True, **filtri):
+        return [r.a_record() for r in self._righe(nome, filtri)]
+
+    @tracciato("archivio.trova")
+    def trova(self, nome, **filtri):
+        riga = self._riga(nome, None, filtri)
+        return riga.a_record() if riga else None
+
+    @tracciato("archivio.conta")
+    def conta(self, nome, **filtri):
+        query, residui = self._query(nome, filtri)
+        if not residui:
+            return query.order_by(None).count()
+        return len(self._righe(nome, filtri))
+
+    @tracciato("archivio.conta_per")
+    def conta_per(self, nome, campo, *altri):
+        modello = self.modelli[nome]
+        colonne, json_in = [], []
+        for i, c in enumerate((campo,) + altri):
+            colonna = getattr(modello, c)
+            if isinstance(colonna.type, db.JSON):
+                # PostgreSQL non raggruppa le colonne json: si passa dal testo
+                colonna = cast(colonna, db.Text)
+                json_in.append(i)
+            colonne.append(colonna)
+        conteggi = {}
+        for *chiave, quanti in db.session.query(*colonne, func.count(modello.pk)).group_by(*colonne):
+            for i in json_in:
+                chiave[i] = carica_json(chiave[i]) if chiave[i] is not None else None
+            conteggi[tuple(chiave) if altri else chiave[0]] = quanti
+        return conteggi
+
+    @tracciato("archivio.in_posizione")
+    def in_posizione(self, nome, indice):
+        riga = self._riga(nome, indice, {})
+        return riga.a_record() if riga else None
+
+    def _posizioni(self, nome, righe):
+        # Posizione in ordine di inserimento di ogni riga, con una sola query
+        modello = self.modelli[nome]
+        numerate = select(modello.pk, (func.row_number().over(order_by=modello.pk) - 1).label("posizione")).subquery()
+        query = select(numerate.c.pk, numerate.c.posizione).where(numerate.c.pk.in_([r.pk for r in righe]))
+        return dict(db.session.execute(query).all())
+
+    @tracciato("archivio.pagina")
+    def pagina(self, nome, limite, cursore=None, ordine=(), discendente=False, con_posizioni=False, **filtri):
+        if limite is not None and limite < 1:
+            return [], None
+        modello = self.modelli[nome]
+        colonne = [getattr(modello, c) for c in ordine] + [modello.pk]
+        query, residui = self._query(nome, filtri)
+        if cursore is not None:
+            _controlla_cursore_sql(cursore, colonne)
+            chiave, dopo = tuple_(*colonne), tuple_(*cursore)
+            query = query.filter(chiave < dopo if discendente else chiave > dopo)
+        query = query.order_by(None).order_by(*(c.desc() if discendente else c.asc() for c in colonne))
+        if limite is not None and not residui:
+            query = query.limit(limite + 1)
+        righe = []
+        for riga in query:
+            if residui and not corrisponde(riga.a_record(), residui):
+                continue
+            righe.append(riga)
+            if limite is not None and len(righe) > limite:
+                break
+        prossimo = None
+        if limite is not None and len(righe) > limite:
+            righe = righe[:limite]
+            prossimo = [getattr(righe[-1], c) for c in ordine] + [righe[-1].pk]
+        posizioni = self._posizioni(nome, righe) if con_posizioni and righe else {}
+        return [(posizioni.get(r.pk), r.a_record()) for r in righe], prossimo
+
+    def scorri(self, nome, blocco=500, **filtri):
+        """Generatore dei record selezionati, letti dal database `blocco` righe alla volta."""
+        query, residui = self._query(nome, filtri)
+        for riga in query.yield_per(blocco):
+            record = riga.a_record()
+            if not residui or corrisponde(record, residui):
+                yield record
+
+    # ---- id ----
+    def _alloca_id(self, nome, quanti=1, oltre=0):
+        # UPDATE ... RETURNING è atomico: niente SELECT max(id) concorrenti.
+        # L'id fa parte della transazione di chi lo chiede. Riserva `quanti`
+        # id consecutivi dopo `oltre` e restituisce il primo.
+        while True:
+            base = case((ContatoreId.ultimo < oltre, oltre), else_=ContatoreId.ultimo)
+            ultimo = db.session.execute(
+                update(ContatoreId).where(ContatoreId.nome == nome)
+                .values(ultimo=base + quanti).returning(ContatoreId.ultimo)
+            ).scalar()
+            if ultimo is not None:
+                return ultimo - quanti + 1
+            # Primo id: il contatore parte dal massimo già presente. Se un altro
+            # worker lo crea nel frattempo l'INSERT non fa niente; nessun commit
+            # qui, resta tutto nella transazione del chiamante.
+            modello = self.modelli[nome]
+            massimo = select(func.coalesce(func.max(modello.id), 0)).scalar_subquery()
+            db.session.execute(
+                _insert_se_manca(ContatoreId).values(nome=nome, ultimo=massimo).on_conflict_do_nothing())
+
+    @tracciato("archivio.nuovo_id")
+    def nuovo_id(self, nome):
+        ultimo = self._alloca_id(nome)
+        db.session.commit()
+        return ultimo
+
+    @tracciato("archivio.assegna_id")
+    def assegna_id(self, nome):
+        modello = self.modelli[nome]
+        visti, da_rinumerare = set(), []
+        for pk, valore in db.session.query(modello.pk, modello.id).order_by(modello.pk):
+            if valore is None or valore in visti:
+                da_rinumerare.append(pk)
+            else:
+                visti.add(valore)
+        if not da_rinumerare:
+            return 0
+        nuovi = [self._alloca_id(nome) for _ in da_rinumerare]
+        for pk, valore in zip(da_rinumerare, nuovi):
+            db.session.get(modello, pk).id = valore
+        self._incrementa_versione(nome)
+        db.session.commit()
+        return len(da_rinumerare)
+
+    def aggiungi_indice(self, nome, campo):
+        # Le colonne hanno già un indice nel database
+        pass
+
+    # ---- viste ----
+    def aggiungi_vista(self, nome, vista):
+        pass
+
+    @tracciato("archivio.leggi_vista")
+    def leggi_vista(self, nome, vista, *argomenti):
+        risultato = vista.interroga(self, nome, *argomenti)
+        if risultato is not NON_INTERROGABILE:
+            return risultato
+        # Nessun flusso di modifiche dal database: la vista si ricalcola
+        with vista.lock:
+            vista.ricostruisci(self.tutti(nome))
+            return vista.risultato(*argomenti)
+
+    # ---- scritture ----
+    @tracciato("archivio.inserisci")
+    def inserisci(self, nome, record):
+        if nome in self.con_id:
+            record["id"] = self._alloca_id(nome)
+        db.session.add(self.modelli[nome].da_record(record))
+        self._incrementa_versione(nome)
+        db.session.commit()
+        self._avvisa(nome, [record])
+        return record
+
+    @tracciato("archivio.inserisci_molti")
+    def inserisci_molti(self, nome, record):
+        """Inserisce una lista di record con un solo commit; gli id presenti restano."""
+        if not record:
+            return record
+        senza_id = [r for r in record if r.get("id") is None] if nome in self.con_id else []
+        presenti = id_massimo(record) if nome in self.con_id else 0
+        if senza_id or presenti:
+            primo = self._alloca_id(nome, len(senza_id), presenti)
+            for i, r in enumerate(senza_id):
+                r["id"] = primo + i
+        db.session.add_all(self.modelli[nome].da_record(r) for r in record)
+        self._incrementa_versione(nome)
+        db.session.commit()
+        self._avvisa(nome, record)
+        return record
+
+    @tracciato("archivio.modifica")
+    def modifica(self, nome, funzione, indice=None, **filtri):
+        riga = self._riga(nome, indice, filtri, per_modifica=True)
+        if riga is None:
+            return None
+        record = riga.a_record()
+        funzione(record)
+        riga.aggiorna_da(record)
+        self._incrementa_versione(nome)
+        db.session.commit()
+        self._avvisa(nome, [record])
+        return record
+
+    @tracciato("archivio.modifica_tutti")
+    def modifica_tutti(self, nome, funzione, **filtri):
+        righe = self._righe(nome, filtri, per_modifica=True)
+        modificati = []
+        for riga in righe:
+            record = riga.a_record()
+            funzione(record)
+            riga.aggiorna_da(record)
+            modificati.append(record)
+        if righe:
+            self._incrementa_versione(nome)
+        db.session.commit()
+        self._avvisa(nome, modificati)
+        return len(righe)
+
+    @tracciato("archivio.elimina")
+    def elimina(self, nome, indice=None, **filtri):
+        righe = [self._riga(nome, indice, {})] if indice is not None else self._righe(nome, filtri)
+        righe = [r for r in righe if r is not None]
+        eliminati = [riga.a_record() for riga in righe]
+        for riga in righe:
+            db.session.delete(riga)
+        if righe:
+            self._incrementa_versione(nome)
+        db.session.commit()
+        self._avvisa(nome, eliminati)
+        return len(righe)
+
+    def importa_da(self, sorgente):
+        """Copia tutte le collezioni da un altro archivio (es. dai file JSON)."""
+        ContatoreId.query.delete()
+        for nome, modello in self.modelli.items():
+            modello.query.delete()
+            db.session.add_all(modello.da_record(r) for r in sorgente.tutti(nome))
+            self._incrementa_versione(nome)
+        db.session.commit()
+
+
+def crea_archivio(tipo, percorsi, journal=None, con_id=()):
+    if tipo == "sql":
+        return ArchivioSQL(con_id=con_id)
+    return ArchivioJSON(percorsi, journal, con_id)
@@ -0,0 +1,185 @@
+"""Benchmark di carico degli endpoint principali, sull'app vera attraverso il test client di Flask.
+
+Per ogni scenario si fanno --riscaldamento richieste non misurate e poi
+--richieste richieste divise tra --thread thread, ognuno con il suo client
+già autenticato. Per ogni scenario si riportano le latenze p50/p95/p99 e
+media (risposta letta per intero) e le richieste al secondo. I risultati,
+con commit, parametri e dimensione del dataset, si salvano in JSON;
+--confronta stampa le variazioni rispetto a un file salvato prima, per
+trovare le regressioni tra un commit e l'altro. Il dataset si prepara con
+benchmark.dati_sintetici.
+
+    python -m benchmark.dati_sintetici --cartella /tmp/registro_bench --utenti 10000 --voti 1000000
+    python -m benchmark.carico --cartella /tmp/registro_bench --output prima.json
+    python -m benchmark.carico --cartella /tmp/registro_bench --confronta prima.json
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import subprocess
+import threading
+import time
+from datetime import datetime
+
+from benchmark.dati_sintetici import carica_app
+
+# nome -> (metodo, percorso, chi fa la richiesta, esito atteso)
+SCENARI = {
+    "login": ("POST", "/login", "utente", 302),
+    "voti": ("GET", "/api/voti", "utente", 200),
+    "voti_pagina": ("GET", "/api/voti?limit=50", "utente", 200),
+    "utenti": ("GET", "/api/utenti", "admin", 200),
+    "notifiche": ("GET", "/api/notifiche", "utente", 200),
+    "recensioni_pagina": ("GET", "/api/recensioni?limit=50&per_utente=1", "utente", 200),
+    "statistiche": ("GET", "/api/statistiche/professori", "utente", 200),
+}
+CREDENZIALI = {"admin": ("admin", "admin"), "utente": ("utente00001", "password")}
+
+
+def percentile(valori, p):
+    # Nearest-rank su una lista già ordinata
+    return valori[max(0, min(len(valori) - 1, math.ceil(p / 100 * len(valori)) - 1))]
+
+
+def commit_corrente():
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def client_autenticato(app, chi):
+    client = app.test_client()
+    username, password = CREDENZIALI[chi]
+    risposta = client.post("/login", data={"username": username, "password": password})
+    if risposta.status_code != 302:
+        raise SystemExit(f"❌ Login di {username} fallito: il dataset viene da benchmark.dati_sintetici?")
+    return client
+
+
+def esegui(client, metodo, percorso, chi):
+    if metodo == "POST":
+        username, password = CREDENZIALI[chi]
+        risposta = client.post(percorso, data={"username": username, "password": password})
+    else:
+        risposta = client.get(percorso)
+    byte = len(risposta.get_data())
+    risposta.close()
+    return risposta.status_code, byte
+
+
+def misura(app, scenario, richieste, thread, riscaldamento):
+    metodo, percorso, chi, atteso = SCENARI[scenario]
+    client = [client_autenticato(app, chi) for _ in range(thread)]
+    for _ in range(riscaldamento):
+        esegui(client[0], metodo, percorso, chi)
+    latenze, errori, byte = [], [0], [0]
+    lock = threading.Lock()
+
+    def lavora(c, quante):
+        locali, sbagliate, letti = [], 0, 0
+        for _ in range(quante):
+            inizio = time.perf_counter()
+            stato, dimensione = esegui(c, metodo, percorso, chi)
+            locali.append(time.perf_counter() - inizio)
+            sbagliate += stato != atteso
+            letti += dimensione
+        with lock:
+            latenze.extend(locali)
+            errori[0] += sbagliate
+            byte[0] += letti
+
+    quote = [richieste // thread + (i < richieste % thread) for i in range(thread)]
+    threads = [threading.Thread(target=lavora, args=(c, q)) for c, q in zip(client, quote)]
+    inizio = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    durata = time.perf_counter() - inizio
+    latenze.sort()
+    return {
+        "richieste": len(latenze),
+        "errori": errori[0],
+        "p50_ms": round(percentile(latenze, 50) * 1000, 3),
+        "p95_ms": round(percentile(latenze, 95) * 1000, 3),
+        "p99_ms": round(percentile(latenze, 99) * 1000, 3),
+        "media_ms": round(sum(latenze) / len(latenze) * 1000, 3),
+        "al_secondo": round(len(latenze) / durata, 1),
+        "byte_medi": byte[0] // len(latenze)
+    }
+
+
+def stampa_confronto(vecchi, nuovi):
+    print(f"\nConfronto con {vecchi.get('commit') or '?'} ({vecchi.get('data', '?')})")
+    print(f"{'scenario':<20} {'p50 ms':>19} {'p95 ms':>19} {'req/s':>19}")
+    for scenario, nuovo in nuovi["scenari"].items():
+        vecchio = vecchi.get("scenari", {}).get(scenario)
+        if vecchio is None:
+            continue
+        colonne = []
+        for campo in ("p50_ms", "p95_ms", "al_secondo"):
+            variazione = (nuovo[campo] - vecchio[campo]) / vecchio[campo] * 100 if vecchio[campo] else 0.0
+            colonne.append(f"{vecchio[campo]:>8g}→{nuovo[campo]:<8g}{variazione:+.0f}%")
+        print(f"{scenario:<20} " + " ".join(f"{c:>19}" for c in colonne))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--cartella", required=True, help="cartella del dataset")
+    parser.add_argument("--archivio", choices=("json", "sql"), default="json")
+    parser.add_argument("--scenari", default=",".join(SCENARI), help="scenari separati da virgola")
+    parser.add_argument("--richieste", type=int, default=200, help="richieste misurate per scenario")
+    parser.add_argument("--thread", type=int, default=1)
+    parser.add_argument("--riscaldamento", type=int, default=5)
+    parser.add_argument("--output", help="file JSON in cui salvare i risultati")
+    parser.add_argument("--confronta", help="risultati di un'esecuzione precedente")
+    args = parser.parse_args()
+    scenari = [s for s in args.scenari.split(",") if s]
+    sconosciuti = [s for s in scenari if s not in SCENARI]
+    if sconosciuti:
+        raise SystemExit(f"❌ Scenari sconosciuti: {', '.join(sconosciuti)} (disponibili: {', '.join(SCENARI)})")
+
+    modulo = carica_app(args.cartella, args.archivio)
+    app = modulo.app
+    with app.app_context():
+        dataset = {nome: modulo.archivio.conta(nome) for nome in ("utenti", "voti", "recensioni", "commenti",
+                                                                  "reazioni", "notifiche", "sessioni")}
+    try:
+        with open(os.path.join(args.cartella, "dataset.json"), encoding="utf-8") as f:
+            generazione = json.load(f)
+    except (OSError, ValueError):
+        generazione = None
+
+    risultati = {
+        "commit": commit_corrente(),
+        "data": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "python": platform.python_version(),
+        "parametri": {k: v for k, v in vars(args).items() if k not in ("output", "confronta")},
+        "dataset": dataset,
+        "generazione": generazione,
+        "scenari": {}
+    }
+    print(f"dataset: {', '.join(f'{k}={v}' for k, v in dataset.items())}")
+    print(f"{'scenario':<20} {'richieste':>9} {'errori':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'req/s':>8} {'KB':>9}")
+    for scenario in scenari:
+        r = misura(app, scenario, args.richieste, args.thread, args.riscaldamento)
+        risultati["scenari"][scenario] = r
+        print(f"{scenario:<20} {r['richieste']:>9} {r['errori']:>6} {r['p50_ms']:>9.2f} {r['p95_ms']:>9.2f} "
+              f"{r['p99_ms']:>9.2f} {r['al_secondo']:>8.1f} {r['byte_medi'] / 1024:>9.1f}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(risultati, f, indent=4)
+        print(f"✅ Risultati salvati in {args.output}")
+    if args.confronta:
+        with open(args.confronta, encoding="utf-8") as f:
+            stampa_confronto(json.load(f), risultati)
+    raise SystemExit(1 if any(r["errori"] for r in risultati["scenari"].values()) else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""Confronto dei codec dei file (dimensione, tempo di scrittura e di lettura) sulle collezioni vere.
+
+Legge ogni file *.json della cartella (in qualunque formato: JSON o snapshot
+msgpack), lo codifica con ogni codec disponibile e misura il migliore di
+--ripetizioni giri. "json" è il formato di sempre letto con la libreria
+standard; "json+orjson" è lo stesso file letto con orjson, cioè quello che si
+guadagna installando orjson senza cambiare formato. Con --moltiplica le
+collezioni piccole vengono replicate per avvicinarsi ai volumi di produzione.
+
+    python -m benchmark.confronto_codec --cartella data --ripetizioni 5 --moltiplica 100
+"""
+import argparse
+import gc
+import glob
+import json
+import os
+import time
+
+from codec import CODEC, CodecNonDisponibile, codec_disponibili, crea_codec, decodifica, orjson
+
+
+def migliore(funzione, ripetizioni):
+    # Come timeit: il garbage collector spento non sporca le misure
+    tempi = []
+    gc.disable()
+    try:
+        for _ in range(ripetizioni):
+            inizio = time.perf_counter()
+            funzione()
+            tempi.append(time.perf_counter() - inizio)
+    finally:
+        gc.enable()
+    return min(tempi)
+
+
+def varianti():
+    """(nome, codec per scrivere, funzione per leggere) per ogni combinazione disponibile."""
+    risultato = [("json", crea_codec("json"), json.loads)]
+    if orjson is not None:
+        risultato.append(("json+orjson", crea_codec("json"), decodifica))
+    for nome in codec_disponibili():
+        if nome != "json":
+            risultato.append((nome, crea_codec(nome), decodifica))
+    return risultato
+
+
+def misura(dati, ripetizioni):
+    righe = []
+    for nome, codec, leggi in varianti():
+        contenuto = codec.codifica(dati)
+        if leggi(contenuto) != dati:
+            raise SystemExit(f"{nome}: i dati riletti non coincidono")
+        righe.append({
+            "codec": nome,
+            "byte": len(contenuto),
+            "scrittura": migliore(lambda: codec.codifica(dati), ripetizioni),
+            "lettura": migliore(lambda: leggi(contenuto), ripetizioni)
+        })
+    return righe
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--cartella", default="data", help="cartella con i file delle collezioni")
+    parser.add_argument("--ripetizioni", type=int, default=5)
+    parser.add_argument("--moltiplica", type=int, default=1, help="replica i record di ogni collezione N volte")
+    args = parser.parse_args()
+
+    mancanti = [nome for nome in CODEC if nome not in codec_disponibili()]
+    if mancanti:
+        print(f"(non installati: {', '.join(mancanti)})")
+    print(f"{'collezione':<24} {'record':>8} {'codec':<12} {'KB':>9} {'scrittura ms':>13} {'lettura ms':>11}")
+    totali = {}
+    for path in sorted(glob.glob(os.path.join(args.cartella, "*.json"))):
+        with open(path, "rb") as f:
+            try:
+                dati = decodifica(f.read())
+            except ValueError:
+                continue
+            except CodecNonDisponibile as e:
+                print(f"{os.path.basename(path)}: {e}")
+                continue
+        if not isinstance(dati, list) or not dati:
+            continue
+        dati = dati * args.moltiplica
+        for r in misura(dati, args.ripetizioni):
+            print(f"{os.path.basename(path):<24} {len(dati):>8} {r['codec']:<12} {r['byte'] / 1024:>9.1f} "
+                  f"{r['scrittura'] * 1000:>13.2f} {r['lettura'] * 1000:>11.2f}")
+            totale = totali.setdefault(r["codec"], {"byte": 0, "scrittura": 0.0, "lettura": 0.0})
+            for campo in totale:
+                totale[campo] += r[campo]
+    for nome, totale in totali.items():
+        print(f"{'TOTALE':<24} {'':>8} {nome:<12} {totale['byte'] / 1024:>9.1f} "
+              f"{totale['scrittura'] * 1000:>13.2f} {totale['lettura'] * 1000:>11.2f}")
+
+
+if __name__ == "__main__":
+    main()
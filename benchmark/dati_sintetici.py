@@ -0,0 +1,255 @@
+"""Generatore deterministico di un dataset sintetico nell'archivio dell'app.
+
+Utenti, professori, voti, recensioni con commenti e like, notifiche e sessioni,
+con la stessa forma dei record creati dalle rotte. Stesso --seme e stessa
+scala danno sempre gli stessi record: anche le date partono da un giorno
+fisso. I record passano da archivio.inserisci_molti a lotti, quindi il dataset
+si genera con entrambi i backend e con le viste (statistiche, reazioni,
+ricerca, ...) già allineate. Nella cartella resta dataset.json con seme e
+scala, che benchmark.carico riporta nei risultati.
+
+    python -m benchmark.dati_sintetici --cartella /tmp/registro_bench --utenti 10000 --voti 1000000
+"""
+import argparse
+import json
+import os
+import random
+import time
+from datetime import datetime, timedelta
+
+DATA_INIZIO = datetime(2025, 9, 1, 8, 0, 0)
+DURATA = timedelta(days=270)  # un anno scolastico
+
+SCALA_PREDEFINITA = {
+    "utenti": 1000,
+    "scuole": 20,
+    "professori": 400,
+    "voti": 100000,
+    "recensioni": 10000,
+    "commenti": 30000,
+    "reazioni": 50000,
+    "notifiche": 20000,
+    "sessioni": 200,
+}
+
+NOMI = ("Marco", "Giulia", "Luca", "Francesca", "Andrea", "Sara", "Matteo", "Chiara", "Paolo", "Elena",
+        "Davide", "Martina", "Stefano", "Laura", "Simone", "Anna", "Giorgio", "Valentina", "Roberto", "Silvia")
+COGNOMI = ("Rossi", "Russo", "Ferrari", "Esposito", "Bianchi", "Romano", "Colombo", "Ricci", "Marino", "Greco",
+           "Bruno", "Gallo", "Conti", "De Luca", "Mancini", "Costa", "Giordano", "Rizzo", "Lombardi", "Moretti")
+MATERIE = ("Matematica", "Italiano", "Storia", "Inglese", "Fisica", "Chimica", "Scienze", "Latino", "Filosofia",
+           "Informatica", "Arte", "Educazione fisica")
+TIPI_SCUOLA = ("Liceo", "Istituto Tecnico", "Istituto Professionale", "Liceo Scientifico", "Liceo Classico")
+NOMI_SCUOLA = ("Volta", "Manzoni", "Galilei", "Fermi", "Marconi", "Leopardi", "Dante", "Carducci", "Pascoli",
+               "Einstein", "Da Vinci", "Montale")
+PAROLE = ("professore", "spiega", "bene", "male", "chiaro", "lezioni", "interessanti", "noiose", "compiti",
+          "verifiche", "difficili", "facili", "disponibile", "severo", "giusto", "preparato", "paziente",
+          "sempre", "mai", "molto", "poco", "classe", "argomenti", "esempi", "voti", "interrogazioni",
+          "puntuale", "ritardo", "consiglio", "materia", "aiuta", "studenti", "ascolta", "appunti")
+TIPI_NOTIFICA = (("ticket", "💬 Risposta al tuo ticket", "/user#ticket"),
+                 ("registrazione", "✅ Registrazione approvata", "/login"),
+                 ("segnalazione", "🚩 Nuova Segnalazione", "/admin#segnalazioni"))
+
+
+class Generatore:
+    def __init__(self, seme, scala):
+        self.rng = random.Random(seme)
+        self.scala = scala
+        self.scuole = self._scuole(scala["scuole"])
+        self.utenti = []  # (username, ruolo)
+        self.professori = []
+        self.recensioni = []  # id
+        self.commenti = []  # id
+
+    def data(self, frazione):
+        """Data nell'anno scolastico; frazione crescente -> date crescenti, come i record veri."""
+        return (DATA_INIZIO + DURATA * frazione).strftime("%Y-%m-%d %H:%M:%S")
+
+    def testo(self, minimo, massimo):
+        return " ".join(self.rng.choices(PAROLE, k=self.rng.randint(minimo, massimo))).capitalize() + "."
+
+    def _scuole(self, quante):
+        scuole = [f"{t} {n}" for n in NOMI_SCUOLA for t in TIPI_SCUOLA]
+        return [scuole[i % len(scuole)] + (f" {i // len(scuole) + 1}" if i >= len(scuole) else "")
+                for i in range(quante)]
+
+    def utente(self):
+        return self.rng.choice(self.utenti)
+
+    # ---- collezioni: generatori di record nell'ordine di inserimento ----
+    def genera_utenti(self):
+        n = self.scala["utenti"]
+        for i in range(n):
+            username, ruolo = ("admin", "admin") if i == 0 else (f"utente{i:05d}", "user")
+            self.utenti.append((username, ruolo))
+            yield {
+                "username": username,
+                "password": "admin" if ruolo == "admin" else "password",
+                "email": f"{username}@esempio.it",
+                "nome_cognome": f"{self.rng.choice(NOMI)} {self.rng.choice(COGNOMI)}",
+                "scuola": self.rng.choice(self.scuole),
+                "role": ruolo,
+                "stato": "attivo",
+                "account_status": "attivo",
+                "created_at": self.data(i / n * 0.1)
+            }
+
+    def genera_professori(self):
+        for i in range(self.scala["professori"]):
+            professore = {
+                "nome": f"{self.rng.choice(NOMI)} {self.rng.choice(COGNOMI)}",
+                "materia": self.rng.choice(MATERIE),
+                "scuola": self.scuole[i % len(self.scuole)]
+            }
+            self.professori.append(professore)
+            yield professore
+
+    def genera_voti(self):
+        n = self.scala["voti"]
+        for i in range(n):
+            professore = self.rng.choice(self.professori)
+            yield {
+                "nomeProf": professore["nome"],
+                "materia": professore["materia"],
+                "scuola": professore["scuola"],
+                # Come dal form: il voto arriva come testo
+                "voto": str(min(10, max(1, round(self.rng.gauss(6.5, 1.8))))),
+                "user": self.utente()[0],
+                "timestamp": self.data(i / n)
+            }
+
+    def genera_recensioni(self):
+        n = self.scala["recensioni"]
+        for i in range(n):
+            professore = self.rng.choice(self.professori)
+            yield {
+                "nomeProfRec": professore["nome"],
+                "scuola": professore["scuola"],
+                "recensione": self.testo(8, 60),
+                "user": self.utente()[0],
+                "timestamp": self.data(i / n)
+            }
+
+    def genera_commenti(self):
+        n = self.scala["commenti"]
+        for i in range(n):
+            username, ruolo = self.utente()
+            yield {
+                "recensione_id": self.rng.choice(self.recensioni),
+                "utente": username,
+                "ruolo": ruolo,
+                "testo": self.testo(3, 25),
+                "data": self.data(i / n)
+            }
+
+    def genera_reazioni(self):
+        elementi = [f"recensione:{i}" for i in self.recensioni] + [f"commento:{i}" for i in self.commenti]
+        if not elementi:
+            return
+        viste = set()
+        for _ in range(self.scala["reazioni"]):
+            elemento, username = self.rng.choice(elementi), self.utente()[0]
+            chiave = f"{elemento}|{username}"
+            if chiave in viste:
+                # Una sola reazione per utente ed elemento, come reagisci()
+                continue
+            viste.add(chiave)
+            yield {"chiave": chiave, "elemento": elemento, "utente": username,
+                   "azione": "like" if self.rng.random() < 0.75 else "dislike"}
+
+    def genera_notifiche(self):
+        n = self.scala["notifiche"]
+        for i in range(n):
+            tipo, titolo, link = self.rng.choice(TIPI_NOTIFICA)
+            letta = self.rng.random() < 0.6
+            yield {
+                "utente": self.utente()[0],
+                "tipo": tipo,
+                "titolo": titolo,
+                "messaggio": self.testo(4, 12),
+                "link": link,
+                "letta": letta,
+                "data": self.data(i / n),
+                "data_lettura": self.data(i / n) if letta else None
+            }
+
+    def genera_sessioni(self):
+        # Una sessione per utente, come registra_sessione
+        for username, _ in self.rng.sample(self.utenti, min(self.scala["sessioni"], len(self.utenti))):
+            inizio = self.rng.random()
+            yield {
+                "session_id": "%032x" % self.rng.getrandbits(128),
+                "username": username,
+                "ip": f"10.0.{self.rng.randrange(256)}.{self.rng.randrange(256)}",
+                "login_time": self.data(inizio),
+                "last_activity": self.data(min(1.0, inizio + 0.001)),
+                "user_agent": "benchmark"
+            }
+
+
+# Ordine di generazione: commenti dopo le recensioni, reazioni dopo entrambi
+COLLEZIONI_GENERATE = ("utenti", "professori", "voti", "recensioni", "commenti", "reazioni", "notifiche",
+                       "sessioni")
+
+
+def genera(archivio, seme=42, scala=None, lotto=10000, stampa=print):
+    """Scrive il dataset nell'archivio (da chiamare nel contesto dell'app). Restituisce i conteggi."""
+    scala = dict(SCALA_PREDEFINITA, **(scala or {}))
+    generatore = Generatore(seme, scala)
+    conteggi = {}
+    for nome in COLLEZIONI_GENERATE:
+        inizio = time.perf_counter()
+        blocco, totale = [], 0
+        for record in getattr(generatore, f"genera_{nome}")():
+            blocco.append(record)
+            if len(blocco) == lotto:
+                totale += len(archivio.inserisci_molti(nome, blocco))
+                blocco = []
+        if blocco:
+            totale += len(archivio.inserisci_molti(nome, blocco))
+        if nome == "recensioni":
+            generatore.recensioni = [r["id"] for r in archivio.scorri("recensioni")]
+        elif nome == "commenti":
+            generatore.commenti = [c["id"] for c in archivio.scorri("commenti")]
+        conteggi[nome] = totale
+        stampa(f"✅ {nome}: {totale} in {time.perf_counter() - inizio:.1f}s")
+    return conteggi
+
+
+def carica_app(cartella, tipo_archivio="json"):
+    """Importa l'app con i dati in `cartella`: file JSON oppure registro.db SQLite lì dentro."""
+    cartella = os.path.abspath(cartella)
+    os.makedirs(cartella, exist_ok=True)
+    os.environ["CARTELLA_DATI"] = cartella
+    os.environ["ARCHIVIO"] = tipo_archivio
+    os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(cartella, "registro.db")
+    # Con queste l'app userebbe il database della cartella corrente
+    os.environ.pop("RENDER", None)
+    os.environ.pop("USE_SQLITE", None)
+    import utenti
+    return utenti
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--cartella", required=True, help="cartella dei dati (vuota)")
+    parser.add_argument("--archivio", choices=("json", "sql"), default="json")
+    parser.add_argument("--seme", type=int, default=42)
+    parser.add_argument("--lotto", type=int, default=10000, help="record per transazione")
+    for nome, valore in SCALA_PREDEFINITA.items():
+        parser.add_argument(f"--{nome}", type=int, default=valore)
+    args = parser.parse_args()
+
+    app = carica_app(args.cartella, args.archivio)
+    scala = {nome: getattr(args, nome) for nome in SCALA_PREDEFINITA}
+    with app.app.app_context():
+        if app.archivio.conta("utenti"):
+            raise SystemExit(f"❌ {args.cartella} contiene già dei dati: serve una cartella vuota")
+        inizio = time.perf_counter()
+        conteggi = genera(app.archivio, args.seme, scala, args.lotto)
+    with open(os.path.join(args.cartella, "dataset.json"), "w", encoding="utf-8") as f:
+        json.dump({"seme": args.seme, "archivio": args.archivio, "scala": scala, "record": conteggi}, f, indent=4)
+    print(f"✅ Dataset generato in {time.perf_counter() - inizio:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
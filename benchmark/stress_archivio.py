@@ -0,0 +1,111 @@
+"""Stress test dell'archivio JSON con più processi (come i worker gunicorn).
+
+Ogni worker è un processo separato con il proprio ArchivioJSON sugli stessi
+file e, opzionalmente, più thread. Ogni operazione è un leggi-modifica-scrivi:
+incrementa un contatore in una delle collezioni e aggiunge un voto al journal.
+Alla fine si controlla che nessun aggiornamento sia andato perso e si stampa il
+throughput al crescere del numero di worker.
+
+    python -m benchmark.stress_archivio --worker 1,2,4,8 --operazioni 200
+"""
+import argparse
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from archivio import ArchivioJSON, JournalCollezione
+
+
+def crea_archivio_prova(cartella, collezioni, soglia):
+    percorsi = {f"contatori{i}": os.path.join(cartella, f"contatori{i}.json") for i in range(collezioni)}
+    percorsi["voti"] = os.path.join(cartella, "voti.json")
+    journal = {"voti": JournalCollezione(
+        percorsi["voti"],
+        os.path.join(cartella, "voti.journal.ndjson"),
+        os.path.join(cartella, "voti.compattazione.ndjson"),
+        os.path.join(cartella, "voti.checkpoint"),
+        soglia
+    )}
+    return ArchivioJSON(percorsi, journal)
+
+
+def _incrementa(record):
+    record["valore"] += 1
+
+
+def lavora(cartella, collezioni, soglia, worker, thread, operazioni, partenza):
+    archivio = crea_archivio_prova(cartella, collezioni, soglia)
+
+    def esegui(numero_thread):
+        for i in range(operazioni):
+            archivio.modifica(f"contatori{(worker + i) % collezioni}", _incrementa, indice=0)
+            archivio.inserisci("voti", {"user": f"w{worker}", "thread": numero_thread, "n": i, "voto": "8"})
+
+    partenza.wait()
+    threads = [threading.Thread(target=esegui, args=(t,)) for t in range(thread)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+
+def misura(worker, thread, operazioni, collezioni, soglia):
+    cartella = tempfile.mkdtemp(prefix="stress_archivio_")
+    try:
+        archivio = crea_archivio_prova(cartella, collezioni, soglia)
+        archivio.inizializza()
+        for i in range(collezioni):
+            archivio.inserisci(f"contatori{i}", {"id": 0, "valore": 0})
+
+        partenza = multiprocessing.Event()
+        processi = [
+            multiprocessing.Process(target=lavora, args=(cartella, collezioni, soglia, w, thread, operazioni, partenza))
+            for w in range(worker)
+        ]
+        for p in processi:
+            p.start()
+        inizio = time.perf_counter()
+        partenza.set()
+        for p in processi:
+            p.join()
+        durata = time.perf_counter() - inizio
+
+        attese = worker * thread * operazioni
+        contati = sum(archivio.in_posizione(f"contatori{i}", 0)["valore"] for i in range(collezioni))
+        voti = archivio.conta("voti")
+        return {
+            "worker": worker,
+            "thread": thread,
+            "transazioni": attese * 2,
+            "secondi": durata,
+            "al_secondo": attese * 2 / durata,
+            "persi": (attese - contati) + (attese - voti)
+        }
+    finally:
+        shutil.rmtree(cartella, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--worker", default="1,2,4,8", help="numeri di processi da provare, separati da virgola")
+    parser.add_argument("--thread", type=int, default=2, help="thread per processo")
+    parser.add_argument("--operazioni", type=int, default=200, help="operazioni per thread")
+    parser.add_argument("--collezioni", type=int, default=4, help="collezioni di contatori su cui distribuire le scritture")
+    parser.add_argument("--soglia", type=int, default=64 * 1024, help="soglia di compattazione del journal in byte")
+    args = parser.parse_args()
+
+    print(f"{'worker':>6} {'thread':>6} {'transazioni':>11} {'secondi':>8} {'tx/s':>9} {'persi':>6}")
+    esito = 0
+    for worker in (int(w) for w in args.worker.split(",")):
+        r = misura(worker, args.thread, args.operazioni, args.collezioni, args.soglia)
+        print(f"{r['worker']:>6} {r['thread']:>6} {r['transazioni']:>11} {r['secondi']:>8.2f} {r['al_secondo']:>9.0f} {r['persi']:>6}")
+        if r["persi"]:
+            esito = 1
+    raise SystemExit(esito)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+import json
+
+try:
+    import orjson
+except ImportError:  # facoltativo: JSON più veloce
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # facoltativo: snapshot binari
+    msgpack = None
+
+
+# ======== CODEC DEI FILE ========
+# Come le collezioni diventano byte su disco. In lettura il formato si
+# riconosce dal contenuto, qualunque sia il codec configurato: uno snapshot
+# msgpack inizia con MAGIA_MSGPACK, tutto il resto è JSON. Così si può
+# cambiare codec senza convertire i file: vengono riscritti nel nuovo formato
+# alla prima scrittura (o compattazione del journal).
+#
+#   json     libreria standard, indentato (il formato di sempre)
+#   orjson   JSON compatto, 5-10 volte più veloce; leggibile da chiunque
+#   msgpack  binario con intestazione, il più piccolo; serve il pacchetto
+MAGIA_MSGPACK = b"RPMP\x01"
+
+
+class CodecNonDisponibile(RuntimeError):
+    """Il file (o il codec richiesto) ha bisogno di un pacchetto non installato."""
+
+
+def carica_json(contenuto):
+    if orjson is not None:
+        try:
+            return orjson.loads(contenuto)
+        except orjson.JSONDecodeError:
+            # NaN/Infinity scritti da json.dump: li accetta solo la libreria standard
+            pass
+    return json.loads(contenuto)
+
+
+def decodifica(contenuto):
+    """Record da byte in uno qualsiasi dei formati; ValueError se non sono validi."""
+    if contenuto.startswith(MAGIA_MSGPACK):
+        if msgpack is None:
+            raise CodecNonDisponibile("snapshot msgpack ma il pacchetto msgpack non è installato")
+        return msgpack.unpackb(contenuto[len(MAGIA_MSGPACK):], strict_map_key=False)
+    return carica_json(contenuto)
+
+
+class CodecJSON:
+    nome = "json"
+
+    def __init__(self, indent=4):
+        self.indent = indent
+
+    def codifica(self, dati):
+        return json.dumps(dati, indent=self.indent).encode("utf-8")
+
+
+class CodecOrjson:
+    nome = "orjson"
+
+    def codifica(self, dati):
+        try:
+            return orjson.dumps(dati)
+        except TypeError:
+            # Valori che orjson rifiuta (interi oltre 64 bit, chiavi non testuali)
+            return json.dumps(dati, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class CodecMsgpack:
+    nome = "msgpack"
+
+    def codifica(self, dati):
+        return MAGIA_MSGPACK + msgpack.packb(dati)
+
+
+CODEC = {"json": CodecJSON, "orjson": CodecOrjson, "msgpack": CodecMsgpack}
+DIPENDENZE = {"orjson": orjson, "msgpack": msgpack}
+
+
+def codec_disponibili():
+    return [nome for nome in CODEC if DIPENDENZE.get(nome, json) is not None]
+
+
+def crea_codec(nome):
+    if nome not in CODEC:
+        raise ValueError(f"codec sconosciuto: {nome} (disponibili: {', '.join(CODEC)})")
+    if nome not in codec_disponibili():
+        raise CodecNonDisponibile(f"il codec {nome} richiede il pacchetto {nome}")
+    return CODEC[nome]()
@@ -0,0 +1,140 @@
+import json
+import os
+import time
+
+from archivio import LockFile
+
+BLOCCO_A_RITROSO = 64 * 1024
+
+
+# ======== CANALE EVENTI ========
+# Registro append-only (NDJSON) degli eventi di modifica, condiviso da tutti i
+# worker: chi scrive appende una riga, ogni stream SSE legge le righe nuove
+# con una stat per giro. Il cursore di lettura è (inode, offset) ed è anche
+# l'id dell'evento SSE, così un client che si riconnette con Last-Event-ID
+# riprende da dove era rimasto. Oltre la soglia il file viene ruotato in
+# "<file>.1"; chi era rimasto indietro finisce di leggere lì.
+class CanaleEventi:
+    def __init__(self, path, soglia=1024 * 1024):
+        self.path = path
+        self.ruotato = path + ".1"
+        self.soglia = soglia
+        self.lock = LockFile(path + ".lock")
+
+    def pubblica(self, tipo, **dati):
+        riga = json.dumps(dict(dati, tipo=tipo, ora=time.time()), ensure_ascii=False) + "\n"
+        with self.lock:
+            try:
+                if os.path.getsize(self.path) > self.soglia:
+                    os.replace(self.path, self.ruotato)
+            except OSError:
+                pass
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(riga)
+
+    def posizione(self):
+        """Cursore che punta alla fine del registro: si ricevono solo gli eventi futuri."""
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return (None, 0)
+        return (st.st_ino, st.st_size)
+
+    @staticmethod
+    def _leggi_righe(f, offset):
+        f.seek(offset)
+        contenuto = f.read()
+        fine = contenuto.rfind(b"\n") + 1
+        eventi = []
+        for riga in contenuto[:fine].splitlines():
+            try:
+                eventi.append(json.loads(riga))
+            except ValueError:
+                pass
+        return eventi, offset + fine
+
+    @staticmethod
+    def _righe_a_ritroso(path):
+        """Righe di un file dall'ultima alla prima, lette a blocchi dalla fine."""
+        try:
+            f = open(path, "rb")
+        except FileNotFoundError:
+            return
+        with f:
+            fine = os.fstat(f.fileno()).st_size
+            resto = b""
+            while fine > 0:
+                inizio = max(0, fine - BLOCCO_A_RITROSO)
+                f.seek(inizio)
+                righe = (f.read(fine - inizio) + resto).split(b"\n")
+                fine = inizio
+                # La prima riga del blocco può continuare nel blocco precedente
+                resto = righe.pop(0)
+                for riga in reversed(righe):
+                    if riga:
+                        yield riga
+            if resto:
+                yield resto
+
+    def ultimi(self, limite, filtro=None):
+        """Gli ultimi `limite` eventi che passano `filtro`, dal più recente.
+
+        Legge dalla fine (poi dal file ruotato) e si ferma appena ne ha
+        abbastanza: il costo non dipende dalla dimensione del registro.
+        """
+        eventi = []
+        for path in (self.path, self.ruotato):
+            for riga in self._righe_a_ritroso(path):
+                try:
+                    evento = json.loads(riga)
+                except ValueError:
+                    # Riga ancora in scrittura
+                    continue
+                if filtro is None or filtro(evento):
+                    eventi.append(evento)
+                    if len(eventi) >= limite:
+                        return eventi
+        return eventi
+
+    def leggi_da(self, cursore):
+        """Restituisce (eventi, nuovo cursore).
+
+        Se il cursore punta a un file non più disponibile (più rotazioni nel
+        frattempo) restituisce un evento "tutto": il client ricarica tutto.
+        """
+        inode, offset = cursore
+        try:
+            corrente = open(self.path, "rb")
+        except FileNotFoundError:
+            return [], (None, 0)
+        with corrente:
+            st = os.fstat(corrente.fileno())
+            if st.st_ino == inode:
+                if st.st_size <= offset:
+                    return [], cursore
+                eventi, offset = self._leggi_righe(corrente, offset)
+                return eventi, (inode, offset)
+            eventi = []
+            if inode is not None:
+                try:
+                    with open(self.ruotato, "rb") as vecchio:
+                        if os.fstat(vecchio.fileno()).st_ino == inode:
+                            eventi = self._leggi_righe(vecchio, offset)[0]
+                        else:
+                            eventi = [{"tipo": "tutto"}]
+                except FileNotFoundError:
+                    eventi = [{"tipo": "tutto"}]
+            nuovi, offset = self._leggi_righe(corrente, 0)
+            return eventi + nuovi, (st.st_ino, offset)
+
+    @staticmethod
+    def id_da_cursore(cursore):
+        return f"{cursore[0]}:{cursore[1]}"
+
+    @staticmethod
+    def cursore_da_id(testo):
+        try:
+            inode, offset = testo.split(":")
+            return (int(inode), int(offset))
+        except (AttributeError, ValueError):
+            return None
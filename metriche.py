@@ -0,0 +1,172 @@
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+# ======== METRICHE ========
+# Contatori, istogrammi e indicatori in memoria, esposti nel formato testuale
+# di Prometheus. Ogni processo (worker gunicorn) ha i suoi valori: Prometheus
+# li vede come serie distinte se ogni worker viene interrogato, altrimenti
+# descrivono il worker che risponde. Gli indicatori (dimensione delle
+# collezioni, ...) si calcolano al momento dell'esposizione.
+LIMITI_SECONDI = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _testo_etichetta(valore):
+    return str(valore).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _etichette(nomi, valori, extra=()):
+    coppie = [f'{n}="{_testo_etichetta(v)}"' for n, v in list(zip(nomi, valori)) + list(extra)]
+    return "{" + ",".join(coppie) + "}" if coppie else ""
+
+
+def _numero(valore):
+    if valore == float("inf"):
+        return "+Inf"
+    return repr(float(valore)) if isinstance(valore, float) else str(valore)
+
+
+class _Metrica:
+    tipo = "untyped"
+
+    def __init__(self, nome, aiuto, etichette=()):
+        self.nome = nome
+        self.aiuto = aiuto
+        self.etichette = tuple(etichette)
+        self.valori = {}
+        self.lock = threading.Lock()
+
+    def _chiave(self, etichette):
+        return tuple(str(etichette.get(n, "")) for n in self.etichette)
+
+    def righe(self):
+        raise NotImplementedError
+
+
+class Contatore(_Metrica):
+    tipo = "counter"
+
+    def incrementa(self, quanto=1, **etichette):
+        chiave = self._chiave(etichette)
+        with self.lock:
+            self.valori[chiave] = self.valori.get(chiave, 0) + quanto
+
+    def righe(self):
+        with self.lock:
+            valori = sorted(self.valori.items())
+        for chiave, valore in valori:
+            yield f"{self.nome}{_etichette(self.etichette, chiave)} {_numero(valore)}"
+
+
+class Istogramma(_Metrica):
+    tipo = "histogram"
+
+    def __init__(self, nome, aiuto, etichette=(), limiti=LIMITI_SECONDI):
+        super().__init__(nome, aiuto, etichette)
+        self.limiti = tuple(limiti)
+
+    def osserva(self, valore, **etichette):
+        chiave = self._chiave(etichette)
+        with self.lock:
+            serie = self.valori.get(chiave)
+            if serie is None:
+                # [osservazioni per intervallo (non cumulative), somma, conteggio]
+                serie = self.valori[chiave] = [[0] * len(self.limiti), 0.0, 0]
+            i = bisect.bisect_left(self.limiti, valore)
+            if i < len(self.limiti):
+                serie[0][i] += 1
+            serie[1] += valore
+            serie[2] += 1
+
+    @contextmanager
+    def misura(self, **etichette):
+        inizio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.osserva(time.perf_counter() - inizio, **etichette)
+
+    def righe(self):
+        with self.lock:
+            valori = sorted((k, (list(v[0]), v[1], v[2])) for k, v in self.valori.items())
+        for chiave, (intervalli, somma, conteggio) in valori:
+            cumulativo = 0
+            for limite, quanti in zip(self.limiti, intervalli):
+                cumulativo += quanti
+                yield f"{self.nome}_bucket{_etichette(self.etichette, chiave, [('le', _numero(limite))])} {cumulativo}"
+            yield f"{self.nome}_bucket{_etichette(self.etichette, chiave, [('le', '+Inf')])} {conteggio}"
+            yield f"{self.nome}_sum{_etichette(self.etichette, chiave)} {_numero(somma)}"
+            yield f"{self.nome}_count{_etichette(self.etichette, chiave)} {conteggio}"
+
+
+class Indicatore(_Metrica):
+    """Valori calcolati da `funzione()` a ogni esposizione: {(etichette...): valore}."""
+    tipo = "gauge"
+
+    def __init__(self, nome, aiuto, etichette=(), funzione=None, tipo=None):
+        super().__init__(nome, aiuto, etichette)
+        self.funzione = funzione
+        if tipo:
+            self.tipo = tipo
+
+    def righe(self):
+        try:
+            valori = sorted(self.funzione().items())
+        except Exception as e:
+            print(f"❌ Errore metrica {self.nome}: {e}")
+            return
+        for chiave, valore in valori:
+            yield f"{self.nome}{_etichette(self.etichette, chiave)} {_numero(valore)}"
+
+
+class Registro:
+    def __init__(self):
+        self.metriche = []
+
+    def _aggiungi(self, metrica):
+        self.metriche.append(metrica)
+        return metrica
+
+    def contatore(self, nome, aiuto, etichette=()):
+        return self._aggiungi(Contatore(nome, aiuto, etichette))
+
+    def istogramma(self, nome, aiuto, etichette=(), limiti=LIMITI_SECONDI):
+        return self._aggiungi(Istogramma(nome, aiuto, etichette, limiti))
+
+    def indicatore(self, nome, aiuto, etichette=(), funzione=None, tipo=None):
+        return self._aggiungi(Indicatore(nome, aiuto, etichette, funzione, tipo))
+
+    def esponi(self):
+        righe = []
+        for metrica in self.metriche:
+            righe.append(f"# HELP {metrica.nome} {metrica.aiuto}")
+            righe.append(f"# TYPE {metrica.nome} {metrica.tipo}")
+            righe.extend(metrica.righe())
+        return "\n".join(righe) + "\n"
+
+
+registro = Registro()
+
+
+# ======== I/O DEI FILE ========
+# Usate da archivio.py per ogni lettura/scrittura di un file di collezione,
+# journal o snapshot: etichetta = nome del file (registro.json,
+# registro.journal.ndjson, ...).
+io_byte = registro.contatore("registroprof_archivio_io_bytes_total",
+                             "Byte letti e scritti sui file delle collezioni", ("file", "operazione"))
+io_secondi = registro.istogramma("registroprof_archivio_io_seconds",
+                                 "Durata di letture e scritture dei file delle collezioni", ("file", "operazione"))
+
+
+def registra_io(path, operazione, byte, secondi):
+    file = os.path.basename(path)
+    io_byte.incrementa(byte, file=file, operazione=operazione)
+    io_secondi.osserva(secondi, file=file, operazione=operazione)
+
+
+# ======== SMTP ========
+smtp_secondi = registro.istogramma("registroprof_smtp_seconds",
+                                   "Durata delle operazioni SMTP in uscita", ("operazione", "esito"))
@@ -0,0 +1,288 @@
+import argparse
+import contextlib
+import os
+import smtplib
+import socketserver
+import threading
+import time
+from datetime import datetime
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+from metriche import smtp_secondi
+from traccia import span_concluso, tracciando
+
+
+# ======== CODA EMAIL ========
+# Le email da inviare sono record di una collezione dell'archivio, così la coda
+# sopravvive ai riavvii ed è condivisa dai worker. Un mittente prenota una email
+# passando lo stato da "in_coda" a "in_invio" con una modifica condizionata:
+# due worker non la prendono mai entrambi. Se il worker muore a metà invio la
+# prenotazione scade e un altro la riprende. Dopo un errore si riprova con
+# attesa doppia a ogni tentativo; oltre max_tentativi l'email resta "fallita".
+class CodaEmail:
+    def __init__(self, archivio, nome="email", max_tentativi=5, attesa=30.0, prenotazione=300.0):
+        self.archivio = archivio
+        self.nome = nome
+        self.max_tentativi = max_tentativi
+        self.attesa = attesa
+        self.prenotazione = prenotazione
+
+    def accoda(self, destinatario, oggetto, html):
+        email = {
+            "id": self.archivio.nuovo_id(self.nome),
+            "destinatario": destinatario,
+            "oggetto": oggetto,
+            "html": html,
+            "stato": "in_coda",
+            "tentativi": 0,
+            "prossimo_tentativo": time.time(),
+            "errore": None,
+            "data": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        }
+        self.archivio.inserisci(self.nome, email)
+        return email
+
+    def prendi(self):
+        """Prenota la prossima email pronta da inviare; None se non ce ne sono."""
+        adesso = time.time()
+        pronte = []
+        for stato in ("in_coda", "in_invio"):
+            pronte += self.archivio.cerca(self.nome, copia=False, stato=stato, prossimo_tentativo__lte=adesso)
+        for email in sorted(pronte, key=lambda e: e["prossimo_tentativo"]):
+            prenotata = self.archivio.modifica(
+                self.nome,
+                lambda e: e.update(stato="in_invio", prossimo_tentativo=adesso + self.prenotazione),
+                id=email["id"], stato=email["stato"], prossimo_tentativo=email["prossimo_tentativo"]
+            )
+            if prenotata is not None:
+                return prenotata
+        return None
+
+    def completata(self, email):
+        self.archivio.elimina(self.nome, id=email["id"])
+
+    def fallita(self, email, errore):
+        tentativi = email.get("tentativi", 0) + 1
+        definitiva = tentativi >= self.max_tentativi
+        self.archivio.modifica(self.nome, lambda e: e.update(
+            stato="fallita" if definitiva else "in_coda",
+            tentativi=tentativi,
+            errore=str(errore)[:500],
+            prossimo_tentativo=time.time() + self.attesa * 2 ** (tentativi - 1)
+        ), id=email["id"])
+
+
+# ======== MITTENTE ========
+# Un thread per worker svuota la coda. La connessione SMTP (STARTTLS + login)
+# resta aperta tra un invio e l'altro e si chiude dopo `inattivita` secondi
+# senza email; se il server l'ha già chiusa si riapre e si riprova subito.
+# Le email accodate nello stesso worker svegliano il thread, quelle degli
+# altri worker si vedono al giro successivo (ogni `intervallo` secondi).
+# Ogni email ha la sua traccia (prenotazione, SMTP, aggiornamento della coda),
+# quindi gli invii lenti finiscono nel registro delle richieste lente.
+def _misura_smtp(inizio, operazione, esito):
+    durata = time.perf_counter() - inizio
+    smtp_secondi.osserva(durata, operazione=operazione, esito=esito)
+    span_concluso(f"smtp.{operazione}", inizio, durata, esito=esito)
+
+
+class MittenteEmail:
+    def __init__(self, coda, server, porta, mittente, password=None, starttls=True,
+                 contesto=contextlib.nullcontext, intervallo=5.0, inattivita=60.0, timeout=20.0):
+        self.coda = coda
+        self.server = server
+        self.porta = porta
+        self.mittente = mittente
+        self.password = password
+        self.starttls = starttls
+        self.contesto = contesto
+        self.intervallo = intervallo
+        self.inattivita = inattivita
+        self.timeout = timeout
+        self._smtp = None
+        self._ultimo_uso = 0.0
+        self._evento = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def avvia(self):
+        # Dopo un fork il thread del processo padre non esiste più: si riavvia
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._ciclo, daemon=True)
+                self._thread.start()
+
+    def sveglia(self):
+        self.avvia()
+        self._evento.set()
+
+    def _ciclo(self):
+        while True:
+            self._evento.clear()
+            inviate = 0
+            try:
+                with self.contesto():
+                    inviate = self.svuota()
+            except Exception as e:
+                print(f"❌ Errore coda email: {e}")
+            if not inviate and self._smtp is not None and time.time() - self._ultimo_uso > self.inattivita:
+                self._chiudi()
+            self._evento.wait(self.intervallo)
+
+    def svuota(self):
+        """Invia le email pronte; restituisce quante ne sono partite."""
+        inviate = 0
+        while True:
+            with tracciando("posta.invio") as traccia:
+                email = self.coda.prendi()
+                if email is None:
+                    return inviate
+                if traccia is not None:
+                    traccia.attributi["email"] = email["id"]
+                try:
+                    self._invia(email)
+                except Exception as e:
+                    print(f"❌ Errore invio email #{email['id']}: {e}")
+                    self._chiudi()
+                    self.coda.fallita(email, e)
+                else:
+                    self.coda.completata(email)
+                    inviate += 1
+
+    def _connetti(self):
+        if self._smtp is None:
+            inizio, esito = time.perf_counter(), "errore"
+            try:
+                smtp = smtplib.SMTP(self.server, self.porta, timeout=self.timeout)
+                try:
+                    if self.starttls:
+                        smtp.starttls()
+                    if self.password:
+                        smtp.login(self.mittente, self.password)
+                except Exception:
+                    smtp.close()
+                    raise
+                esito = "ok"
+            finally:
+                _misura_smtp(inizio, "connessione", esito)
+            self._smtp = smtp
+        return self._smtp
+
+    def _chiudi(self):
+        smtp, self._smtp = self._smtp, None
+        if smtp is not None:
+            try:
+                smtp.quit()
+            except Exception:
+                smtp.close()
+
+    def _invia(self, email):
+        messaggio = MIMEMultipart("alternative")
+        messaggio["Subject"] = email["oggetto"]
+        messaggio["From"] = self.mittente
+        messaggio["To"] = email["destinatario"]
+        messaggio.attach(MIMEText(email["html"], "html"))
+        while True:
+            riusata = self._smtp is not None
+            smtp = self._connetti()
+            inizio = time.perf_counter()
+            try:
+                smtp.send_message(messaggio)
+                _misura_smtp(inizio, "invio", "ok")
+                self._ultimo_uso = time.time()
+                return
+            except smtplib.SMTPServerDisconnected:
+                # Connessione scaduta lato server: una nuova, poi si rinuncia
+                _misura_smtp(inizio, "invio", "disconnesso")
+                self._chiudi()
+                if not riusata:
+                    raise
+            except Exception:
+                _misura_smtp(inizio, "invio", "errore")
+                raise
+
+
+# ======== SERVER SMTP LOCALE ========
+# Per sviluppo e prove: accetta ogni messaggio senza TLS né login e lo salva
+# come file .eml. Con SMTP_SERVER=127.0.0.1 SMTP_PORT=1025 SMTP_STARTTLS=false
+# l'app gli consegna le email al posto del server vero.
+#
+#     python -m posta --porta 1025 --cartella posta_locale
+class _GestoreSMTP(socketserver.StreamRequestHandler):
+    def _rispondi(self, riga):
+        self.wfile.write((riga + "\r\n").encode("ascii"))
+
+    def _leggi_dati(self):
+        righe = []
+        while True:
+            riga = self.rfile.readline()
+            if not riga or riga.rstrip(b"\r\n") == b".":
+                return b"".join(righe)
+            righe.append(riga[1:] if riga.startswith(b"..") else riga)
+
+    def handle(self):
+        self._rispondi("220 registroprof SMTP locale")
+        mittente, destinatari = None, []
+        while True:
+            riga = self.rfile.readline()
+            if not riga:
+                return
+            comando = riga.decode("utf-8", "replace").strip()
+            verbo = comando[:4].upper()
+            if verbo in ("HELO", "EHLO", "NOOP"):
+                self._rispondi("250 OK")
+            elif verbo == "MAIL":
+                mittente, destinatari = comando[10:].split(" ")[0].strip("<>"), []
+                self._rispondi("250 OK")
+            elif verbo == "RCPT":
+                destinatari.append(comando[8:].split(" ")[0].strip("<>"))
+                self._rispondi("250 OK")
+            elif verbo == "DATA":
+                self._rispondi("354 Fine con <CRLF>.<CRLF>")
+                self.server.salva(mittente, destinatari, self._leggi_dati())
+                self._rispondi("250 OK")
+            elif verbo == "RSET":
+                mittente, destinatari = None, []
+                self._rispondi("250 OK")
+            elif verbo == "QUIT":
+                self._rispondi("221 Arrivederci")
+                return
+            else:
+                self._rispondi("502 Comando non supportato")
+
+
+class ServerSMTPLocale(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, indirizzo, cartella=None):
+        super().__init__(indirizzo, _GestoreSMTP)
+        self.cartella = cartella
+        self.messaggi = []  # (mittente, destinatari, byte), anche senza cartella
+        self._lock = threading.Lock()
+        if cartella:
+            os.makedirs(cartella, exist_ok=True)
+
+    def salva(self, mittente, destinatari, dati):
+        with self._lock:
+            self.messaggi.append((mittente, destinatari, dati))
+        if self.cartella:
+            with open(os.path.join(self.cartella, f"{time.time_ns()}.eml"), "wb") as f:
+                f.write(dati)
+        print(f"📧 {mittente} -> {', '.join(destinatari)} ({len(dati)} byte)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Server SMTP locale che salva le email ricevute.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--porta", type=int, default=1025)
+    parser.add_argument("--cartella", default="posta_locale", help="dove salvare i file .eml")
+    args = parser.parse_args()
+    with ServerSMTPLocale((args.host, args.porta), args.cartella) as server:
+        print(f"✅ SMTP locale su {args.host}:{args.porta}, email in {args.cartella}/")
+        server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
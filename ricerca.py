@@ -0,0 +1,232 @@
+import bisect
+import heapq
+import math
+import re
+import unicodedata
+
+from archivio import Vista
+
+
+# ======== TOKENIZZAZIONE ========
+# Minuscole, accenti tolti ("perché" = "perche"), apostrofi come separatori
+# ("dell'insegnante" -> "insegnante"), parole vuote italiane scartate e un
+# taglio leggero delle desinenze così singolare e plurale coincidono
+# ("professore"/"professori", "matematica"/"matematiche").
+PAROLE_VUOTE = frozenset("""
+    a ad agli ai al all alla alle allo anche che chi ci coi col come con contro cui da dagli dai dal dall
+    dalla dalle dallo degli dei del dell della delle dello di dove e ed era gli ha hai hanno ho i il in
+    io la le lei lo loro lui ma mi mia mie miei mio ne negli nei nel nell nella nelle nello noi non nostro
+    o per perche piu poi quale quando quella quelle quelli quello questa queste questi questo se sei si
+    sia sono su sua sue sugli sui sul sull sulla sulle sullo suo suoi ti tra tu tua tue tuo tuoi un una
+    uno vi voi
+""".split())
+
+_PAROLA = re.compile(r"[a-z0-9]+")
+
+
+def normalizza(testo):
+    testo = unicodedata.normalize("NFKD", str(testo).lower())
+    return "".join(c for c in testo if not unicodedata.combining(c))
+
+
+def radice(parola):
+    if len(parola) > 4 and parola[-1] in "aeio":
+        parola = parola[:-1]
+        if parola.endswith(("ch", "gh")):
+            parola = parola[:-1]
+    return parola
+
+
+def tokenizza(testo):
+    if not testo:
+        return []
+    return [radice(p) for p in _PAROLA.findall(normalizza(testo)) if p not in PAROLE_VUOTE and len(p) > 1]
+
+
+def chiave_prefisso(testo):
+    """Testo normalizzato per i confronti di prefisso: parole separate da uno spazio."""
+    return " ".join(_PAROLA.findall(normalizza(testo or "")))
+
+
+# ======== VISTE IN MEMORIA ========
+# Sul backend SQL non c'è un flusso di modifiche: la vista si ricostruisce
+# quando la collezione cambia versione, non a ogni lettura.
+class VistaInMemoria(Vista):
+    def interroga(self, archivio, nome, *argomenti):
+        versione = ("versione", archivio.versione(nome))
+        with self.lock:
+            if self.generazione != versione:
+                self.ricostruisci(archivio.tutti(nome, copia=False))
+                self.generazione = versione
+            return self.risultato(*argomenti)
+
+
+# ======== INDICE INVERTITO ========
+# Per ogni radice i documenti (id del record) che la contengono con il peso
+# delle occorrenze: un campo con peso 3 vale come tre occorrenze. Come le altre
+# viste si aggiorna record per record a ogni scrittura; i risultati sono
+# ordinati per punteggio BM25.
+class IndiceTestuale(VistaInMemoria):
+    K1 = 1.2
+    B = 0.75
+
+    def __init__(self, campi, proprietario=None):
+        super().__init__()
+        self.campi = campi  # campo -> peso
+        self.proprietario = proprietario
+        self.azzera()
+
+    def azzera(self):
+        self.documenti = {}  # radice -> {id: frequenza pesata}
+        self.lunghezze = {}  # id -> somma delle frequenze
+        self.proprietari = {}
+        self.lunghezza_totale = 0
+
+    def _frequenze(self, record):
+        frequenze = {}
+        for campo, peso in self.campi.items():
+            for token in tokenizza(record.get(campo)):
+                frequenze[token] = frequenze.get(token, 0) + peso
+        return frequenze
+
+    def aggiungi(self, record):
+        id_record = record.get("id")
+        if id_record is None or id_record in self.lunghezze:
+            return
+        frequenze = self._frequenze(record)
+        for token, frequenza in frequenze.items():
+            self.documenti.setdefault(token, {})[id_record] = frequenza
+        self.lunghezze[id_record] = sum(frequenze.values())
+        self.lunghezza_totale += self.lunghezze[id_record]
+        if self.proprietario:
+            self.proprietari[id_record] = record.get(self.proprietario)
+
+    def togli(self, record):
+        id_record = record.get("id")
+        if id_record not in self.lunghezze:
+            return
+        for token in self._frequenze(record):
+            documenti = self.documenti.get(token)
+            if documenti is not None:
+                documenti.pop(id_record, None)
+                if not documenti:
+                    del self.documenti[token]
+        self.lunghezza_totale -= self.lunghezze.pop(id_record)
+        self.proprietari.pop(id_record, None)
+
+    def risultato(self, testo, limite=None, proprietario=None):
+        """[(id, punteggio), ...] dal più pertinente; con proprietario solo i suoi record."""
+        totale = len(self.lunghezze)
+        if not totale:
+            return []
+        media = self.lunghezza_totale / totale or 1
+        punteggi = {}
+        for token in set(tokenizza(testo)):
+            documenti = self.documenti.get(token, {})
+            idf = math.log(1 + (totale - len(documenti) + 0.5) / (len(documenti) + 0.5))
+            for id_record, frequenza in documenti.items():
+                if proprietario is not None and self.proprietari.get(id_record) != proprietario:
+                    continue
+                normalizzata = frequenza * (self.K1 + 1) / (
+                    frequenza + self.K1 * (1 - self.B + self.B * self.lunghezze[id_record] / media))
+                punteggi[id_record] = punteggi.get(id_record, 0.0) + idf * normalizzata
+        if limite is None:
+            return sorted(punteggi.items(), key=lambda v: (-v[1], v[0]))
+        return heapq.nsmallest(limite, punteggi.items(), key=lambda v: (-v[1], v[0]))
+
+
+# ======== PREFISSI ========
+# Liste ordinate di (chiave, id): i record che iniziano con un prefisso sono
+# consecutivi, li trova una bisect e se ne leggono solo i primi `limite`.
+# Ogni valore entra con tutti i suoi suffissi di parola ("mario rossi",
+# "rossi"), così si trova anche dal cognome. Oltre alla lista globale ce n'è
+# una per valore di `gruppo` (la scuola), per i suggerimenti di una scuola.
+class IndicePrefissi(VistaInMemoria):
+    def __init__(self, campi, gruppo=None):
+        super().__init__()
+        self.campi = campi
+        self.gruppo = gruppo
+        self.azzera()
+
+    def azzera(self):
+        self.liste = {}  # (campo, gruppo normalizzato o None) -> [(chiave, id)] ordinata
+        self.record = {}
+
+    def _voci(self, record):
+        parole = chiave_prefisso(record.get(self.gruppo)) if self.gruppo else ""
+        for campo in self.campi:
+            chiave = chiave_prefisso(record.get(campo)).split()
+            for i in range(len(chiave)):
+                for gruppo in {None, parole or None}:
+                    yield (campo, gruppo), (" ".join(chiave[i:]), record.get("id"))
+
+    def aggiungi(self, record):
+        if record.get("id") is None or record["id"] in self.record:
+            return
+        self.record[record["id"]] = record
+        for lista, voce in self._voci(record):
+            bisect.insort(self.liste.setdefault(lista, []), voce)
+
+    def togli(self, record):
+        if self.record.get(record.get("id")) is None:
+            return
+        del self.record[record["id"]]
+        for lista, voce in self._voci(record):
+            voci = self.liste.get(lista, [])
+            i = bisect.bisect_left(voci, voce)
+            if i < len(voci) and voci[i] == voce:
+                del voci[i]
+
+    def risultato(self, prefisso, campi=None, gruppo=None, limite=10):
+        """Record con un campo che inizia con il prefisso, prima i campi elencati prima."""
+        prefisso = chiave_prefisso(prefisso)
+        gruppo = chiave_prefisso(gruppo) or None
+        trovati = {}
+        for campo in campi or self.campi:
+            voci = self.liste.get((campo, gruppo), [])
+            i = bisect.bisect_left(voci, (prefisso,))
+            while i < len(voci) and len(trovati) < limite and voci[i][0].startswith(prefisso):
+                trovati.setdefault(voci[i][1], None)
+                i += 1
+        return [dict(self.record[id_record]) for id_record in trovati]
+
+
+class ValoriPerPrefisso(VistaInMemoria):
+    """Valori distinti di un campo (es. le scuole) che iniziano con un prefisso."""
+
+    def __init__(self, campo):
+        super().__init__()
+        self.campo = campo
+        self.azzera()
+
+    def azzera(self):
+        self.chiavi = []  # [(chiave, valore)] ordinata
+        self.conteggi = {}  # valore -> record che lo usano
+
+    def aggiungi(self, record):
+        valore = record.get(self.campo)
+        if not isinstance(valore, str) or not valore.strip():
+            return
+        self.conteggi[valore] = self.conteggi.get(valore, 0) + 1
+        if self.conteggi[valore] == 1:
+            bisect.insort(self.chiavi, (chiave_prefisso(valore), valore))
+
+    def togli(self, record):
+        valore = record.get(self.campo)
+        if valore not in self.conteggi:
+            return
+        self.conteggi[valore] -= 1
+        if not self.conteggi[valore]:
+            del self.conteggi[valore]
+            i = bisect.bisect_left(self.chiavi, (chiave_prefisso(valore), valore))
+            if i < len(self.chiavi) and self.chiavi[i][1] == valore:
+                del self.chiavi[i]
+
+    def risultato(self, prefisso, limite=10):
+        prefisso = chiave_prefisso(prefisso)
+        i = bisect.bisect_left(self.chiavi, (prefisso,))
+        valori = []
+        while i < len(self.chiavi) and len(valori) < limite and self.chiavi[i][0].startswith(prefisso):
+            valori.append(self.chiavi[i][1])
+            i += 1
+        return valori
@@ -0,0 +1,92 @@
+import os
+import sys
+
+import pytest
+
+# I moduli dell'app stanno nella cartella principale, non in un pacchetto
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from archivio import ArchivioJSON, ArchivioSQL, JournalCollezione, db  # noqa: E402
+
+
+def crea_archivio_json(cartella, soglia=256 * 1024):
+    """ticket su un file JSON semplice, voti e reazioni con snapshot + journal."""
+    cartella = str(cartella)
+    percorsi = {nome: os.path.join(cartella, f"{nome}.json") for nome in ("ticket", "voti", "reazioni")}
+    journal = {nome: JournalCollezione(
+        percorsi[nome],
+        os.path.join(cartella, f"{nome}.journal.ndjson"),
+        os.path.join(cartella, f"{nome}.compattazione.ndjson"),
+        os.path.join(cartella, f"{nome}.checkpoint"),
+        soglia,
+        chiave="chiave" if nome == "reazioni" else "id"
+    ) for nome in ("voti", "reazioni")}
+    archivio = ArchivioJSON(percorsi, journal, con_id=("ticket", "voti"))
+    for nome in ("ticket", "voti"):
+        archivio.aggiungi_indice(nome, "id")
+    archivio.aggiungi_indice("reazioni", "chiave")
+    archivio.inizializza()
+    return archivio
+
+
+@pytest.fixture
+def archivio_json(tmp_path):
+    return crea_archivio_json(tmp_path)
+
+
+@pytest.fixture
+def archivio_sql(tmp_path):
+    from flask import Flask
+
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{tmp_path}/prova.db"
+    db.init_app(app)
+    with app.app_context():
+        archivio = ArchivioSQL(con_id=("ticket", "voti"))
+        archivio.inizializza()
+        yield archivio
+        db.session.remove()
+
+
+@pytest.fixture(params=["json", "sql"])
+def archivio(request):
+    """Lo stesso test sui due backend."""
+    return request.getfixturevalue(f"archivio_{request.param}")
+
+
+@pytest.fixture(scope="session")
+def utenti(tmp_path_factory):
+    """Il modulo dell'app, importato una volta con i dati in una cartella temporanea."""
+    cartella = tmp_path_factory.mktemp("dati")
+    for variabile in ("RENDER", "USE_SQLITE"):
+        os.environ.pop(variabile, None)
+    os.environ.update({
+        "CARTELLA_DATI": str(cartella),
+        "DATABASE_URL": f"sqlite:///{cartella}/registro.db",
+        "ARCHIVIO": "json",
+        "AMMISSIONE": "false",
+        "TRACCE": "false",
+    })
+    import utenti
+    return utenti
+
+
+@pytest.fixture
+def app(utenti):
+    """L'app con tutte le collezioni vuote."""
+    with utenti.app.app_context():
+        for nome in utenti.COLLEZIONI:
+            utenti.archivio.elimina(nome)
+    return utenti.app
+
+
+@pytest.fixture
+def accedi(app):
+    """accedi(username, ruolo) -> client di prova con la sessione già aperta."""
+    def accedi(username, ruolo="user"):
+        client = app.test_client()
+        with client.session_transaction() as sessione:
+            sessione["username"] = username
+            sessione["role"] = ruolo
+        return client
+    return accedi
@@ -0,0 +1,36 @@
+def test_304_finche_la_collezione_non_cambia(app, accedi):
+    client = accedi("mario")
+    client.post("/api/voti", json={"nomeProf": "Rossi", "voto": "7"})
+
+    prima = client.get("/api/voti")
+    etag = prima.headers["ETag"]
+    assert prima.status_code == 200
+    assert prima.headers["Cache-Control"] == "private, no-cache"
+
+    ripetuta = client.get("/api/voti", headers={"If-None-Match": etag})
+    assert ripetuta.status_code == 304
+    assert ripetuta.data == b""
+    assert ripetuta.headers["ETag"] == etag
+    # Il vecchio ?t= anti-cache non cambia l'ETag
+    assert client.get("/api/voti?t=123", headers={"If-None-Match": etag}).status_code == 304
+
+    client.post("/api/voti", json={"nomeProf": "Bianchi", "voto": "8"})
+    dopo = client.get("/api/voti", headers={"If-None-Match": etag})
+    assert dopo.status_code == 200
+    assert dopo.headers["ETag"] != etag
+    assert len(dopo.get_json()) == 2
+
+
+def test_l_etag_dipende_da_utente_e_parametri(app, accedi):
+    mario, anna = accedi("mario"), accedi("anna")
+    mario.post("/api/voti", json={"nomeProf": "Rossi", "voto": "7"})
+    etag = mario.get("/api/voti").headers["ETag"]
+
+    assert anna.get("/api/voti", headers={"If-None-Match": etag}).status_code == 200
+    assert mario.get("/api/voti?limit=1", headers={"If-None-Match": etag}).status_code == 200
+
+
+def test_niente_etag_senza_sessione(app):
+    risposta = app.test_client().get("/api/voti")
+    assert risposta.status_code == 403
+    assert "ETag" not in risposta.headers
@@ -0,0 +1,72 @@
+from archivio import ContatoreId, db
+
+
+def test_gli_id_crescono_e_non_si_riusano(archivio):
+    ids = [archivio.inserisci("voti", {"n": n})["id"] for n in range(3)]
+    assert ids == [1, 2, 3]
+    archivio.elimina("voti", id=3)
+    assert archivio.inserisci("voti", {"n": 3})["id"] == 4
+    assert archivio.nuovo_id("voti") == 5
+    assert archivio.inserisci("voti", {"n": 4})["id"] == 6
+
+
+def test_inserisci_ignora_l_id_del_record(archivio):
+    archivio.inserisci("voti", {"n": 0})
+    doppio = archivio.inserisci("voti", {"id": 1, "n": 1})
+    assert doppio["id"] == 2
+    assert sorted(v["id"] for v in archivio.tutti("voti")) == [1, 2]
+
+
+def test_inserisci_molti_tiene_gli_id_presenti(archivio):
+    archivio.inserisci_molti("voti", [{"id": 10, "n": 0}, {"n": 1}, {"id": 11, "n": 2}])
+    ids = sorted(v["id"] for v in archivio.tutti("voti"))
+    assert ids[:2] == [10, 11]
+    # Quelli mancanti vengono dal contatore, oltre gli id già usati
+    assert archivio.inserisci("voti", {"n": 3})["id"] > 11
+
+
+def test_le_collezioni_senza_id_non_ne_ricevono(archivio):
+    assert "id" not in archivio.inserisci("reazioni", {"chiave": "x", "azione": "like"})
+
+
+def test_assegna_id_rinumera_i_doppioni(archivio):
+    archivio.inserisci_molti("voti", [{"id": 1, "n": 0}, {"id": 1, "n": 1}, {"n": 2}])
+    assert archivio.assegna_id("voti") in (1, 2)
+    ids = [v["id"] for v in archivio.tutti("voti")]
+    assert len(set(ids)) == 3 and None not in ids
+    assert archivio.assegna_id("voti") == 0
+
+
+def test_il_contatore_sql_nasce_nella_transazione_del_chiamante(archivio_sql):
+    archivio_sql.inserisci_molti("voti", [{"id": 7, "n": 0}])
+    ContatoreId.query.delete()
+    db.session.commit()
+
+    assert archivio_sql._alloca_id("voti") == 8
+    db.session.rollback()
+    assert ContatoreId.query.count() == 0
+
+    assert archivio_sql.inserisci("voti", {"n": 1})["id"] == 8
+    assert db.session.get(ContatoreId, "voti").ultimo == 8
+
+
+def test_l_id_mandato_dal_client_viene_ignorato(app, accedi):
+    client = accedi("mario")
+    for nome_prof in ("A", "B"):
+        assert client.post("/api/voti", json={"id": 1, "nomeProf": nome_prof, "voto": "7"}).status_code == 200
+    voti = client.get("/api/voti").get_json()
+    assert len({v["id"] for v in voti}) == 2
+
+    assert client.delete(f"/api/voti/id/{voti[0]['id']}").status_code == 200
+    assert [v["nomeProf"] for v in client.get("/api/voti").get_json()] == ["B"]
+
+
+def test_la_modifica_di_un_professore_non_tocca_l_id(app, accedi):
+    client = accedi("admin", "admin")
+    client.post("/api/professori", json={"id": 5, "nome": "Rossi", "materia": "storia", "scuola": "Galilei"})
+    professore, = client.get("/api/professori").get_json()
+
+    risposta = client.put("/api/professori/0", json={"id": 99, "nome": "Bianchi", "extra": "x"})
+    assert risposta.status_code == 200
+    assert client.get("/api/professori").get_json() == [
+        {"id": professore["id"], "nome": "Bianchi", "materia": "storia", "scuola": "Galilei"}]
@@ -0,0 +1,120 @@
+import json
+import os
+import time
+
+from archivio import leggi_json
+from conftest import crea_archivio_json
+
+
+def _incrementa(record):
+    record["valore"] += 1
+
+
+def test_un_archivio_nuovo_rilegge_lo_stesso_stato(tmp_path):
+    archivio = crea_archivio_json(tmp_path)
+    for n in range(5):
+        archivio.inserisci("voti", {"n": n, "valore": 0})
+    archivio.modifica("voti", _incrementa, id=2)
+    archivio.elimina("voti", id=1)
+    archivio.modifica("voti", _incrementa, id=2)
+
+    atteso = [{"n": 1, "valore": 2, "id": 2}, {"n": 2, "valore": 0, "id": 3},
+              {"n": 3, "valore": 0, "id": 4}, {"n": 4, "valore": 0, "id": 5}]
+    assert archivio.tutti("voti") == atteso
+    # Lo snapshot non esiste ancora: tutto viene dal journal
+    assert not os.path.exists(tmp_path / "voti.json")
+    assert crea_archivio_json(tmp_path).tutti("voti") == atteso
+
+
+def test_le_righe_del_journal_portano_id_e_record_intero(tmp_path):
+    archivio = crea_archivio_json(tmp_path)
+    archivio.inserisci("voti", {"valore": 0})
+    archivio.inserisci("voti", {"valore": 0})
+    archivio.modifica("voti", _incrementa, id=2)
+    archivio.elimina("voti", id=1)
+
+    with open(tmp_path / "voti.journal.ndjson", encoding="utf-8") as f:
+        righe = [json.loads(riga) for riga in f]
+    assert righe[2] == {"op": "modifica", "indice": 1, "record": {"valore": 1, "id": 2}, "dove": {"id": 2}}
+    assert righe[3] == {"op": "elimina", "indice": 0, "dove": {"id": 1}}
+
+
+def test_una_riga_per_posizione_sbagliata_trova_il_record_per_id(tmp_path):
+    archivio = crea_archivio_json(tmp_path)
+    for n in range(3):
+        archivio.inserisci("voti", {"n": n})
+    with open(tmp_path / "voti.journal.ndjson", "a", encoding="utf-8") as f:
+        # Scritta da chi vedeva ancora un record in più davanti
+        f.write(json.dumps({"op": "modifica", "indice": 0, "record": {"n": 9, "id": 3}, "dove": {"id": 3}}) + "\n")
+        f.write(json.dumps({"op": "elimina", "indice": 0, "dove": {"id": 42}}) + "\n")
+    assert [v["n"] for v in crea_archivio_json(tmp_path).tutti("voti")] == [0, 1, 9]
+
+
+def test_le_vecchie_righe_con_campi_si_applicano_per_posizione(tmp_path):
+    with open(tmp_path / "voti.journal.ndjson", "w", encoding="utf-8") as f:
+        f.write(json.dumps({"op": "inserisci", "voto": {"id": 1, "voto": "6", "user": "a"}}) + "\n")
+        f.write(json.dumps({"op": "modifica", "indice": 0, "campi": {"voto": "8"}}) + "\n")
+    assert crea_archivio_json(tmp_path).tutti("voti") == [{"id": 1, "voto": "8", "user": "a"}]
+
+
+def test_una_riga_incompleta_aspetta_la_fine_della_scrittura(tmp_path):
+    archivio = crea_archivio_json(tmp_path)
+    archivio.inserisci("voti", {"n": 0})
+    riga = json.dumps({"op": "inserisci", "record": {"n": 1, "id": 99}}) + "\n"
+    with open(tmp_path / "voti.journal.ndjson", "a", encoding="utf-8") as f:
+        f.write(riga[:10])
+        f.flush()
+        assert archivio.conta("voti") == 1
+        f.write(riga[10:])
+    assert archivio.conta("voti") == 2
+
+
+def test_la_compattazione_scrive_lo_snapshot_e_svuota_il_journal(tmp_path):
+    archivio = crea_archivio_json(tmp_path)
+    for n in range(20):
+        archivio.inserisci("voti", {"n": n, "valore": 0})
+    archivio.modifica_tutti("voti", _incrementa, valore=0)
+    archivio.elimina("voti", id=7)
+    prima = archivio.tutti("voti")
+
+    archivio.journal["voti"].compatta()
+
+    assert leggi_json(str(tmp_path / "voti.json")) == prima
+    for nome in ("voti.journal.ndjson", "voti.compattazione.ndjson", "voti.checkpoint"):
+        assert not os.path.exists(tmp_path / nome)
+    assert archivio.tutti("voti") == prima
+    assert crea_archivio_json(tmp_path).tutti("voti") == prima
+
+    # Dopo la compattazione il journal riparte e si somma allo snapshot
+    archivio.inserisci("voti", {"n": 20, "valore": 0})
+    assert crea_archivio_json(tmp_path).tutti("voti") == prima + [{"n": 20, "valore": 0, "id": 21}]
+
+
+def test_la_soglia_fa_partire_la_compattazione(tmp_path):
+    archivio = crea_archivio_json(tmp_path, soglia=512)
+    for n in range(30):
+        archivio.inserisci("voti", {"n": n})
+    # L'evento resta acceso finché il thread di compattazione non finisce
+    journal = archivio.journal["voti"]
+    for _ in range(500):
+        if not journal.compattazione_attiva.is_set():
+            break
+        time.sleep(0.01)
+    assert os.path.exists(tmp_path / "voti.json")
+    assert [v["n"] for v in crea_archivio_json(tmp_path).tutti("voti")] == list(range(30))
+
+
+def test_una_compattazione_interrotta_viene_ripresa(tmp_path):
+    archivio = crea_archivio_json(tmp_path)
+    for n in range(5):
+        archivio.inserisci("voti", {"n": n})
+    # Crash dopo aver spostato il journal e prima di scrivere lo snapshot
+    os.replace(tmp_path / "voti.journal.ndjson", tmp_path / "voti.compattazione.ndjson")
+    nuovo = crea_archivio_json(tmp_path)
+    nuovo.inserisci("voti", {"n": 5})
+    assert [v["n"] for v in nuovo.tutti("voti")] == list(range(6))
+
+    nuovo.journal["voti"].compatta()
+    assert not os.path.exists(tmp_path / "voti.compattazione.ndjson")
+    assert [v["n"] for v in crea_archivio_json(tmp_path).tutti("voti")] == list(range(6))
+    assert [v["id"] for v in crea_archivio_json(tmp_path).tutti("voti")] == list(range(1, 7))
@@ -0,0 +1,55 @@
+import json
+
+import pytest
+
+
+@pytest.fixture
+def dati_vecchi(app, utenti):
+    """Recensioni nel formato di prima: liste di reazioni e commenti annidati, voti senza id."""
+    archivio = utenti.archivio
+    with app.app_context():
+        archivio.inserisci_molti("voti", [{"user": "mario", "voto": "7"}, {"user": "anna", "voto": "6"}])
+        archivio.modifica_tutti("voti", lambda v: v.pop("id"))
+        archivio.inserisci_molti("recensioni", [{
+            "id": 1, "user": "mario", "recensione": "ok",
+            "user_likes": ["anna", "luca"], "user_dislikes": ["mario"], "likes": 2, "dislikes": 1,
+            "commenti": [{"id": 1, "user": "anna", "testo": "sì", "user_likes": ["mario"]},
+                         {"id": 2, "user": "luca", "testo": "no"}],
+        }])
+    return archivio
+
+
+def _stato(app, archivio):
+    with app.app_context():
+        return {nome: archivio.tutti(nome) for nome in ("voti", "recensioni", "commenti", "reazioni")}
+
+
+def test_le_migrazioni_convertono_i_dati_vecchi(app, utenti, dati_vecchi):
+    assert utenti.esegui_migrazioni(tutte=True) == ["id", "reazioni", "commenti"]
+    stato = _stato(app, dati_vecchi)
+
+    assert all(type(v["id"]) is int for v in stato["voti"])
+    assert len({v["id"] for v in stato["voti"]}) == 2
+    recensione, = stato["recensioni"]
+    assert not {"user_likes", "user_dislikes", "likes", "dislikes", "commenti"} & set(recensione)
+    assert [c["testo"] for c in stato["commenti"]] == ["sì", "no"]
+    assert all(c["recensione_id"] == 1 for c in stato["commenti"])
+
+    reazioni = {(r["elemento"], r["utente"]): r["azione"] for r in stato["reazioni"]}
+    primo_commento = utenti.elemento_commento(stato["commenti"][0]["id"])
+    assert reazioni == {
+        ("recensione:1", "anna"): "like", ("recensione:1", "luca"): "like", ("recensione:1", "mario"): "dislike",
+        (primo_commento, "mario"): "like",
+    }
+
+
+def test_eseguirle_di_nuovo_non_cambia_niente(app, utenti, dati_vecchi):
+    utenti.esegui_migrazioni(tutte=True)
+    prima = _stato(app, dati_vecchi)
+
+    assert utenti.esegui_migrazioni(tutte=True) == ["id", "reazioni", "commenti"]
+    assert _stato(app, dati_vecchi) == prima
+    # Senza tutte=True quelle già registrate non ripartono
+    assert utenti.esegui_migrazioni() == []
+    with open(utenti.FILE_MIGRAZIONI, encoding="utf-8") as f:
+        assert set(json.load(f)) == {"id", "reazioni", "commenti"}
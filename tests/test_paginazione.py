@@ -0,0 +1,83 @@
+import base64
+import json
+
+import pytest
+
+
+def _tutte(archivio, limite, **opzioni):
+    pagine, cursore = [], None
+    while True:
+        voci, cursore = archivio.pagina("voti", limite, cursore, **opzioni)
+        pagine.append([record["n"] for _, record in voci])
+        if cursore is None:
+            return pagine
+
+
+@pytest.fixture
+def voti(archivio):
+    archivio.inserisci_molti("voti", [{"n": n, "scuola": "ab"[n % 2], "timestamp": f"2026-01-{n % 4 + 1:02d}"}
+                                      for n in range(10)])
+    return archivio
+
+
+def test_le_pagine_coprono_tutti_i_record_una_volta(voti):
+    assert _tutte(voti, 4) == [[0, 1, 2, 3], [4, 5, 6, 7], [8, 9]]
+    assert _tutte(voti, 4, discendente=True) == [[9, 8, 7, 6], [5, 4, 3, 2], [1, 0]]
+    assert _tutte(voti, 3, scuola="a") == [[0, 2, 4], [6, 8]]
+
+
+def test_ordine_per_campo_con_parita_decisa_dall_id(voti):
+    pagine = _tutte(voti, 3, ordine=("timestamp",))
+    assert sum(pagine, []) == [0, 4, 8, 1, 5, 9, 2, 6, 3, 7]
+    pagine = _tutte(voti, 3, ordine=("timestamp",), discendente=True)
+    assert sum(pagine, []) == [7, 3, 6, 2, 9, 5, 1, 8, 4, 0]
+
+
+def test_eliminare_record_gia_visti_non_fa_saltare_la_pagina(voti):
+    voci, cursore = voti.pagina("voti", 3)
+    assert [r["n"] for _, r in voci] == [0, 1, 2]
+    voti.elimina("voti", id=voci[0][1]["id"])
+    voti.elimina("voti", id=voci[2][1]["id"])
+    voci, _ = voti.pagina("voti", 3, cursore)
+    assert [r["n"] for _, r in voci] == [3, 4, 5]
+
+
+def test_posizioni_solo_se_richieste(voti):
+    voci, cursore = voti.pagina("voti", 2)
+    assert [p for p, _ in voci] == [None, None]
+    voci, _ = voti.pagina("voti", 2, cursore, con_posizioni=True)
+    assert [p for p, _ in voci] == [2, 3]
+
+
+def test_limite_zero_e_senza_limite(voti):
+    assert voti.pagina("voti", 0) == ([], None)
+    voci, cursore = voti.pagina("voti", None)
+    assert len(voci) == 10 and cursore is None
+
+
+@pytest.mark.parametrize("cursore", [[], ["x"], [{"a": 1}], [[1]], [1, 2], "x", [1.5]])
+def test_cursori_non_validi(voti, cursore):
+    with pytest.raises(ValueError):
+        voti.pagina("voti", 2, cursore)
+
+
+def _codifica(cursore):
+    return base64.urlsafe_b64encode(json.dumps(cursore).encode("utf-8")).decode("ascii")
+
+
+def test_api_paginata_e_cursore_non_valido(app, accedi):
+    client = accedi("mario")
+    for n in range(5):
+        client.post("/api/voti", json={"nomeProf": f"P{n}", "voto": "7"})
+
+    nomi, url = [], "/api/voti?limit=2"
+    while url:
+        pagina = client.get(url).get_json()
+        nomi += [v["nomeProf"] for v in pagina["items"]]
+        url = pagina["next_cursor"] and f"/api/voti?limit=2&cursor={pagina['next_cursor']}"
+    assert nomi == [f"P{n}" for n in range(5)]
+
+    for cursore in ("zzz", "%C3%A8", _codifica([{"a": 1}]), _codifica(["x", 1])):
+        assert client.get(f"/api/voti?limit=2&cursor={cursore}").status_code == 400
+    # Senza parametri di pagina la lista resta intera
+    assert len(client.get("/api/voti").get_json()) == 5
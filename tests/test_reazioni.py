@@ -0,0 +1,52 @@
+def _recensione(client):
+    client.post("/api/recensioni", json={"nomeProfRec": "Rossi", "scuola": "Galilei", "recensione": "ok"})
+    return client.get("/api/recensioni").get_json()[-1]["id"]
+
+
+def _reagisci(client, id, azione):
+    risposta = client.post(f"/api/recensioni/id/{id}/like", json={"azione": azione})
+    assert risposta.status_code == 200
+    dati = risposta.get_json()
+    return dati["likes"], dati["dislikes"]
+
+
+def test_una_reazione_per_utente(app, accedi, utenti):
+    mario, anna = accedi("mario"), accedi("anna")
+    id = _recensione(mario)
+
+    assert _reagisci(mario, id, "like") == (1, 0)
+    assert _reagisci(mario, id, "like") == (1, 0)
+    assert _reagisci(anna, id, "like") == (2, 0)
+    assert _reagisci(mario, id, "dislike") == (1, 1)
+    assert _reagisci(anna, id, None) == (0, 1)
+
+    with app.app_context():
+        reazioni = utenti.archivio.cerca("reazioni", elemento=utenti.elemento_recensione(id))
+    assert len({r["chiave"] for r in reazioni}) == len(reazioni)
+    assert {r["utente"]: r["azione"] for r in reazioni if r["azione"]} == {"mario": "dislike"}
+
+
+def test_la_recensione_riporta_le_reazioni_dell_utente(app, accedi):
+    mario, anna = accedi("mario"), accedi("anna")
+    id = _recensione(mario)
+    _reagisci(mario, id, "like")
+    _reagisci(anna, id, "dislike")
+
+    recensione, = [r for r in mario.get("/api/recensioni?per_utente=1").get_json() if r["id"] == id]
+    assert (recensione["likes"], recensione["dislikes"]) == (1, 1)
+    assert recensione["liked_by_me"] and not recensione["disliked_by_me"]
+    recensione, = [r for r in anna.get("/api/recensioni?per_utente=1").get_json() if r["id"] == id]
+    assert recensione["disliked_by_me"] and not recensione["liked_by_me"]
+
+
+def test_le_reazioni_spariscono_con_la_recensione(app, accedi, utenti):
+    mario = accedi("mario")
+    id = _recensione(mario)
+    _reagisci(mario, id, "like")
+    assert mario.delete(f"/api/recensioni/id/{id}").status_code == 200
+    with app.app_context():
+        assert utenti.archivio.conta("reazioni", elemento=utenti.elemento_recensione(id)) == 0
+
+
+def test_reazioni_di_una_recensione_inesistente(app, accedi):
+    assert accedi("mario").post("/api/recensioni/id/999/like", json={"azione": "like"}).status_code == 404
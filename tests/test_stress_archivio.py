@@ -0,0 +1,90 @@
+"""Più processi (come i worker gunicorn), ognuno con più thread e il proprio
+ArchivioJSON sugli stessi file: nessun aggiornamento perso e id unici, sia
+per le collezioni JSON semplici sia per quelle con journal, con la
+compattazione forzata da una soglia piccola mentre si scrive."""
+import multiprocessing
+import os
+import threading
+
+from archivio import ArchivioJSON, JournalCollezione
+
+WORKER = 3
+THREAD = 2
+OPERAZIONI = 40
+SOGLIA = 2048
+
+
+def crea_archivio(cartella):
+    percorsi = {nome: os.path.join(cartella, f"{nome}.json") for nome in ("contatori", "ticket", "voti")}
+    journal = {"voti": JournalCollezione(
+        percorsi["voti"],
+        os.path.join(cartella, "voti.journal.ndjson"),
+        os.path.join(cartella, "voti.compattazione.ndjson"),
+        os.path.join(cartella, "voti.checkpoint"),
+        SOGLIA
+    )}
+    archivio = ArchivioJSON(percorsi, journal, con_id=("ticket", "voti"))
+    archivio.aggiungi_indice("voti", "id")
+    return archivio
+
+
+def _incrementa(record):
+    record["valore"] += 1
+
+
+def lavora(cartella, worker, partenza):
+    archivio = crea_archivio(cartella)
+
+    def esegui(thread):
+        for n in range(OPERAZIONI):
+            archivio.modifica("contatori", _incrementa, indice=0)
+            archivio.inserisci("ticket", {"worker": worker, "thread": thread, "n": n})
+            voto = archivio.inserisci("voti", {"worker": worker, "thread": thread, "n": n, "valore": 0})
+            archivio.modifica("voti", _incrementa, id=voto["id"])
+            if n % 3 == 0:
+                archivio.elimina("voti", id=voto["id"])
+
+    partenza.wait()
+    threads = [threading.Thread(target=esegui, args=(t,)) for t in range(THREAD)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+
+def test_nessun_aggiornamento_perso_tra_processi(tmp_path):
+    cartella = str(tmp_path)
+    archivio = crea_archivio(cartella)
+    archivio.inizializza()
+    archivio.inserisci("contatori", {"valore": 0})
+
+    partenza = multiprocessing.Event()
+    processi = [multiprocessing.Process(target=lavora, args=(cartella, w, partenza)) for w in range(WORKER)]
+    for p in processi:
+        p.start()
+    partenza.set()
+    for p in processi:
+        p.join(timeout=120)
+        assert p.exitcode == 0
+
+    # Un archivio nuovo rilegge snapshot, compattazione e journal da disco
+    for controllo in (crea_archivio(cartella), archivio):
+        totale = WORKER * THREAD * OPERAZIONI
+        assert controllo.in_posizione("contatori", 0)["valore"] == totale
+
+        ticket = controllo.tutti("ticket")
+        assert len(ticket) == totale
+        assert len({t["id"] for t in ticket}) == totale
+
+        voti = controllo.tutti("voti")
+        attesi = {(w, t, n) for w in range(WORKER) for t in range(THREAD) for n in range(OPERAZIONI) if n % 3}
+        assert {(v["worker"], v["thread"], v["n"]) for v in voti} == attesi
+        assert len(voti) == len(attesi)
+        assert all(v["valore"] == 1 for v in voti)
+        assert len({v["id"] for v in voti}) == len(voti)
+        assert controllo.trova("voti", id=voti[-1]["id"]) == voti[-1]
+
+    # La soglia piccola ha fatto compattare almeno una volta
+    assert os.path.exists(os.path.join(cartella, "voti.json"))
+    archivio.journal["voti"].compatta()
+    assert len(crea_archivio(cartella).tutti("voti")) == len(attesi)
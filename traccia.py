@@ -0,0 +1,148 @@
+import contextvars
+import secrets
+import time
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+
+
+# ======== TRACCE ========
+# Una traccia segue una richiesta (o un giro di un lavoro in background) e
+# raccoglie gli span annidati: letture/scritture dell'archivio, ricerche negli
+# indici, file, template, SMTP. La traccia corrente sta in una ContextVar,
+# quindi ogni thread o greenlet ha la sua e i thread avviati da una richiesta
+# (es. la compattazione) non ne fanno parte. Senza traccia attiva uno span
+# costa una lettura della ContextVar. Alla fine della traccia gli osservatori
+# ricevono la traccia completa (es. per il registro delle richieste lente).
+MAX_SPAN = 500
+
+_corrente = contextvars.ContextVar("traccia", default=None)
+_abilitato = [True]
+_osservatori = []
+_NESSUNO_SPAN = nullcontext()
+
+
+class Traccia:
+    def __init__(self, nome, id_traccia=None, **attributi):
+        self.id = id_traccia or secrets.token_hex(8)
+        self.nome = nome
+        self.attributi = attributi
+        self.inizio = time.perf_counter()
+        self.fine = None
+        self.span = []  # [nome, inizio, durata, livello, attributi]
+        self.livello = 0
+        self.scartati = 0
+
+    @property
+    def durata(self):
+        return (self.fine or time.perf_counter()) - self.inizio
+
+    def apri(self, nome, inizio, attributi):
+        self.livello += 1
+        if len(self.span) >= MAX_SPAN:
+            self.scartati += 1
+            return None
+        voce = [nome, inizio, None, self.livello - 1, attributi]
+        self.span.append(voce)
+        return voce
+
+    def chiudi(self, voce, fine):
+        self.livello -= 1
+        if voce is not None:
+            voce[2] = fine - voce[1]
+
+    def aggiungi(self, nome, inizio, durata, attributi):
+        """Span già concluso (durata misurata dal chiamante), figlio dello span aperto."""
+        if len(self.span) >= MAX_SPAN:
+            self.scartati += 1
+            return
+        self.span.append([nome, inizio, durata, self.livello, attributi])
+
+    def riepilogo(self):
+        span = []
+        for nome, inizio, durata, livello, attributi in sorted(self.span, key=lambda s: (s[1], s[3])):
+            span.append(dict(attributi, nome=nome, livello=livello,
+                             inizio_ms=round((inizio - self.inizio) * 1000, 3),
+                             durata_ms=round(durata * 1000, 3) if durata is not None else None))
+        return dict(self.attributi, id=self.id, nome=self.nome, durata_ms=round(self.durata * 1000, 3),
+                    span=span, span_scartati=self.scartati)
+
+
+def abilita(attivo):
+    _abilitato[0] = attivo
+
+
+def aggiungi_osservatore(funzione):
+    _osservatori.append(funzione)
+
+
+def corrente():
+    return _corrente.get()
+
+
+def inizia(nome, id_traccia=None, **attributi):
+    """Apre una traccia nel contesto corrente; restituisce il token da passare a termina (None se disabilitate)."""
+    if not _abilitato[0]:
+        return None
+    return _corrente.set(Traccia(nome, id_traccia, **attributi))
+
+
+def termina(token, **attributi):
+    if token is None:
+        return None
+    traccia = _corrente.get()
+    _corrente.reset(token)
+    if traccia is None:
+        return None
+    traccia.fine = time.perf_counter()
+    traccia.attributi.update(attributi)
+    for funzione in _osservatori:
+        try:
+            funzione(traccia)
+        except Exception as e:
+            print(f"❌ Errore osservatore tracce: {e}")
+    return traccia
+
+
+@contextmanager
+def tracciando(nome, **attributi):
+    token = inizia(nome, **attributi)
+    try:
+        yield _corrente.get() if token is not None else None
+    finally:
+        termina(token)
+
+
+@contextmanager
+def _span_attivo(traccia, nome, attributi):
+    voce = traccia.apri(nome, time.perf_counter(), attributi)
+    try:
+        yield
+    finally:
+        traccia.chiudi(voce, time.perf_counter())
+
+
+def span(nome, **attributi):
+    traccia = _corrente.get()
+    if traccia is None:
+        return _NESSUNO_SPAN
+    return _span_attivo(traccia, nome, attributi)
+
+
+def span_concluso(nome, inizio, durata, **attributi):
+    traccia = _corrente.get()
+    if traccia is not None:
+        traccia.aggiungi(nome, inizio, durata, attributi)
+
+
+def tracciato(nome):
+    """Decoratore per i metodi dell'archivio: uno span per chiamata, con la collezione (primo argomento)."""
+    def decoratore(metodo):
+        @wraps(metodo)
+        def gestore(self, collezione, *args, **kwargs):
+            traccia = _corrente.get()
+            if traccia is None:
+                return metodo(self, collezione, *args, **kwargs)
+            with _span_attivo(traccia, nome, {"collezione": collezione}):
+                return metodo(self, collezione, *args, **kwargs)
+        return gestore
+    return decoratore
@@ -1,13 +1,30 @@
-from flask import Flask, render_template, request, redirect, url_for, session, jsonify
+from flask import Flask, render_template, request, redirect, url_for, session, jsonify, Response, stream_with_context, g
+from flask import before_render_template, template_rendered
 import json
 import os
-from datetime import datetime
+import atexit
+import base64
+import bisect
+import csv
+import io
+import hashlib
+import heapq
+import math
+import threading
+import time
+from datetime import datetime, timedelta
+from functools import wraps
 import secrets
 import random
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from flask_sqlalchemy import SQLAlchemy  # ← AGGIUNGI QUESTO
+from ammissione import ControlloAmmissione
+from archivio import db, crea_archivio, imposta_codec, ArchivioJSON, ArchivioSQL, JournalCollezione, LockFile, NON_INTERROGABILE, Vista, ConteggioPerCampo, MappaPerCampo, statistiche_cache_json
+from codec import CodecNonDisponibile
+from metriche import registro as registro_metriche
+from traccia import abilita as abilita_tracce, aggiungi_osservatore as aggiungi_osservatore_tracce
+from traccia import inizia as inizia_traccia, termina as termina_traccia, span_concluso
+from eventi import CanaleEventi
+from posta import CodaEmail, MittenteEmail
+from ricerca import IndiceTestuale, IndicePrefissi, ValoriPerPrefisso
 from dotenv import load_dotenv  # ← AGGIUNGI QUESTO
 
 load_dotenv()  # ← AGGIUNGI QUESTO
@@ -37,7 +54,10 @@ if not database_url.startswith("sqlite"):
         "pool_pre_ping": True,
     }
 
-db = SQLAlchemy(app)# ✅ AGGIUNGI QUESTO (funziona su Windows E Linux):
+# Backend delle collezioni: "json" (default) oppure "sql"
+app.config["ARCHIVIO"] = os.getenv("ARCHIVIO", "json")
+
+db.init_app(app)# ✅ AGGIUNGI QUESTO (funziona su Windows E Linux):
 import os
 # ═══════════════════════════════════════════════════════════
 # CODICE TEMPORANEO: CREA UTENTI DI TEST PER RENDER
@@ -46,7 +66,10 @@ with app.app_context():
     db.create_all()  # Crea le tabelle se non esistono
     
 # Usa la variabile d'ambiente RENDER se esiste (su Render), altrimenti percorso locale
-if os.getenv("RENDER"):
+if os.getenv("CARTELLA_DATI"):
+    # Cartella esplicita (benchmark, prove), ovunque giri l'app
+    BASE_DIR = os.getenv("CARTELLA_DATI")
+elif os.getenv("RENDER"):
     # Su Render: usa la cartella corrente per i file JSON (o meglio, usa il database)
     BASE_DIR = os.path.join(os.getcwd(), "data")
 else:
@@ -66,22 +89,995 @@ FILE_AVVISI = os.path.join(BASE_DIR, "avvisi.json")
 FILE_TICKET = os.path.join(BASE_DIR, "ticket.json")
 FILE_NOTIFICHE = os.path.join(BASE_DIR, "notifiche.json")
 FILE_RECUPERO = os.path.join(BASE_DIR, "recupero_password.json")
+FILE_EMAIL = os.path.join(BASE_DIR, "email.json")
+FILE_REAZIONI = os.path.join(BASE_DIR, "reazioni.json")
+FILE_COMMENTI = os.path.join(BASE_DIR, "commenti.json")
+
+# Journal append-only dei voti (NDJSON): registro.json resta lo snapshot
+FILE_VOTI_JOURNAL = os.path.join(BASE_DIR, "registro.journal.ndjson")
+FILE_VOTI_COMPATTAZIONE = os.path.join(BASE_DIR, "registro.compattazione.ndjson")
+FILE_VOTI_CHECKPOINT = os.path.join(BASE_DIR, "registro.checkpoint")
+VOTI_JOURNAL = os.getenv("VOTI_JOURNAL", "true") == "true"
+SOGLIA_COMPATTAZIONE_VOTI = int(os.getenv("SOGLIA_COMPATTAZIONE_VOTI", 256 * 1024))
+
+# Anche le notifiche: crearle o segnarle lette appende una riga invece di
+# riscrivere notifiche.json
+FILE_NOTIFICHE_JOURNAL = os.path.join(BASE_DIR, "notifiche.journal.ndjson")
+FILE_NOTIFICHE_COMPATTAZIONE = os.path.join(BASE_DIR, "notifiche.compattazione.ndjson")
+FILE_NOTIFICHE_CHECKPOINT = os.path.join(BASE_DIR, "notifiche.checkpoint")
+NOTIFICHE_JOURNAL = os.getenv("NOTIFICHE_JOURNAL", "true") == "true"
+SOGLIA_COMPATTAZIONE_NOTIFICHE = int(os.getenv("SOGLIA_COMPATTAZIONE_NOTIFICHE", 256 * 1024))
+
+# E le reazioni (like/dislike): un click è una riga nel journal
+FILE_REAZIONI_JOURNAL = os.path.join(BASE_DIR, "reazioni.journal.ndjson")
+FILE_REAZIONI_COMPATTAZIONE = os.path.join(BASE_DIR, "reazioni.compattazione.ndjson")
+FILE_REAZIONI_CHECKPOINT = os.path.join(BASE_DIR, "reazioni.checkpoint")
+REAZIONI_JOURNAL = os.getenv("REAZIONI_JOURNAL", "true") == "true"
+SOGLIA_COMPATTAZIONE_REAZIONI = int(os.getenv("SOGLIA_COMPATTAZIONE_REAZIONI", 256 * 1024))
+
+# E i commenti delle recensioni: aggiungerne uno non riscrive recensioni.json
+FILE_COMMENTI_JOURNAL = os.path.join(BASE_DIR, "commenti.journal.ndjson")
+FILE_COMMENTI_COMPATTAZIONE = os.path.join(BASE_DIR, "commenti.compattazione.ndjson")
+FILE_COMMENTI_CHECKPOINT = os.path.join(BASE_DIR, "commenti.checkpoint")
+COMMENTI_JOURNAL = os.getenv("COMMENTI_JOURNAL", "true") == "true"
+SOGLIA_COMPATTAZIONE_COMMENTI = int(os.getenv("SOGLIA_COMPATTAZIONE_COMMENTI", 256 * 1024))
+
+# Formato dei file delle collezioni e degli snapshot: "json" (indentato, come
+# sempre), "orjson" (compatto e più veloce) o "msgpack" (binario, richiede il
+# pacchetto). I file esistenti si leggono in qualunque formato.
+CODEC_ARCHIVIO = os.getenv("CODEC_ARCHIVIO", "json")
+try:
+    imposta_codec(CODEC_ARCHIVIO)
+except (ValueError, CodecNonDisponibile) as e:
+    print(f"⚠️ {e}: i file restano in json")
+
+# Registro degli eventi per /api/stream (condiviso tra i worker)
+FILE_EVENTI = os.path.join(BASE_DIR, "eventi.ndjson")
+STREAM_INTERVALLO = float(os.getenv("STREAM_INTERVALLO", 1.0))
+STREAM_DURATA = int(os.getenv("STREAM_DURATA", 300))
+
+# Tracce delle richieste: quelle più lente di SOGLIA_LENTA_MS finiscono, con
+# tutti gli span, nel registro delle richieste lente (ruotato oltre 5 MB).
+# TRACCE=false le spegne del tutto.
+TRACCE = os.getenv("TRACCE", "true") == "true"
+SOGLIA_LENTA_MS = float(os.getenv("SOGLIA_LENTA_MS", 500))
+FILE_RICHIESTE_LENTE = os.path.join(BASE_DIR, "richieste_lente.ndjson")
+
+
+# ======== ARCHIVIO ========
+# Backend delle collezioni: "json" (file in BASE_DIR) oppure "sql" (tabelle
+# SQLAlchemy sul database configurato sopra).
+COLLEZIONI = {
+    "utenti": FILE_UTENTI,
+    "voti": FILE_VOTI,
+    "recensioni": FILE_RECENSIONI,
+    "professori": FILE_PROFESSORI,
+    "sessioni": FILE_SESSIONI,
+    "segnalazioni": FILE_SEGNALAZIONI,
+    "registrazioni": FILE_REGISTRAZIONI,
+    "avvisi": FILE_AVVISI,
+    "ticket": FILE_TICKET,
+    "notifiche": FILE_NOTIFICHE,
+    "recupero": FILE_RECUPERO,
+    "email": FILE_EMAIL,
+    "reazioni": FILE_REAZIONI,
+    "commenti": FILE_COMMENTI,
+}
+
+journal = {}
+if VOTI_JOURNAL:
+    journal["voti"] = JournalCollezione(FILE_VOTI, FILE_VOTI_JOURNAL, FILE_VOTI_COMPATTAZIONE,
+                                        FILE_VOTI_CHECKPOINT, SOGLIA_COMPATTAZIONE_VOTI)
+if NOTIFICHE_JOURNAL:
+    journal["notifiche"] = JournalCollezione(FILE_NOTIFICHE, FILE_NOTIFICHE_JOURNAL, FILE_NOTIFICHE_COMPATTAZIONE,
+                                             FILE_NOTIFICHE_CHECKPOINT, SOGLIA_COMPATTAZIONE_NOTIFICHE)
+if REAZIONI_JOURNAL:
+    journal["reazioni"] = JournalCollezione(FILE_REAZIONI, FILE_REAZIONI_JOURNAL, FILE_REAZIONI_COMPATTAZIONE,
+                                            FILE_REAZIONI_CHECKPOINT, SOGLIA_COMPATTAZIONE_REAZIONI, chiave="chiave")
+if COMMENTI_JOURNAL:
+    journal["commenti"] = JournalCollezione(FILE_COMMENTI, FILE_COMMENTI_JOURNAL, FILE_COMMENTI_COMPATTAZIONE,
+                                            FILE_COMMENTI_CHECKPOINT, SOGLIA_COMPATTAZIONE_COMMENTI)
+# Collezioni con un id stabile dal contatore: le rotte le indirizzano per id
+COLLEZIONI_CON_ID = ("voti", "recensioni", "commenti", "professori", "ticket", "notifiche", "segnalazioni",
+                     "registrazioni")
+archivio = crea_archivio(app.config["ARCHIVIO"], COLLEZIONI, journal, COLLEZIONI_CON_ID)
+for nome in COLLEZIONI_CON_ID:
+    archivio.aggiungi_indice(nome, "id")
+archivio.aggiungi_indice("reazioni", "chiave")
+archivio.aggiungi_indice("commenti", "recensione_id")
+
+
+def migra_id():
+    # Voti e recensioni vecchi non hanno id; ticket, segnalazioni, ... ne hanno
+    # di ripetuti (erano "numero di record + 1")
+    for nome in COLLEZIONI_CON_ID:
+        archivio.assegna_id(nome)
+
+
+@app.cli.command("migra-archivio")
+def migra_archivio():
+    """Copia tutte le collezioni dai file JSON al database SQL."""
+    with app.app_context():
+        ArchivioSQL().importa_da(ArchivioJSON(COLLEZIONI, journal))
+    print("✅ Collezioni copiate nel database")
+
+
+# ======== STATISTICHE PROFESSORI ========
+# Conteggio, media, minimo/massimo e istogramma 1-10 dei voti per ogni
+# professore/materia/scuola, aggiornati a ogni voto inserito, modificato o
+# eliminato invece di ricalcolarli scorrendo tutto il registro.
+def valore_voto(voto):
+    try:
+        valore = float(voto.get("voto"))
+    except (TypeError, ValueError):
+        return None
+    if not math.isfinite(valore):
+        return None
+    return int(valore) if valore.is_integer() else valore
+
+
+class StatisticheProfessori(Vista):
+    def azzera(self):
+        self.gruppi = {}
+
+    def _chiave(self, voto):
+        return (voto.get("nomeProf") or "", voto.get("materia") or "", voto.get("scuola") or "")
+
+    def aggiungi(self, voto, quanti=1):
+        valore = valore_voto(voto)
+        if valore is None:
+            return
+        gruppo = self.gruppi.setdefault(self._chiave(voto), {"conteggio": 0, "somma": 0.0, "valori": {}})
+        gruppo["conteggio"] += quanti
+        gruppo["somma"] += valore * quanti
+        gruppo["valori"][valore] = gruppo["valori"].get(valore, 0) + quanti
+
+    def togli(self, voto):
+        valore = valore_voto(voto)
+        chiave = self._chiave(voto)
+        gruppo = self.gruppi.get(chiave)
+        if valore is None or gruppo is None or valore not in gruppo["valori"]:
+            return
+        gruppo["conteggio"] -= 1
+        gruppo["somma"] -= valore
+        gruppo["valori"][valore] -= 1
+        if not gruppo["valori"][valore]:
+            del gruppo["valori"][valore]
+        if not gruppo["conteggio"]:
+            del self.gruppi[chiave]
+
+    def risultato(self):
+        risultato = []
+        for (nome_prof, materia, scuola), gruppo in self.gruppi.items():
+            istogramma = {str(i): 0 for i in range(1, 11)}
+            for valore, quanti in gruppo["valori"].items():
+                classe = str(min(10, max(1, int(round(valore)))))
+                istogramma[classe] += quanti
+            risultato.append({
+                "nomeProf": nome_prof,
+                "materia": materia,
+                "scuola": scuola,
+                "conteggio": gruppo["conteggio"],
+                "media": round(gruppo["somma"] / gruppo["conteggio"], 2),
+                "minimo": min(gruppo["valori"]),
+                "massimo": max(gruppo["valori"]),
+                "istogramma": istogramma
+            })
+        risultato.sort(key=lambda g: (g["nomeProf"], g["materia"], g["scuola"]))
+        return risultato
+
+    def interroga(self, archivio, nome):
+        # Sul database un GROUP BY per gruppo e valore del voto: poche righe
+        # anche con tanti voti, poi gli stessi calcoli su una vista nuova
+        statistiche = StatisticheProfessori()
+        statistiche.azzera()
+        conteggi = archivio.conta_per(nome, "nomeProf", "materia", "scuola", "voto")
+        for (nome_prof, materia, scuola, voto), quanti in conteggi.items():
+            statistiche.aggiungi({"nomeProf": nome_prof, "materia": materia, "scuola": scuola, "voto": voto}, quanti)
+        return statistiche.risultato()
+
+
+statistiche_professori = StatisticheProfessori()
+archivio.aggiungi_vista("voti", statistiche_professori)
+
+
+# ======== ATTIVITÀ UTENTI ========
+# Riepilogo per utente (voti, recensioni, sessioni attive, ultimo login)
+# mantenuto dalle scritture, così le pagine admin non scorrono le collezioni.
+class SessioniPerUtente(Vista):
+    def azzera(self):
+        self.accessi = {}  # username -> {login_time: numero di sessioni}
+
+    def aggiungi(self, sessione):
+        accessi = self.accessi.setdefault(sessione.get("username"), {})
+        login_time = sessione.get("login_time") or ""
+        accessi[login_time] = accessi.get(login_time, 0) + 1
+
+    def togli(self, sessione):
+        accessi = self.accessi.get(sessione.get("username"))
+        login_time = sessione.get("login_time") or ""
+        if not accessi or login_time not in accessi:
+            return
+        accessi[login_time] -= 1
+        if not accessi[login_time]:
+            del accessi[login_time]
+        if not accessi:
+            del self.accessi[sessione.get("username")]
+
+    def _riepilogo(self, accessi):
+        return {
+            "sessioni_attive": sum(accessi.values()),
+            "last_login": max(accessi) if accessi else "N/A"
+        }
+
+    def risultato(self, username=None):
+        if username is None:
+            return {u: self._riepilogo(a) for u, a in self.accessi.items()}
+        return self._riepilogo(self.accessi.get(username, {}))
+
+    def interroga(self, archivio, nome, username=None):
+        if username is None:
+            return NON_INTERROGABILE
+        accessi = {}
+        for sessione in archivio.cerca(nome, username=username):
+            accessi[sessione.get("login_time") or ""] = accessi.get(sessione.get("login_time") or "", 0) + 1
+        return self._riepilogo(accessi)
+
+
+ruoli_utenti = MappaPerCampo("username", "role", "user")
+voti_per_utente = ConteggioPerCampo("user")
+recensioni_per_utente = ConteggioPerCampo("user")
+sessioni_per_utente = SessioniPerUtente()
+archivio.aggiungi_vista("utenti", ruoli_utenti)
+archivio.aggiungi_vista("voti", voti_per_utente)
+archivio.aggiungi_vista("recensioni", recensioni_per_utente)
+archivio.aggiungi_vista("sessioni", sessioni_per_utente)
+
+
+def riepilogo_attivita(username):
+    riepilogo = archivio.leggi_vista("sessioni", sessioni_per_utente, username)
+    riepilogo["voti_count"] = archivio.leggi_vista("voti", voti_per_utente, username)
+    riepilogo["recensioni_count"] = archivio.leggi_vista("recensioni", recensioni_per_utente, username)
+    return riepilogo
+
+
+# ======== CASELLE NOTIFICHE ========
+# Per ogni utente le chiavi (data, id) delle sue notifiche in ordine e il numero
+# di non lette, aggiornati a ogni notifica creata o letta: GET /api/notifiche e
+# /api/notifiche/count leggono solo la casella dell'utente.
+class CaselleNotifiche(Vista):
+    def azzera(self):
+        self.caselle = {}  # utente -> {"ordine": [chiavi], "notifiche": {chiave: notifica}, "non_lette": n}
+
+    def _chiave(self, notifica):
+        id_notifica = notifica.get("id")
+        return (notifica.get("data") or "", id_notifica if type(id_notifica) is int else 0)
+
+    def aggiungi(self, notifica):
+        casella = self.caselle.setdefault(notifica.get("utente"), {"ordine": [], "notifiche": {}, "non_lette": 0})
+        chiave = self._chiave(notifica)
+        bisect.insort(casella["ordine"], chiave)
+        casella["notifiche"][chiave] = notifica
+        if not notifica.get("letta"):
+            casella["non_lette"] += 1
+
+    def togli(self, notifica):
+        casella = self.caselle.get(notifica.get("utente"))
+        chiave = self._chiave(notifica)
+        if casella is None:
+            return
+        i = bisect.bisect_left(casella["ordine"], chiave)
+        if i == len(casella["ordine"]) or casella["ordine"][i] != chiave:
+            return
+        del casella["ordine"][i]
+        casella["notifiche"].pop(chiave, None)
+        if not notifica.get("letta"):
+            casella["non_lette"] -= 1
+        if not casella["ordine"]:
+            del self.caselle[notifica.get("utente")]
+
+    def risultato(self, utente, limite=None, cursore=None):
+        """Dalla più recente: {"notifiche", "prossimo", "non_lette", "totale"}.
+
+        limite=0 restituisce solo i contatori; il cursore è la chiave
+        [data, id] dell'ultima notifica della pagina precedente.
+        """
+        casella = self.caselle.get(utente, {"ordine": [], "notifiche": {}, "non_lette": 0})
+        ordine = casella["ordine"]
+        fine = len(ordine)
+        if cursore is not None:
+            if (not isinstance(cursore, list) or len(cursore) != 2 or not isinstance(cursore[0], str)
+                    or type(cursore[1]) is not int):
+                raise ValueError("Cursore non valido")
+            fine = bisect.bisect_left(ordine, tuple(cursore))
+        inizio = 0 if limite is None else max(0, fine - limite)
+        chiavi = ordine[inizio:fine][::-1]
+        return {
+            "notifiche": [dict(casella["notifiche"][c]) for c in chiavi],
+            "prossimo": list(chiavi[-1]) if chiavi and inizio > 0 else None,
+            "non_lette": casella["non_lette"],
+            "totale": len(ordine)
+        }
+
+    def interroga(self, archivio, nome, utente, limite=None, cursore=None):
+        notifiche, prossimo = [], None
+        if limite != 0:
+            voci, prossimo = archivio.pagina(nome, limite, cursore, ordine=("data",), discendente=True, utente=utente)
+            notifiche = [n for _, n in voci]
+        return {
+            "notifiche": notifiche,
+            "prossimo": prossimo,
+            "non_lette": archivio.conta(nome, utente=utente, letta__ne=True),
+            "totale": archivio.conta(nome, utente=utente)
+        }
+
+
+caselle_notifiche = CaselleNotifiche()
+archivio.aggiungi_vista("notifiche", caselle_notifiche)
+
+
+# ======== REAZIONI ========
+# Like e dislike stanno nella collezione "reazioni", un record per coppia
+# (elemento, utente) con chiave "elemento|utente" indicizzata: un click modifica
+# quel record (una riga nel journal) e non riscrive la recensione. Il record
+# resta anche quando la reazione viene tolta (azione None), così il click
+# successivo è di nuovo una modifica. Per ogni elemento la vista tiene
+# utente -> azione e i due contatori, aggiornati a ogni reazione.
+AZIONI_REAZIONE = ("like", "dislike")
+
+
+def elemento_recensione(id_recensione):
+    return f"recensione:{id_recensione}"
+
+
+def elemento_commento(id_commento):
+    return f"commento:{id_commento}"
+
+
+class ReazioniPerElemento(Vista):
+    def azzera(self):
+        self.elementi = {}  # elemento -> {"utenti": {utente: azione}, "like": n, "dislike": n}
+
+    def aggiungi(self, reazione):
+        azione = reazione.get("azione")
+        if azione not in AZIONI_REAZIONE:
+            return
+        voce = self.elementi.setdefault(reazione.get("elemento"), {"utenti": {}, "like": 0, "dislike": 0})
+        precedente = voce["utenti"].get(reazione.get("utente"))
+        if precedente == azione:
+            return
+        if precedente is not None:
+            voce[precedente] -= 1
+        voce["utenti"][reazione.get("utente")] = azione
+        voce[azione] += 1
+
+    def togli(self, reazione):
+        voce = self.elementi.get(reazione.get("elemento"))
+        azione = reazione.get("azione")
+        if voce is None or azione not in AZIONI_REAZIONE or voce["utenti"].get(reazione.get("utente")) != azione:
+            return
+        del voce["utenti"][reazione.get("utente")]
+        voce[azione] -= 1
+        if not voce["utenti"]:
+            del self.elementi[reazione.get("elemento")]
+
+    @staticmethod
+    def _riepilogo(voce, utente):
+        voce = voce or {"utenti": {}, "like": 0, "dislike": 0}
+        riepilogo = {"likes": voce["like"], "dislikes": voce["dislike"]}
+        if utente is not None:
+            riepilogo["liked_by_me"] = voce["utenti"].get(utente) == "like"
+            riepilogo["disliked_by_me"] = voce["utenti"].get(utente) == "dislike"
+        return riepilogo
+
+    def risultato(self, elementi, utente=None):
+        """{elemento: {"likes", "dislikes"[, "liked_by_me", "disliked_by_me"]}}"""
+        return {e: self._riepilogo(self.elementi.get(e), utente) for e in elementi}
+
+    def interroga(self, archivio, nome, elementi, utente=None):
+        parziale = ReazioniPerElemento()
+        parziale.ricostruisci(archivio.cerca(nome, copia=False, elemento__in=list(elementi)))
+        return parziale.risultato(elementi, utente)
+
+
+reazioni_elementi = ReazioniPerElemento()
+archivio.aggiungi_vista("reazioni", reazioni_elementi)
+
+
+def reagisci(elemento, username, azione):
+    """Imposta (o toglie, se l'azione non è like/dislike) la reazione dell'utente."""
+    azione = azione if azione in AZIONI_REAZIONE else None
+    chiave = f"{elemento}|{username}"
+    if not archivio.modifica_tutti("reazioni", lambda r: r.update(azione=azione), chiave=chiave) and azione:
+        archivio.inserisci("reazioni", {"chiave": chiave, "elemento": elemento, "utente": username, "azione": azione})
+    return archivio.leggi_vista("reazioni", reazioni_elementi, [elemento])[elemento]
+
+
+def migra_reazioni():
+    """Sposta nella collezione reazioni le vecchie liste user_likes/user_dislikes."""
+    def da_migrare(elemento):
+        return any(campo in elemento for campo in ("user_likes", "user_dislikes", "likes", "dislikes"))
+
+    for recensione in archivio.tutti("recensioni", copia=False):
+        if not da_migrare(recensione) and not any(da_migrare(c) for c in recensione.get("commenti") or []):
+            continue
+        reazioni = []
+
+        def togli_liste(r, elemento):
+            for azione in AZIONI_REAZIONE:
+                for utente in r.pop(f"user_{azione}s", None) or []:
+                    reazioni.append((elemento, utente, azione))
+            r.pop("likes", None)
+            r.pop("dislikes", None)
+
+        def migra(r):
+            togli_liste(r, elemento_recensione(r["id"]))
+            for c in r.get("commenti") or []:
+                # Commenti ancora annidati: migra_commenti sposta poi la reazione sul nuovo id
+                togli_liste(c, f"commento:{r['id']}:{c.get('id')}")
+
+        # Solo il worker che ha davvero tolto le liste inserisce le reazioni
+        archivio.modifica("recensioni", migra, id=recensione["id"])
+        for elemento, utente, azione in reazioni:
+            reagisci(elemento, utente, azione)
+
+
+# ======== COMMENTI ========
+# I commenti sono una collezione a parte con recensione_id indicizzato: la
+# recensione porta solo num_commenti, dalla vista qui sotto, e i commenti si
+# leggono a pagine da /api/recensioni/id/<id>/commenti.
+commenti_per_recensione = ConteggioPerCampo("recensione_id")
+archivio.aggiungi_vista("commenti", commenti_per_recensione)
+
+
+def migra_commenti():
+    """Sposta nella collezione commenti quelli ancora annidati nelle recensioni."""
+    for recensione in archivio.tutti("recensioni", copia=False):
+        if "commenti" not in recensione:
+            continue
+        annidati = []
+
+        def togli_commenti(r):
+            annidati.extend(r.pop("commenti", None) or [])
+
+        archivio.modifica("recensioni", togli_commenti, id=recensione["id"])
+        for vecchio in annidati:
+            commento = {k: v for k, v in vecchio.items() if k != "id"}
+            commento["recensione_id"] = recensione["id"]
+            archivio.inserisci("commenti", commento)
+            # Le reazioni erano legate alla posizione nella recensione
+            prima, dopo = f"commento:{recensione['id']}:{vecchio.get('id')}", elemento_commento(commento["id"])
+            archivio.modifica_tutti("reazioni", lambda r: r.update(elemento=dopo, chiave=f"{dopo}|{r.get('utente')}"),
+                                    elemento=prima)
+
+
+# ======== MIGRAZIONI ========
+# Conversioni una tantum dei dati vecchi, nell'ordine: le altre usano gli id.
+# FILE_MIGRAZIONI ricorda quelle già fatte su questi dati. All'avvio (se
+# MIGRAZIONI_ALL_AVVIO non è "false") il primo worker esegue quelle mancanti
+# sotto LockFile e gli altri lo aspettano; dopo, l'avvio legge solo il file.
+# A mano, anche per ripeterle tutte:
+#
+#     flask --app utenti migra-dati
+MIGRAZIONI = {"id": migra_id, "reazioni": migra_reazioni, "commenti": migra_commenti}
+FILE_MIGRAZIONI = os.path.join(BASE_DIR, "migrazioni.json")
+MIGRAZIONI_ALL_AVVIO = os.getenv("MIGRAZIONI_ALL_AVVIO", "true") == "true"
+
+
+def migrazioni_eseguite():
+    try:
+        with open(FILE_MIGRAZIONI, "r", encoding="utf-8") as f:
+            return set(json.load(f))
+    except (OSError, ValueError, TypeError):
+        return set()
 
 
-# ======== FUNZIONI JSON ========
-def leggi_json(path):
-    if not os.path.exists(path):
+def esegui_migrazioni(tutte=False):
+    """Esegue le migrazioni non ancora registrate (tutte con tutte=True); restituisce i nomi eseguiti."""
+    if not tutte and set(MIGRAZIONI) <= migrazioni_eseguite():
         return []
-    with open(path, "r", encoding="utf-8") as f:
+    eseguite = []
+    with LockFile(FILE_MIGRAZIONI + ".lock"):
+        fatte = set() if tutte else migrazioni_eseguite()
+        for nome, migrazione in MIGRAZIONI.items():
+            if nome in fatte:
+                continue
+            with app.app_context():
+                migrazione()
+            fatte.add(nome)
+            eseguite.append(nome)
+            temporaneo = FILE_MIGRAZIONI + ".tmp"
+            with open(temporaneo, "w", encoding="utf-8") as f:
+                json.dump(sorted(fatte | migrazioni_eseguite()), f)
+            os.replace(temporaneo, FILE_MIGRAZIONI)
+    return eseguite
+
+
+@app.cli.command("migra-dati")
+def migra_dati():
+    """Esegue tutte le migrazioni dei dati vecchi e le registra."""
+    eseguite = esegui_migrazioni(tutte=True)
+    print(f"✅ Migrazioni eseguite: {', '.join(eseguite)}")
+
+
+if MIGRAZIONI_ALL_AVVIO:
+    eseguite = esegui_migrazioni()
+    if eseguite:
+        print(f"✅ Migrazioni eseguite: {', '.join(eseguite)}")
+
+
+# ======== RICERCA ========
+# Un indice invertito per collezione, aggiornato a ogni scrittura come le
+# altre viste. I campi con peso più alto contano di più nel punteggio; i
+# ticket si cercano solo tra quelli dell'utente (tutti per gli admin).
+INDICI_RICERCA = {
+    "recensioni": IndiceTestuale({"nomeProfRec": 3, "scuola": 1, "recensione": 1}),
+    "professori": IndiceTestuale({"nome": 3, "materia": 2, "scuola": 1}),
+    "ticket": IndiceTestuale({"oggetto": 2, "messaggio": 1}, proprietario="utente"),
+}
+for nome, indice in INDICI_RICERCA.items():
+    archivio.aggiungi_vista(nome, indice)
+
+# Autocompletamento dei moduli voto e recensione: professori per nome o
+# materia (anche solo quelli di una scuola) e scuole distinte
+suggerimenti_professori = IndicePrefissi(("nome", "materia"), gruppo="scuola")
+scuole_professori = ValoriPerPrefisso("scuola")
+scuole_utenti = MappaPerCampo("username", "scuola")
+archivio.aggiungi_vista("professori", suggerimenti_professori)
+archivio.aggiungi_vista("professori", scuole_professori)
+archivio.aggiungi_vista("utenti", scuole_utenti)
+
+
+# ======== PAGINAZIONE ========
+# Le liste accettano ?limit=N&cursor=...&order=asc|desc e rispondono con
+# {"items": [...], "next_cursor": ...}. Senza questi parametri restituiscono
+# l'intera lista come prima, così le pagine esistenti continuano a funzionare.
+LIMITE_PAGINA = 50
+LIMITE_PAGINA_MASSIMO = 500
+
+
+def richiesta_paginata():
+    return "limit" in request.args or "cursor" in request.args
+
+
+def codifica_cursore(cursore):
+    return base64.urlsafe_b64encode(json.dumps(cursore, separators=(",", ":")).encode("utf-8")).decode("ascii")
+
+
+def decodifica_cursore(testo):
+    return json.loads(base64.urlsafe_b64decode(testo.encode("ascii")))
+
+
+def risposta_paginata(nome, ordine=(), discendente=False, trasforma=None, **filtri):
+    limite = max(1, min(request.args.get("limit", LIMITE_PAGINA, type=int), LIMITE_PAGINA_MASSIMO))
+    if request.args.get("order") in ("asc", "desc"):
+        discendente = request.args["order"] == "desc"
+    try:
+        cursore = decodifica_cursore(request.args["cursor"]) if request.args.get("cursor") else None
+        voci, prossimo = archivio.pagina(nome, limite, cursore, ordine, discendente, **filtri)
+    except ValueError:
+        return jsonify({"error": "Cursore non valido"}), 400
+    elementi = [record for _, record in voci]
+    if trasforma:
+        elementi = trasforma(elementi)
+    return jsonify({"items": elementi, "next_cursor": codifica_cursore(prossimo) if prossimo else None})
+
+
+# ======== IMPORT / EXPORT ========
+# L'esportazione scorre la collezione con un generatore e manda al client
+# blocchi di righe NDJSON o CSV man mano che li scrive: la memoria non cresce
+# con il numero di record. L'importazione legge il corpo della richiesta riga
+# per riga, valida ogni record e li inserisce a lotti di LOTTO_IMPORTAZIONE,
+# una transazione per lotto (un'append al journal o un commit SQL) invece di
+# una riscrittura di registro.json per ogni voto.
+LOTTO_IMPORTAZIONE = int(os.getenv("LOTTO_IMPORTAZIONE", 1000))
+RIGHE_PER_BLOCCO = 500
+MAX_ERRORI_IMPORTAZIONE = 50
+TIPI_FORMATO = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+
+def testo_obbligatorio(record, campo):
+    valore = record.get(campo)
+    if not isinstance(valore, str) or not valore.strip():
+        raise ValueError(f"{campo} mancante")
+    return valore.strip()
+
+
+def testo_facoltativo(record, campo):
+    valore = record.get(campo)
+    if valore is not None and not isinstance(valore, str):
+        raise ValueError(f"{campo} deve essere un testo")
+    return (valore or "").strip()
+
+
+def valida_voto(record):
+    voto = valore_voto(record)
+    if voto is None or not 1 <= voto <= 10:
+        raise ValueError("voto deve essere un numero tra 1 e 10")
+    return {
+        "nomeProf": testo_obbligatorio(record, "nomeProf"),
+        "materia": testo_obbligatorio(record, "materia"),
+        "scuola": testo_facoltativo(record, "scuola"),
+        "voto": voto
+    }
+
+
+def valida_recensione(record):
+    return {
+        "nomeProfRec": testo_obbligatorio(record, "nomeProfRec"),
+        "scuola": testo_facoltativo(record, "scuola"),
+        "recensione": testo_obbligatorio(record, "recensione")
+    }
+
+
+# Colonne del CSV, campi su cui filtrare l'esportazione e validazione dei record importati
+COLLEZIONI_ESPORTABILI = {
+    "voti": {
+        "campi": ("id", "user", "nomeProf", "materia", "scuola", "voto", "timestamp"),
+        "filtri": ("user", "nomeProf", "materia", "scuola"),
+        "valida": valida_voto
+    },
+    "recensioni": {
+        "campi": ("id", "user", "nomeProfRec", "scuola", "recensione", "timestamp"),
+        "filtri": ("user", "nomeProfRec", "scuola"),
+        "valida": valida_recensione
+    },
+}
+
+
+def a_blocchi(record, dimensione=RIGHE_PER_BLOCCO):
+    blocco = []
+    for r in record:
+        blocco.append(r)
+        if len(blocco) == dimensione:
+            yield blocco
+            blocco = []
+    if blocco:
+        yield blocco
+
+
+def esporta_ndjson(record):
+    for blocco in a_blocchi(record):
+        yield "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in blocco)
+
+
+def esporta_csv(record, campi):
+    buffer = io.StringIO()
+    scrittore = csv.DictWriter(buffer, fieldnames=campi, extrasaction="ignore")
+    scrittore.writeheader()
+    for i, r in enumerate(record, start=1):
+        scrittore.writerow(r)
+        if i % RIGHE_PER_BLOCCO == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.getvalue():
+        yield buffer.getvalue()
+
+
+def righe_importazione(sorgente, formato):
+    """Genera (numero di riga, record) dal corpo; record è None se la riga non è JSON valido."""
+    testo = io.TextIOWrapper(sorgente, encoding="utf-8-sig", newline="" if formato == "csv" else None)
+    if formato == "csv":
+        # La riga 1 è l'intestazione
+        for numero, record in enumerate(csv.DictReader(testo), start=2):
+            yield numero, record
+        return
+    for numero, riga in enumerate(testo, start=1):
+        if not riga.strip():
+            continue
         try:
-            return json.load(f)
-        except:
-            return []
+            yield numero, json.loads(riga)
+        except ValueError:
+            yield numero, None
+
+
+# ======== LISTE JSON IN STREAMING ========
+# Le liste complete (senza ?limit) non diventano più un'unica stringa:
+# l'array JSON esce a blocchi di RIGHE_PER_BLOCCO record mentre la collezione
+# viene scorsa, serializzati come farebbe jsonify. La memoria di una richiesta
+# è quella di un blocco e il primo blocco parte appena pronto, qualunque sia la
+# dimensione della collezione. `trasforma` riceve un blocco alla volta.
+def lista_in_streaming(record, trasforma=None):
+    def genera():
+        apertura = "["
+        for blocco in a_blocchi(record):
+            if trasforma:
+                blocco = trasforma(blocco)
+            yield apertura + ",".join(app.json.dumps(r, separators=(",", ":")) for r in blocco)
+            apertura = ","
+        yield "[]\n" if apertura == "[" else "]\n"
+    return Response(stream_with_context(genera()), mimetype="application/json")
+
+
+# ======== EVENTI ========
+# Ogni scrittura su queste collezioni diventa un evento per gli stream SSE; le
+# notifiche arrivano solo all'utente a cui sono destinate.
+eventi = CanaleEventi(FILE_EVENTI)
+COLLEZIONI_CON_EVENTI = ("voti", "recensioni", "professori", "avvisi")
+
+
+def pubblica_cambiamento(nome, record):
+    if nome == "notifiche":
+        for utente in {r.get("utente") for r in record}:
+            eventi.pubblica("notifiche", utente=utente)
+    elif nome in ("reazioni", "commenti"):
+        eventi.pubblica("recensioni")
+    elif nome in COLLEZIONI_CON_EVENTI:
+        eventi.pubblica(nome)
+
+
+archivio.aggiungi_ascoltatore(pubblica_cambiamento)
+
+
+# ======== ETAG ========
+# Le GET delle API rispondono con un ETag forte calcolato dalle versioni delle
+# collezioni che leggono, dall'utente e dai parametri della richiesta (tranne
+# il vecchio ?t= anti-cache). Se il client ha già quella versione riceve 304
+# prima che la collezione venga letta o serializzata.
+def con_etag(*collezioni):
+    def decoratore(vista):
+        @wraps(vista)
+        def gestore(*args, **kwargs):
+            if request.method != "GET" or "username" not in session:
+                return vista(*args, **kwargs)
+            parametri = sorted((k, v) for k, v in request.args.items(multi=True) if k != "t")
+            firma = json.dumps([[archivio.versione(n) for n in collezioni], session["username"],
+                                session.get("role"), request.path, parametri])
+            etag = hashlib.sha1(firma.encode("utf-8")).hexdigest()
+            if request.if_none_match.contains(etag):
+                risposta = Response(status=304)
+                risposta.set_etag(etag)
+                return risposta
+            risposta = app.make_response(vista(*args, **kwargs))
+            if risposta.status_code == 200:
+                risposta.set_etag(etag)
+                # Il browser tiene la risposta ma la riconvalida a ogni richiesta
+                risposta.headers["Cache-Control"] = "private, no-cache"
+            return risposta
+        return gestore
+    return decoratore
+
+
+# ======== METRICHE ========
+# Durata di ogni richiesta per endpoint e stato, tempo di rendering dei
+# template e dimensione delle collezioni; l'I/O dei file lo misura
+# archivio.py, l'SMTP posta.py. Tutto esce da /metrics (formato Prometheus).
+METRICHE_TOKEN = os.getenv("METRICHE_TOKEN")
+
+richieste_servite = registro_metriche.contatore(
+    "registroprof_richieste_total", "Richieste HTTP servite", ("endpoint", "metodo", "stato"))
+durata_richieste = registro_metriche.istogramma(
+    "registroprof_richiesta_seconds", "Durata delle richieste (per gli stream: fino al primo blocco del corpo)",
+    ("endpoint", "metodo"))
+durata_template = registro_metriche.istogramma(
+    "registroprof_template_seconds", "Tempo di rendering dei template", ("template",))
+
+
+class AlPrimoBlocco:
+    """Iteratore attorno al corpo di una risposta in streaming: chiama `misura`
+    quando il primo blocco è pronto (o se il corpo finisce, fallisce o viene chiuso prima).
+    close() passa al corpo, come si aspetta stream_with_context."""
+
+    def __init__(self, corpo, misura):
+        self.corpo = iter(corpo)
+        self.misura = misura
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.misura is None:
+            return next(self.corpo)
+        misura, self.misura = self.misura, None
+        try:
+            return next(self.corpo)
+        finally:
+            misura()
+
+    def close(self):
+        # Client andato via prima del primo blocco: la richiesta conta comunque
+        if self.misura is not None:
+            misura, self.misura = self.misura, None
+            misura()
+        if hasattr(self.corpo, "close"):
+            self.corpo.close()
+
+
+def misura_fine_richiesta(stato, risposta=None):
+    inizio = g.pop("inizio_richiesta", None)
+    if inizio is None:
+        return
+    endpoint = request.endpoint or "sconosciuto"
+    metodo = request.method
+    richieste_servite.incrementa(endpoint=endpoint, metodo=metodo, stato=stato)
+
+    def misura():
+        durata_richieste.osserva(time.perf_counter() - inizio, endpoint=endpoint, metodo=metodo)
+
+    # after_request arriva prima che il corpo di uno stream (SSE, liste, export)
+    # venga generato: la durata si chiude sul primo blocco. I file (send_file)
+    # e le HEAD, che non scorrono il corpo, si misurano qui.
+    if (risposta is not None and risposta.is_streamed and not risposta.direct_passthrough
+            and metodo != "HEAD"):
+        risposta.response = AlPrimoBlocco(risposta.response, misura)
+    else:
+        misura()
+
 
+@app.before_request
+def misura_inizio_richiesta():
+    g.inizio_richiesta = time.perf_counter()
 
-def scrivi_json(path, dati):
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(dati, f, indent=4)
+
+@app.after_request
+def misura_risposta(risposta):
+    misura_fine_richiesta(risposta.status_code, risposta)
+    return risposta
+
+
+@app.teardown_request
+def misura_errore(eccezione):
+    # Eccezione non gestita: after_request non è stato chiamato
+    if eccezione is not None:
+        misura_fine_richiesta(500)
+
+
+@before_render_template.connect_via(app)
+def misura_inizio_template(sender, template, context, **extra):
+    g.setdefault("inizio_template", []).append(time.perf_counter())
+
+
+@template_rendered.connect_via(app)
+def misura_template(sender, template, context, **extra):
+    if g.get("inizio_template"):
+        inizio = g.inizio_template.pop()
+        durata = time.perf_counter() - inizio
+        durata_template.osserva(durata, template=template.name)
+        span_concluso("template", inizio, durata, template=template.name)
+
+
+def letture_cache_json():
+    statistiche = statistiche_cache_json()
+    return {("hit",): statistiche["hit"], ("miss",): statistiche["miss"]}
+
+
+def record_per_collezione():
+    return {(nome,): archivio.conta(nome) for nome in COLLEZIONI}
+
+
+def byte_per_collezione():
+    if app.config["ARCHIVIO"] != "json":
+        return {}
+    dimensioni = {}
+    for nome, path in COLLEZIONI.items():
+        file = [path] + ([journal[nome].journal] if nome in journal else [])
+        for f in file:
+            try:
+                dimensioni[(nome, os.path.basename(f))] = os.path.getsize(f)
+            except OSError:
+                pass
+    return dimensioni
+
+
+registro_metriche.indicatore("registroprof_collezione_record", "Record per collezione", ("collezione",),
+                             record_per_collezione)
+registro_metriche.indicatore("registroprof_collezione_bytes", "Dimensione su disco dei file delle collezioni",
+                             ("collezione", "file"), byte_per_collezione)
+registro_metriche.indicatore("registroprof_cache_json_total", "Letture dalla cache delle collezioni JSON",
+                             ("esito",), letture_cache_json, tipo="counter")
+
+
+# ======== TRACCE ========
+# Ogni richiesta ha un id (l'X-Request-ID del proxy se valido, altrimenti uno
+# nuovo), restituito nell'header X-Request-ID, e una traccia con gli span di
+# archivio, indici, file e template (vedi traccia.py). Le richieste più lente
+# di SOGLIA_LENTA_MS vanno in richieste_lente.ndjson, da /api/richieste-lente;
+# lo stesso per gli invii email del MittenteEmail.
+abilita_tracce(TRACCE)
+richieste_lente = CanaleEventi(FILE_RICHIESTE_LENTE, soglia=5 * 1024 * 1024)
+
+
+def id_richiesta_valido(testo):
+    return 0 < len(testo) <= 64 and testo.isascii() and all(c.isalnum() or c in "-_.:" for c in testo)
+
+
+def registra_se_lenta(traccia):
+    durata_ms = traccia.durata * 1000
+    if durata_ms < SOGLIA_LENTA_MS:
+        return
+    print(f"⚠️ Lenta: {traccia.nome} {durata_ms:.0f} ms (id {traccia.id})")
+    richieste_lente.pubblica("lenta", **traccia.riepilogo())
+
+
+aggiungi_osservatore_tracce(registra_se_lenta)
+
+
+def termina_traccia_richiesta(stato):
+    token = g.pop("traccia", None)
+    return termina_traccia(token, endpoint=request.endpoint, stato=stato, utente=session.get("username"))
+
+
+@app.before_request
+def inizia_traccia_richiesta():
+    id_richiesta = request.headers.get("X-Request-ID", "")
+    g.traccia = inizia_traccia(f"{request.method} {request.path}",
+                               id_richiesta if id_richiesta_valido(id_richiesta) else None)
+
+
+@app.after_request
+def chiudi_traccia_richiesta(risposta):
+    traccia = termina_traccia_richiesta(risposta.status_code)
+    if traccia is not None:
+        risposta.headers["X-Request-ID"] = traccia.id
+    return risposta
+
+
+@app.teardown_request
+def chiudi_traccia_errore(eccezione):
+    # Eccezione non gestita: after_request non è stato chiamato
+    if eccezione is not None:
+        termina_traccia_richiesta(500)
+
+
+# ======== CONTROLLO DI AMMISSIONE ========
+# Le scritture (POST/PUT/PATCH/DELETE) passano dai secchi di gettoni di
+# ammissione.py: uno per utente (per indirizzo senza login) e uno globale per
+# worker, più un tetto alle scritture in corso. Quelle in eccesso ricevono
+# subito 429 con Retry-After invece di accodarsi sul lock della collezione.
+# Letture, pagine, login e logout non sono mai limitati; le scritture degli
+# admin hanno solo il limite per utente. Dietro a un proxy PROXY_FIDATI dice
+# quante voci di X-Forwarded-For (da destra) aggiunge l'infrastruttura.
+AMMISSIONE = os.getenv("AMMISSIONE", "true") == "true"
+PROXY_FIDATI = int(os.getenv("PROXY_FIDATI", 0))
+METODI_SCRITTURA = {"POST", "PUT", "PATCH", "DELETE"}
+ENDPOINT_PRIORITARI = {"login", "logout", "static"}
+
+controllo_ammissione = ControlloAmmissione(
+    float(os.getenv("SCRITTURE_AL_SECONDO", 50)), int(os.getenv("SCRITTURE_RAFFICA", 100)),
+    float(os.getenv("SCRITTURE_UTENTE_AL_SECONDO", 3)), int(os.getenv("SCRITTURE_UTENTE_RAFFICA", 20)),
+    int(os.getenv("MAX_SCRITTURE_IN_CORSO", 32)))
+scritture_rifiutate = registro_metriche.contatore(
+    "registroprof_scritture_rifiutate_total", "Scritture rifiutate con 429 dal controllo di ammissione",
+    ("endpoint", "motivo"))
+registro_metriche.indicatore("registroprof_scritture_in_corso", "Scritture ammesse e non ancora concluse", (),
+                             lambda: {(): controllo_ammissione.in_corso})
+
+
+def indirizzo_client():
+    if PROXY_FIDATI:
+        inoltri = [x.strip() for x in request.headers.get("X-Forwarded-For", "").split(",") if x.strip()]
+        if len(inoltri) >= PROXY_FIDATI:
+            return inoltri[-PROXY_FIDATI]
+    return request.remote_addr or "0.0.0.0"
+
+
+@app.before_request
+def ammetti_scrittura():
+    if not AMMISSIONE or request.method not in METODI_SCRITTURA or request.endpoint in ENDPOINT_PRIORITARI:
+        return None
+    chiave = f"utente:{session['username']}" if "username" in session else f"ip:{indirizzo_client()}"
+    rifiuto = controllo_ammissione.ammetti(chiave, prioritaria=admin_required())
+    if rifiuto is None:
+        g.scrittura_ammessa = True
+        return None
+    motivo, attesa = rifiuto
+    scritture_rifiutate.incrementa(endpoint=request.endpoint or "sconosciuto", motivo=motivo)
+    secondi = max(1, math.ceil(attesa))
+    messaggio = f"Troppe richieste, riprova tra {secondi} s."
+    if request.path.startswith("/api/"):
+        risposta = jsonify({"error": messaggio})
+    else:
+        risposta = Response(messaggio, mimetype="text/plain")
+    risposta.status_code = 429
+    risposta.headers["Retry-After"] = str(secondi)
+    return risposta
+
+
+@app.teardown_request
+def concludi_scrittura(eccezione):
+    if g.pop("scrittura_ammessa", False):
+        controllo_ammissione.termina()
 
 
 # ======== CAPTCHA SESSIONE ========
@@ -102,9 +1098,8 @@ def genera_session_id():
 
 
 def registra_sessione(username):
-    sessioni = leggi_json(FILE_SESSIONI)
     session_id = genera_session_id()
-    sessioni = [s for s in sessioni if s["username"] != username]
+    archivio.elimina("sessioni", username=username)
     
     nuova_sessione = {
         "session_id": session_id,
@@ -114,39 +1109,115 @@ def registra_sessione(username):
         "last_activity": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
         "user_agent": request.headers.get("User-Agent", "Unknown")[:100]
     }
-    sessioni.append(nuova_sessione)
-    scrivi_json(FILE_SESSIONI, sessioni)
+    archivio.inserisci("sessioni", nuova_sessione)
     return session_id
 
 
+# L'ultima attività si annota in memoria a ogni pagina e finisce in sessioni.json
+# al massimo ogni SESSIONI_INTERVALLO_SCRITTURA secondi, con una sola
+# transazione per tutti gli utenti attivi nel frattempo.
+DURATA_SESSIONE = 86400
+SESSIONI_INTERVALLO_SCRITTURA = float(os.getenv("SESSIONI_INTERVALLO_SCRITTURA", 30))
+
+
+class AttivitaSessioni:
+    def __init__(self, intervallo):
+        self.intervallo = intervallo
+        self.in_attesa = {}  # username -> last_activity
+        self.lock = threading.Lock()
+        self.ultima_scrittura = time.monotonic()
+
+    def registra(self, username):
+        ora = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        with self.lock:
+            self.in_attesa[username] = ora
+            if time.monotonic() - self.ultima_scrittura < self.intervallo:
+                return
+        self.scrivi()
+
+    def scrivi(self):
+        with self.lock:
+            attese, self.in_attesa = self.in_attesa, {}
+            self.ultima_scrittura = time.monotonic()
+        if not attese:
+            return
+        # max(): un login più recente (altro worker) non torna indietro
+        archivio.modifica_tutti(
+            "sessioni",
+            lambda s: s.update(last_activity=max(s.get("last_activity") or "", attese[s["username"]])),
+            username__in=list(attese)
+        )
+
+
+attivita_sessioni = AttivitaSessioni(SESSIONI_INTERVALLO_SCRITTURA)
+
+
+@atexit.register
+def scrivi_attivita_sessioni():
+    with app.app_context():
+        attivita_sessioni.scrivi()
+
+
+class ScadenzeSessioni(Vista):
+    """Min-heap (last_activity, session_id) per trovare le sessioni scadute senza scorrerle tutte.
+
+    Le voci dello heap superate da una modifica o da un'eliminazione restano
+    lì e vengono scartate quando arrivano in cima.
+    """
+
+    def azzera(self):
+        self.heap = []
+        self.attivita = {}  # session_id -> last_activity corrente
+
+    def aggiungi(self, sessione):
+        voce = (sessione.get("last_activity") or "", sessione.get("session_id") or "")
+        self.attivita[voce[1]] = voce[0]
+        heapq.heappush(self.heap, voce)
+        if len(self.heap) > 2 * len(self.attivita) + 64:
+            self.heap = [(a, s) for s, a in self.attivita.items()]
+            heapq.heapify(self.heap)
+
+    def togli(self, sessione):
+        session_id = sessione.get("session_id") or ""
+        if self.attivita.get(session_id) == (sessione.get("last_activity") or ""):
+            del self.attivita[session_id]
+
+    def risultato(self, limite):
+        scadute = {}
+        while self.heap and self.heap[0][0] <= limite:
+            last_activity, session_id = heapq.heappop(self.heap)
+            if self.attivita.get(session_id) == last_activity:
+                scadute[session_id] = last_activity
+        # Restano nello heap finché non vengono davvero eliminate
+        for session_id, last_activity in scadute.items():
+            heapq.heappush(self.heap, (last_activity, session_id))
+        return list(scadute)
+
+    def interroga(self, archivio, nome, limite):
+        return [s["session_id"] for s in archivio.cerca(nome, last_activity__lte=limite)]
+
+
+scadenze_sessioni = ScadenzeSessioni()
+archivio.aggiungi_vista("sessioni", scadenze_sessioni)
+
+
 def aggiorna_attivita_sessione():
     if "username" not in session:
         return
-    sessioni = leggi_json(FILE_SESSIONI)
-    for s in sessioni:
-        if s["username"] == session["username"]:
-            s["last_activity"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            break
-    scrivi_json(FILE_SESSIONI, sessioni)
+    attivita_sessioni.registra(session["username"])
 
 
 def pulisci_sessioni_scadute():
-    sessioni = leggi_json(FILE_SESSIONI)
-    ora_corrente = datetime.now()
-    sessioni_attive = []
-    for s in sessioni:
-        last_activity = datetime.strptime(s["last_activity"], "%Y-%m-%d %H:%M:%S")
-        if (ora_corrente - last_activity).total_seconds() < 86400:
-            sessioni_attive.append(s)
-    if len(sessioni_attive) != len(sessioni):
-        scrivi_json(FILE_SESSIONI, sessioni_attive)
+    # Le date "%Y-%m-%d %H:%M:%S" si confrontano anche come stringhe
+    limite = (datetime.now() - timedelta(seconds=DURATA_SESSIONE)).strftime("%Y-%m-%d %H:%M:%S")
+    scadute = archivio.leggi_vista("sessioni", scadenze_sessioni, limite)
+    if scadute:
+        archivio.elimina("sessioni", session_id__in=scadute, last_activity__lte=limite)
 
 
 # ======== FUNZIONE CREA NOTIFICA ========
 def crea_notifica(username, tipo, titolo, messaggio, link=None):
-    notifiche = leggi_json(FILE_NOTIFICHE)
     nuova_notifica = {
-        "id": len(notifiche) + 1,
         "utente": username,
         "tipo": tipo,
         "titolo": titolo,
@@ -156,51 +1227,60 @@ def crea_notifica(username, tipo, titolo, messaggio, link=None):
         "data": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
         "data_lettura": None
     }
-    notifiche.append(nuova_notifica)
-    scrivi_json(FILE_NOTIFICHE, notifiche)
+    archivio.inserisci("notifiche", nuova_notifica)
     return nuova_notifica
 
 
 # ======== CONFIGURAZIONE EMAIL ========
-SMTP_SERVER = "smtp-mail.outlook.com"
-SMTP_PORT = 587
+SMTP_SERVER = os.getenv("SMTP_SERVER", "smtp-mail.outlook.com")
+SMTP_PORT = int(os.getenv("SMTP_PORT", 587))
+SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", "true") == "true"
 EMAIL_SENDER = "assistenzaregistroprof@outlook.com"
-EMAIL_PASSWORD = ""  # Inserisci la tua App Password di Outlook
+EMAIL_PASSWORD = os.getenv("EMAIL_PASSWORD", "")  # App Password di Outlook
 EMAIL_RECEIVER = "assistenzaregistroprof@outlook.com"
-SITE_URL = "http://localhost:5000"
+SITE_URL = os.getenv("SITE_URL", "http://localhost:5000")
+# Senza password si invia solo a un server indicato esplicitamente (es. python -m posta)
+EMAIL_ATTIVA = bool(EMAIL_PASSWORD) or "SMTP_SERVER" in os.environ
+
+# Le email partono da un thread in background (vedi posta.py): la richiesta
+# che crea il ticket si limita ad accodarle.
+coda_email = CodaEmail(archivio, "email",
+                       max_tentativi=int(os.getenv("EMAIL_TENTATIVI", 5)),
+                       attesa=float(os.getenv("EMAIL_ATTESA", 30)))
+mittente_email = MittenteEmail(coda_email, SMTP_SERVER, SMTP_PORT, EMAIL_SENDER, EMAIL_PASSWORD,
+                               starttls=SMTP_STARTTLS, contesto=app.app_context)
+if EMAIL_ATTIVA:
+    mittente_email.avvia()
+
+
+def accoda_email(destinatario, oggetto, html):
+    if not EMAIL_ATTIVA:
+        return False
+    coda_email.accoda(destinatario, oggetto, html)
+    mittente_email.sveglia()
+    return True
 
 
 def invia_email_ticket(ticket):
-    if not EMAIL_PASSWORD:
-        return False
-    try:
-        msg = MIMEMultipart("alternative")
-        msg["Subject"] = f"🎫 Nuovo Ticket #{ticket['id']}: {ticket['oggetto']}"
-        msg["From"] = EMAIL_SENDER
-        msg["To"] = EMAIL_RECEIVER
-        ticket_link = f"{SITE_URL}/admin#ticket-{ticket['id']}"
-        html = f"""
-        <html><body style="font-family: Arial, sans-serif; max-width: 600px; margin: 0 auto; padding: 20px;">
-            <div style="background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); padding: 20px; border-radius: 10px 10px 0 0; color: white;">
-                <h2 style="margin: 0;">🎫 Nuovo Ticket di Supporto</h2>
-                <p style="margin: 5px 0 0 0; opacity: 0.9;">Ticket #{ticket['id']}</p>
-            </div>
-            <div style="background: #f8f9fa; padding: 25px; border: 1px solid #e0e0e0; border-top: none;">
-                <p><strong>Utente:</strong> {ticket['utente']}</p>
-                <p><strong>Oggetto:</strong> {ticket['oggetto']}</p>
-                <p><strong>Messaggio:</strong> {ticket['messaggio']}</p>
-                <div style="text-align: center; margin: 30px 0;">
-                    <a href="{ticket_link}" style="background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); color: white; padding: 14px 35px; text-decoration: none; border-radius: 25px; font-weight: bold; display: inline-block;">👁️ Visualizza Ticket</a>
-                </div>
+    ticket_link = f"{SITE_URL}/admin#ticket-{ticket['id']}"
+    html = f"""
+    <html><body style="font-family: Arial, sans-serif; max-width: 600px; margin: 0 auto; padding: 20px;">
+        <div style="background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); padding: 20px; border-radius: 10px 10px 0 0; color: white;">
+            <h2 style="margin: 0;">🎫 Nuovo Ticket di Supporto</h2>
+            <p style="margin: 5px 0 0 0; opacity: 0.9;">Ticket #{ticket['id']}</p>
+        </div>
+        <div style="background: #f8f9fa; padding: 25px; border: 1px solid #e0e0e0; border-top: none;">
+            <p><strong>Utente:</strong> {ticket['utente']}</p>
+            <p><strong>Oggetto:</strong> {ticket['oggetto']}</p>
+            <p><strong>Messaggio:</strong> {ticket['messaggio']}</p>
+            <div style="text-align: center; margin: 30px 0;">
+                <a href="{ticket_link}" style="background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); color: white; padding: 14px 35px; text-decoration: none; border-radius: 25px; font-weight: bold; display: inline-block;">👁️ Visualizza Ticket</a>
             </div>
-        </body></html>
-        """
-        msg.attach(MIMEText(html, "html"))
-        with smtplib.SMTP(SMTP_SERVER, SMTP_PORT) as server:
-            server.starttls()
-            server.login(EMAIL_SENDER, EMAIL_PASSWORD)
-            server.send_message(msg)
-        return True
+        </div>
+    </body></html>
+    """
+    try:
+        return accoda_email(EMAIL_RECEIVER, f"🎫 Nuovo Ticket #{ticket['id']}: {ticket['oggetto']}", html)
     except Exception as e:
         print(f"❌ Errore invio email: {e}")
         return False
@@ -217,7 +1297,7 @@ def index():
 
 @app.route("/home")
 def home():
-    avvisi = leggi_json(FILE_AVVISI)
+    avvisi = archivio.tutti("avvisi", copia=False)
     avvisi_attivi = [a for a in avvisi if a.get("attivo", True)]
     return render_template("index.html", avvisi=avvisi_attivi)
 
@@ -231,36 +1311,35 @@ def login():
     if request.method == "POST":
         username = request.form.get("username")
         password = request.form.get("password")
-        utenti = leggi_json(FILE_UTENTI)
-        
-        for user in utenti:
-            if user["username"] == username and user["password"] == password:
-                # ✅ CONTROLLA STATO REGISTRAZIONE
-                if user.get("stato", "attivo") == "in_attesa":
-                    return render_template("login.html", error="⏳ Il tuo account è in attesa di approvazione da parte dell'admin.")
-                
-                # ✅ CONTROLLA STATO ACCOUNT (NUOVO)
-                account_status = user.get("account_status", "attivo")
-                
-                if account_status == "sospeso":
-                    return render_template("login.html", 
-                        error="⚠️ Il tuo account è SOSPESO. Contatta l'admin per maggiori informazioni.")
-                
-                if account_status == "bannato":
-                    return render_template("login.html", 
-                        error="❌ Il tuo account è BANNATO. Non puoi più accedere a questo servizio.")
-                
-                # ✅ Account attivo - procedi con login
-                session["username"] = username
-                session["role"] = user.get("role", "user")
-                session["session_id"] = genera_session_id()
-                registra_sessione(username)
-                
-                if session["role"] == "admin":
-                    return redirect(url_for("admin_dashboard"))
-                else:
-                    return redirect(url_for("user_dashboard"))
+        user = archivio.trova("utenti", username=username, password=password)
         
+        if user:
+            # ✅ CONTROLLA STATO REGISTRAZIONE
+            if user.get("stato", "attivo") == "in_attesa":
+                return render_template("login.html", error="⏳ Il tuo account è in attesa di approvazione da parte dell'admin.")
+            
+            # ✅ CONTROLLA STATO ACCOUNT (NUOVO)
+            account_status = user.get("account_status", "attivo")
+            
+            if account_status == "sospeso":
+                return render_template("login.html", 
+                    error="⚠️ Il tuo account è SOSPESO. Contatta l'admin per maggiori informazioni.")
+            
+            if account_status == "bannato":
+                return render_template("login.html", 
+                    error="❌ Il tuo account è BANNATO. Non puoi più accedere a questo servizio.")
+            
+            # ✅ Account attivo - procedi con login
+            session["username"] = username
+            session["role"] = user.get("role", "user")
+            session["session_id"] = genera_session_id()
+            registra_sessione(username)
+            
+            if session["role"] == "admin":
+                return redirect(url_for("admin_dashboard"))
+            else:
+                return redirect(url_for("user_dashboard"))
+    
         return render_template("login.html", error="Credenziali errate")
     
     return render_template("login.html")
@@ -276,29 +1355,18 @@ def recupero_password():
         if step == "1":
             username = request.form.get("username", "").strip()
             email = request.form.get("email", "").strip()
-            utenti = leggi_json(FILE_UTENTI)
-            utente_trovato = None
-            for u in utenti:
-                if u["username"] == username and u.get("email") == email:
-                    utente_trovato = u
-                    break
+            utente_trovato = archivio.trova("utenti", username=username, email=email)
             if not utente_trovato:
                 return render_template("recupero_password.html", errore="Username o email non trovati", step=1)
             codice = genera_codice_recupero()
             recupero = {"username": username, "codice": codice, "data_richiesta": datetime.now().strftime("%Y-%m-%d %H:%M:%S"), "usato": False}
-            recuperi = leggi_json(FILE_RECUPERO)
-            recuperi.append(recupero)
-            scrivi_json(FILE_RECUPERO, recuperi)
+            archivio.inserisci("recupero", recupero)
             return render_template("recupero_password.html", step=2, username=username, codice_mostrato=codice)
         elif step == "2":
             username = request.form.get("username", "").strip()
             codice_inserito = request.form.get("codice", "").strip()
-            recuperi = leggi_json(FILE_RECUPERO)
-            recupero_valido = None
-            for r in recuperi:
-                if r["username"] == username and r["codice"] == codice_inserito and not r.get("usato", False):
-                    recupero_valido = r
-                    break
+            recupero_valido = next((r for r in archivio.cerca("recupero", username=username, codice=codice_inserito)
+                                    if not r.get("usato", False)), None)
             if not recupero_valido:
                 return render_template("recupero_password.html", errore="Codice non valido o scaduto", step=2, username=username)
             return render_template("recupero_password.html", step=3, username=username, codice=codice_inserito)
@@ -310,18 +1378,8 @@ def recupero_password():
                 return render_template("recupero_password.html", errore="Password minima 4 caratteri", step=3, username=username)
             if nuova_password != conferma_password:
                 return render_template("recupero_password.html", errore="Le password non coincidono", step=3, username=username)
-            utenti = leggi_json(FILE_UTENTI)
-            for u in utenti:
-                if u["username"] == username:
-                    u["password"] = nuova_password
-                    break
-            scrivi_json(FILE_UTENTI, utenti)
-            recuperi = leggi_json(FILE_RECUPERO)
-            for r in recuperi:
-                if r["username"] == username and not r.get("usato", False):
-                    r["usato"] = True
-                    break
-            scrivi_json(FILE_RECUPERO, recuperi)
+            archivio.modifica("utenti", lambda u: u.update(password=nuova_password), username=username)
+            archivio.modifica("recupero", lambda r: r.update(usato=True), username=username, usato__ne=True)
             return render_template("recupero_password.html", successo="✅ Password aggiornata! Ora puoi accedere.")
     return render_template("recupero_password.html", step=1)
 # =====================================================
@@ -361,11 +1419,10 @@ def registrazione():
         except:
             errori.append("CAPTCHA errato")
         
-        utenti = leggi_json(FILE_UTENTI)
-        if any(u["username"] == username for u in utenti):
+        if archivio.trova("utenti", username=username):
             errori.append("Username già esistente")
         
-        if any(u.get("email") == email for u in utenti):
+        if archivio.trova("utenti", email=email):
             errori.append("Email già registrata")
         
         if errori:
@@ -375,9 +1432,7 @@ def registrazione():
                                    dati_inviati=request.form,
                                    captcha_domanda=session["captcha"]["domanda"])
         
-        registrazioni = leggi_json(FILE_REGISTRAZIONI)
         nuova_registrazione = {
-            "id": len(registrazioni) + 1,
             "username": username,
             "password": password,
             "email": email,
@@ -387,8 +1442,7 @@ def registrazione():
             "stato": "in_attesa",
             "admin_note": ""
         }
-        registrazioni.append(nuova_registrazione)
-        scrivi_json(FILE_REGISTRAZIONI, registrazioni)
+        archivio.inserisci("registrazioni", nuova_registrazione)
         
         session["captcha"] = genera_captcha()
         
@@ -403,9 +1457,7 @@ def registrazione():
 @app.route("/logout")
 def logout():
     if "username" in session:
-        sessioni = leggi_json(FILE_SESSIONI)
-        sessioni = [s for s in sessioni if s["username"] != session["username"]]
-        scrivi_json(FILE_SESSIONI, sessioni)
+        archivio.elimina("sessioni", username=session["username"])
     session.clear()
     return redirect(url_for("home"))
 
@@ -419,7 +1471,7 @@ def user_dashboard():
     if "username" not in session or session.get("role") != "user":
         return redirect(url_for("login"))
     aggiorna_attivita_sessione()
-    avvisi = leggi_json(FILE_AVVISI)
+    avvisi = archivio.tutti("avvisi", copia=False)
     avvisi_attivi = [a for a in avvisi if a.get("attivo", True)]
     return render_template("server.html", username=session["username"], avvisi=avvisi_attivi)
 
@@ -453,63 +1505,122 @@ def admin_required():
 # =====================================================
 
 @app.route("/api/notifiche", methods=["GET"])
+@con_etag("notifiche")
 def api_notifiche():
     if not login_required():
         return jsonify({"error": "Non autorizzato"}), 403
-    notifiche = leggi_json(FILE_NOTIFICHE)
-    mie_notifiche = [n for n in notifiche if n.get("utente") == session["username"]]
-    mie_notifiche.sort(key=lambda x: x.get("data", ""), reverse=True)
-    return jsonify(mie_notifiche)
+    if not richiesta_paginata():
+        return jsonify(archivio.leggi_vista("notifiche", caselle_notifiche, session["username"])["notifiche"])
+    limite = max(1, min(request.args.get("limit", LIMITE_PAGINA, type=int), LIMITE_PAGINA_MASSIMO))
+    try:
+        cursore = decodifica_cursore(request.args["cursor"]) if request.args.get("cursor") else None
+        casella = archivio.leggi_vista("notifiche", caselle_notifiche, session["username"], limite, cursore)
+    except ValueError:
+        return jsonify({"error": "Cursore non valido"}), 400
+    prossimo = casella["prossimo"]
+    return jsonify({"items": casella["notifiche"], "next_cursor": codifica_cursore(prossimo) if prossimo else None})
+
+@app.route("/api/notifiche/count", methods=["GET"])
+@con_etag("notifiche")
+def api_notifiche_count():
+    if not login_required():
+        return jsonify({"error": "Non autorizzato"}), 403
+    casella = archivio.leggi_vista("notifiche", caselle_notifiche, session["username"], 0)
+    return jsonify({"non_lette": casella["non_lette"], "totale": casella["totale"]})
 
 @app.route("/api/notifiche/<int:id>", methods=["PUT"])
 def api_notifica_letta(id):
     if not login_required():
         return jsonify({"error": "Non autorizzato"}), 403
-    notifiche = leggi_json(FILE_NOTIFICHE)
-    indice = next((i for i, n in enumerate(notifiche) if n["id"] == id), None)
-    if indice is None:
-        return jsonify({"error": "Notifica non trovata"}), 404
-    if notifiche[indice].get("utente") != session["username"]:
+    notifica = archivio.trova("notifiche", id=id, utente=session["username"])
+    if notifica is None:
+        if archivio.trova("notifiche", id=id) is None:
+            return jsonify({"error": "Notifica non trovata"}), 404
         return jsonify({"error": "Non autorizzato"}), 403
-    notifiche[indice]["letta"] = True
-    notifiche[indice]["data_lettura"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    scrivi_json(FILE_NOTIFICHE, notifiche)
+    if notifica.get("letta"):
+        return jsonify({"success": True})
+    ora = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    archivio.modifica("notifiche", lambda n: n.update(letta=True, data_lettura=ora), id=id,
+                      utente=session["username"])
     return jsonify({"success": True})
 
 @app.route("/api/notifiche/segna-tutte-lette", methods=["POST"])
 def api_notifiche_tutte_lette():
     if not login_required():
         return jsonify({"error": "Non autorizzato"}), 403
-    notifiche = leggi_json(FILE_NOTIFICHE)
-    for n in notifiche:
-        if n.get("utente") == session["username"] and not n.get("letta", False):
-            n["letta"] = True
-            n["data_lettura"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    scrivi_json(FILE_NOTIFICHE, notifiche)
+    ora = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    archivio.modifica_tutti("notifiche", lambda n: n.update(letta=True, data_lettura=ora),
+                            utente=session["username"], letta__ne=True)
     return jsonify({"success": True})
 
 
+# =====================================================
+# ============= STREAM EVENTI (SSE) ===================
+# =====================================================
+
+@app.route("/api/stream", methods=["GET"])
+def api_stream():
+    """Server-Sent Events: voti, recensioni, professori, avvisi, notifiche.
+
+    Il client ricarica solo ciò che è cambiato. Ogni giro costa una stat del
+    registro eventi; la connessione si chiude dopo STREAM_DURATA secondi e
+    EventSource si riconnette da solo riprendendo da Last-Event-ID.
+    """
+    if not login_required():
+        return jsonify({"error": "Non autorizzato"}), 403
+    username = session["username"]
+    cursore = CanaleEventi.cursore_da_id(request.headers.get("Last-Event-ID")) or eventi.posizione()
+
+    def genera(cursore):
+        yield "retry: 3000\n\n"
+        inizio = ultimo_invio = time.monotonic()
+        while time.monotonic() - inizio < STREAM_DURATA:
+            nuovi, cursore = eventi.leggi_da(cursore)
+            # Più eventi dello stesso tipo nello stesso giro: basta un solo ricaricamento
+            tipi = []
+            for evento in nuovi:
+                if evento.get("tipo") == "notifiche" and evento.get("utente") != username:
+                    continue
+                if evento.get("tipo") not in tipi:
+                    tipi.append(evento.get("tipo"))
+            for tipo in tipi:
+                yield f"id: {CanaleEventi.id_da_cursore(cursore)}\nevent: {tipo}\ndata: {{}}\n\n"
+            if tipi:
+                ultimo_invio = time.monotonic()
+            elif time.monotonic() - ultimo_invio > 15:
+                # Commento SSE: tiene aperta la connessione attraverso i proxy
+                yield ": ping\n\n"
+                ultimo_invio = time.monotonic()
+            time.sleep(STREAM_INTERVALLO)
+
+    return Response(genera(cursore), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
 # =====================================================
 # ============= TICKET API ============================
 # =====================================================
 
 @app.route("/api/ticket", methods=["GET", "POST"])
+@con_etag("ticket")
 def api_ticket():
     if not login_required():
         return jsonify({"error": "Non autorizzato"}), 403
-    ticket_list = leggi_json(FILE_TICKET)
     if request.method == "GET":
+        if richiesta_paginata():
+            if session["role"] == "admin":
+                return risposta_paginata("ticket", ordine=("id",))
+            return risposta_paginata("ticket", ordine=("id",), utente=session["username"])
         if session["role"] == "admin":
-            return jsonify(ticket_list)
+            return jsonify(archivio.tutti("ticket", copia=False))
         else:
-            miei_ticket = [t for t in ticket_list if t.get("utente") == session["username"]]
+            miei_ticket = archivio.cerca("ticket", copia=False, utente=session["username"])
             return jsonify(miei_ticket)
     elif request.method == "POST":
         if session["role"] == "admin":
             return jsonify({"error": "Gli admin non possono creare ticket"}), 403
         data = request.get_json()
         nuovo_ticket = {
-            "id": len(ticket_list) + 1,
             "utente": session["username"],
             "oggetto": data.get("oggetto", ""),
             "messaggio": data.get("messaggio", ""),
@@ -520,21 +1631,19 @@ def api_ticket():
             "admin_assegnato": None,
             "risposte": []
         }
-        ticket_list.append(nuovo_ticket)
-        scrivi_json(FILE_TICKET, ticket_list)
-        utenti = leggi_json(FILE_UTENTI)
-        admin_list = [u["username"] for u in utenti if u.get("role") == "admin"]
+        archivio.inserisci("ticket", nuovo_ticket)
+        admin_list = [u["username"] for u in archivio.cerca("utenti", copia=False, role="admin")]
         for admin_username in admin_list:
             crea_notifica(username=admin_username, tipo="ticket", titolo=f"🎫 Nuovo Ticket #{nuovo_ticket['id']}", messaggio=f"{session['username']} ha creato un nuovo ticket: {nuovo_ticket['oggetto']}", link="/admin#ticket")
         invia_email_ticket(nuovo_ticket)
         return jsonify({"success": True, "message": "Ticket creato", "ticket_id": nuovo_ticket["id"]})
 
 @app.route("/api/ticket/<int:id>", methods=["GET", "PUT", "DELETE"])
+@con_etag("ticket")
 def api_ticket_dettaglio(id):
     if not login_required():
         return jsonify({"error": "Non autorizzato"}), 403
-    ticket_list = leggi_json(FILE_TICKET)
-    ticket = next((t for t in ticket_list if t["id"] == id), None)
+    ticket = archivio.trova("ticket", id=id)
     if not ticket:
         return jsonify({"error": "Ticket non trovato"}), 404
     is_admin = session["role"] == "admin"
@@ -545,29 +1654,28 @@ def api_ticket_dettaglio(id):
         return jsonify(ticket)
     elif request.method == "PUT":
         data = request.get_json()
-        if is_admin:
-            if "stato" in data and data["stato"] in ["aperto", "in_lavorazione", "risolto", "chiuso"]:
-                ticket["stato"] = data["stato"]
-                if data["stato"] in ["risolto", "chiuso"]:
-                    ticket["data_chiusura"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            if "risposta" in data and data["risposta"]:
-                risposta = {"da": "admin", "admin": session["username"], "messaggio": data["risposta"], "data": datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
-                ticket["risposte"].append(risposta)
-                crea_notifica(username=ticket["utente"], tipo="ticket", titolo="💬 Risposta al tuo ticket", messaggio=f"L'admin {session['username']} ha risposto al ticket #{id}", link="/user#ticket")
-        elif is_creatore and ticket["stato"] == "aperto":
-            if "messaggio" in data and data["messaggio"]:
-                risposta = {"da": "utente", "utente": session["username"], "messaggio": data["messaggio"], "data": datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
-                ticket["risposte"].append(risposta)
-        for i, t in enumerate(ticket_list):
-            if t["id"] == id:
-                ticket_list[i] = ticket
-                break
-        scrivi_json(FILE_TICKET, ticket_list)
+
+        def aggiorna_ticket(ticket):
+            if is_admin:
+                if "stato" in data and data["stato"] in ["aperto", "in_lavorazione", "risolto", "chiuso"]:
+                    ticket["stato"] = data["stato"]
+                    if data["stato"] in ["risolto", "chiuso"]:
+                        ticket["data_chiusura"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                if "risposta" in data and data["risposta"]:
+                    risposta = {"da": "admin", "admin": session["username"], "messaggio": data["risposta"], "data": datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
+                    ticket["risposte"].append(risposta)
+            elif is_creatore and ticket["stato"] == "aperto":
+                if "messaggio" in data and data["messaggio"]:
+                    risposta = {"da": "utente", "utente": session["username"], "messaggio": data["messaggio"], "data": datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
+                    ticket["risposte"].append(risposta)
+
+        archivio.modifica("ticket", aggiorna_ticket, id=id)
+        if is_admin and data.get("risposta"):
+            crea_notifica(username=ticket["utente"], tipo="ticket", titolo="💬 Risposta al tuo ticket", messaggio=f"L'admin {session['username']} ha risposto al ticket #{id}", link="/user#ticket")
         return jsonify({"success": True, "message": "Ticket aggiornato"})
     elif request.method == "DELETE":
         if is_admin or (is_creatore and len(ticket.get("risposte", [])) == 0):
-            ticket_list = [t for t in ticket_list if t["id"] != id]
-            scrivi_json(FILE_TICKET, ticket_list)
+            archivio.elimina("ticket", id=id)
             return jsonify({"success": True, "message": "Ticket eliminato"})
         else:
             return jsonify({"error": "Non puoi eliminare ticket con risposte"}), 403
@@ -578,33 +1686,30 @@ def api_ticket_dettaglio(id):
 # =====================================================
 
 @app.route("/api/registrazioni", methods=["GET"])
+@con_etag("registrazioni")
 def api_registrazioni_lista():
     if not admin_required():
         return jsonify({"error": "Non autorizzato. Solo admin."}), 403
-    return jsonify(leggi_json(FILE_REGISTRAZIONI))
+    return lista_in_streaming(archivio.scorri("registrazioni"))
 
 @app.route("/api/registrazioni/<int:id>", methods=["PUT", "DELETE"])
 def api_registrazioni_gestisci(id):
     if not admin_required():
         return jsonify({"error": "Non autorizzato. Solo admin."}), 403
-    registrazioni = leggi_json(FILE_REGISTRAZIONI)
-    indice = next((i for i, r in enumerate(registrazioni) if r["id"] == id), None)
-    if indice is None:
+    if archivio.trova("registrazioni", id=id) is None:
         return jsonify({"error": "Registrazione non trovata"}), 404
     if request.method == "DELETE":
-        registrazioni.pop(indice)
-        scrivi_json(FILE_REGISTRAZIONI, registrazioni)
+        archivio.elimina("registrazioni", id=id)
         return jsonify({"success": True, "message": "Registrazione eliminata"})
     if request.method == "PUT":
         data = request.get_json()
         if "stato" in data and data["stato"] in ["approvato", "rifiutato"]:
-            registrazioni[indice]["stato"] = data["stato"]
-            registrazioni[indice]["admin_note"] = data.get("admin_note", "")
-            registrazioni[indice]["data_approvazione"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            scrivi_json(FILE_REGISTRAZIONI, registrazioni)
+            reg = archivio.modifica("registrazioni", lambda r: r.update(
+                stato=data["stato"],
+                admin_note=data.get("admin_note", ""),
+                data_approvazione=datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            ), id=id)
             if data["stato"] == "approvato":
-                reg = registrazioni[indice]
-                utenti = leggi_json(FILE_UTENTI)
                 nuovo_utente = {
                     "username": reg["username"],
                     "password": reg["password"],
@@ -622,56 +1727,24 @@ def api_registrazioni_gestisci(id):
                     "admin_note": "",
                     "account_status": "attivo"
                 }
-                utenti.append(nuovo_utente)
-                scrivi_json(FILE_UTENTI, utenti)
+                archivio.inserisci("utenti", nuovo_utente)
                 crea_notifica(username=reg["username"], tipo="registrazione", titolo="✅ Registrazione approvata", messaggio="Il tuo account è stato approvato! Ora puoi accedere.", link="/login")
             return jsonify({"success": True, "message": f"Registrazione {data['stato']}"})
         return jsonify({"error": "Stato non valido"}), 400
-# DOPO aver salvato la registrazione, aggiungi questo:
-
-# Se siamo su Render con SQLite, approva automaticamente la registrazione
-if os.getenv("USE_SQLITE") == "true":
-    # Crea direttamente l'utente nella tabella users
-    nuovo_utente = User(
-        username=username,
-        password=password,
-        email=email,
-        nome_cognome=nome_cognome,
-        scuola=scuola,
-        role="user",
-        stato="attivo",
-        account_status="attivo"
-    )
-    db.session.add(nuovo_utente)
-    db.session.commit()
-    
-        # Comportamento normale: salva in attesa di approvazione
-    registrazioni = leggi_json(FILE_REGISTRAZIONI)
-    # ... codice esistente ...
-
 @app.route("/api/registrazioni/<int:id>/modifica", methods=["PUT"])
 def api_registrazioni_modifica(id):
     if not admin_required():
         return jsonify({"error": "Non autorizzato. Solo admin."}), 403
-    registrazioni = leggi_json(FILE_REGISTRAZIONI)
-    indice = next((i for i, r in enumerate(registrazioni) if r["id"] == id), None)
-    if indice is None:
+    if archivio.trova("registrazioni", id=id) is None:
         return jsonify({"error": "Registrazione non trovata"}), 404
     data = request.get_json()
     if "username" in data:
-        utenti = leggi_json(FILE_UTENTI)
-        if any(u["username"] == data["username"] for u in utenti):
+        if archivio.trova("utenti", username=data["username"]):
             return jsonify({"error": "Username già esistente"}), 400
-        registrazioni[indice]["username"] = data["username"]
-    if "email" in data:
-        registrazioni[indice]["email"] = data["email"]
-    if "nome_cognome" in data:
-        registrazioni[indice]["nome_cognome"] = data["nome_cognome"]
-    if "scuola" in data:
-        registrazioni[indice]["scuola"] = data["scuola"]
+    campi = {k: data[k] for k in ("username", "email", "nome_cognome", "scuola") if k in data}
     if "password" in data and data["password"]:
-        registrazioni[indice]["password"] = data["password"]
-    scrivi_json(FILE_REGISTRAZIONI, registrazioni)
+        campi["password"] = data["password"]
+    archivio.modifica("registrazioni", lambda r: r.update(campi), id=id)
     return jsonify({"success": True, "message": "Dati aggiornati"})
 
 
@@ -680,6 +1753,7 @@ def api_registrazioni_modifica(id):
 # =====================================================
 
 @app.route("/api/utenti-anagrafica/<int:index>", methods=["GET", "PUT"])
+@con_etag("utenti", "voti", "recensioni", "sessioni")
 def api_utenti_anagrafica(index):
     """
     GET: Ottieni scheda anagrafica completa di un utente
@@ -688,18 +1762,12 @@ def api_utenti_anagrafica(index):
     if not login_required():
         return jsonify({"error": "Non autorizzato"}), 403
     
-    utenti = leggi_json(FILE_UTENTI)
-    if index >= len(utenti):
+    utente = archivio.in_posizione("utenti", index)
+    if utente is None:
         return jsonify({"error": "Utente non trovato"}), 404
     
-    utente = utenti[index]
-    
     if request.method == "GET":
-        # Calcola statistiche
-        voti_list = leggi_json(FILE_VOTI)
-        recensioni_list = leggi_json(FILE_RECENSIONI)
-        sessioni_list = leggi_json(FILE_SESSIONI)
-        
+        attivita = riepilogo_attivita(utente["username"])
         anagrafica = {
             "id": index,
             "username": utente.get("username", ""),
@@ -716,24 +1784,18 @@ def api_utenti_anagrafica(index):
             "account_status": utente.get("account_status", "attivo"),
             "admin_note": utente.get("admin_note", ""),
             "created_at": utente.get("created_at", "N/A"),
-            "last_login": "N/A",
-            "voti_count": len([v for v in voti_list if v.get("user") == utente["username"]]),
-            "recensioni_count": len([r for r in recensioni_list if r.get("user") == utente["username"]]),
-            "sessioni_attive": len([s for s in sessioni_list if s["username"] == utente["username"]])
+            "last_login": attivita["last_login"],
+            "voti_count": attivita["voti_count"],
+            "recensioni_count": attivita["recensioni_count"],
+            "sessioni_attive": attivita["sessioni_attive"]
         }
-        
-        # Trova ultimo login
-        sessioni_utente = [s for s in sessioni_list if s["username"] == utente["username"]]
-        if sessioni_utente:
-            anagrafica["last_login"] = max(s["login_time"] for s in sessioni_utente)
-        
         return jsonify(anagrafica)
     
     elif request.method == "PUT":
         if not admin_required():
             return jsonify({"error": "Solo admin possono modificare"}), 403
         
-        if utenti[index]["username"] == session["username"]:
+        if utente["username"] == session["username"]:
             return jsonify({"error": "Non puoi modificare il tuo stesso account"}), 403
         
         data = request.get_json()
@@ -742,15 +1804,13 @@ def api_utenti_anagrafica(index):
         campi_modificabili = ["email", "nome_cognome", "scuola", "telefono", "data_nascita", 
                              "indirizzo", "citta", "cap", "account_status", "admin_note", "role"]
         
-        for campo in campi_modificabili:
-            if campo in data:
-                utenti[index][campo] = data[campo]
+        campi = {campo: data[campo] for campo in campi_modificabili if campo in data}
         
         # Se cambia password
         if "password" in data and data["password"]:
-            utenti[index]["password"] = data["password"]
+            campi["password"] = data["password"]
         
-        scrivi_json(FILE_UTENTI, utenti)
+        archivio.modifica("utenti", lambda u: u.update(campi), indice=index)
         
         # Notifica all'utente se ci sono modifiche importanti
         if "account_status" in data or "role" in data:
@@ -764,7 +1824,7 @@ def api_utenti_anagrafica(index):
             
             if status_msg:
                 crea_notifica(
-                    username=utenti[index]["username"],
+                    username=utente["username"],
                     tipo="sistema",
                     titolo="⚙️ Stato account aggiornato",
                     messaggio=status_msg,
@@ -778,54 +1838,87 @@ def api_utenti_anagrafica(index):
 # =====================================================
 
 @app.route("/api/sessioni", methods=["GET"])
+@con_etag("sessioni")
 def api_sessioni_lista():
     if not admin_required():
         return jsonify({"error": "Non autorizzato. Solo admin."}), 403
-    return jsonify(leggi_json(FILE_SESSIONI))
+    return lista_in_streaming(archivio.scorri("sessioni"))
 
 @app.route("/api/sessioni/<session_id>", methods=["DELETE"])
 def api_sessioni_termina(session_id):
     if not admin_required():
         return jsonify({"error": "Non autorizzato. Solo admin."}), 403
-    sessioni = leggi_json(FILE_SESSIONI)
-    sessione_trovata = next((s for s in sessioni if s["session_id"] == session_id), None)
+    sessione_trovata = archivio.trova("sessioni", session_id=session_id)
     if not sessione_trovata:
         return jsonify({"error": "Sessione non trovata"}), 404
     if sessione_trovata["username"] == session["username"]:
         return jsonify({"error": "Non puoi disconnettere te stesso"}), 403
-    sessioni = [s for s in sessioni if s["session_id"] != session_id]
-    scrivi_json(FILE_SESSIONI, sessioni)
+    archivio.elimina("sessioni", session_id=session_id)
     return jsonify({"success": True, "message": f"Sessione di {sessione_trovata['username']} terminata"})
 
 
+# =====================================================
+# ============= STATISTICHE CACHE =====================
+# =====================================================
+
+@app.route("/api/cache/statistiche", methods=["GET"])
+def api_cache_statistiche():
+    if not admin_required():
+        return jsonify({"error": "Non autorizzato. Solo admin."}), 403
+    return jsonify(statistiche_cache_json())
+
+
+# =====================================================
+# ==================== METRICHE =======================
+# =====================================================
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """Metriche in formato Prometheus: per gli admin o con Authorization: Bearer METRICHE_TOKEN."""
+    token = METRICHE_TOKEN and secrets.compare_digest(request.headers.get("Authorization", "").encode(),
+                                                      f"Bearer {METRICHE_TOKEN}".encode())
+    if not admin_required() and not token:
+        return jsonify({"error": "Non autorizzato. Solo admin."}), 403
+    return Response(registro_metriche.esponi(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.route("/api/richieste-lente", methods=["GET"])
+def api_richieste_lente():
+    """Ultime richieste lente con gli span, dalla più recente: ?limit=N[&endpoint=...]."""
+    if not admin_required():
+        return jsonify({"error": "Non autorizzato. Solo admin."}), 403
+    limite = max(1, min(request.args.get("limit", LIMITE_PAGINA, type=int), LIMITE_PAGINA_MASSIMO))
+    endpoint = request.args.get("endpoint")
+    filtro = (lambda r: r.get("endpoint") == endpoint) if endpoint else None
+    return jsonify({"soglia_ms": SOGLIA_LENTA_MS, "richieste": richieste_lente.ultimi(limite, filtro)})
+
+
 # =====================================================
 # ========== SEGNALAZIONI UTENTI ======================
 # =====================================================
 
 @app.route("/api/segnalazioni", methods=["GET", "POST"])
+@con_etag("segnalazioni")
 def api_segnalazioni():
     if request.method == "GET":
         if not admin_required():
             return jsonify({"error": "Non autorizzato. Solo admin."}), 403
-        return jsonify(leggi_json(FILE_SEGNALAZIONI))
+        return jsonify(archivio.tutti("segnalazioni", copia=False))
     elif request.method == "POST":
         if not login_required():
             return jsonify({"error": "Non autorizzato"}), 403
         data = request.get_json()
-        segnalazioni_esistenti = leggi_json(FILE_SEGNALAZIONI)
         nuova_segnalazione = {
-            "id": len(segnalazioni_esistenti) + 1,
             "tipo": data.get("tipo", "recensione"),
+            "elemento_id": data.get("elemento_id"),
             "indice": data.get("indice"),
             "motivo": data.get("motivo", ""),
             "segnalatore": session["username"],
             "data": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
             "stato": "pending"
         }
-        segnalazioni_esistenti.append(nuova_segnalazione)
-        scrivi_json(FILE_SEGNALAZIONI, segnalazioni_esistenti)
-        utenti = leggi_json(FILE_UTENTI)
-        admin_list = [u["username"] for u in utenti if u.get("role") == "admin"]
+        archivio.inserisci("segnalazioni", nuova_segnalazione)
+        admin_list = [u["username"] for u in archivio.cerca("utenti", copia=False, role="admin")]
         for admin_username in admin_list:
             crea_notifica(username=admin_username, tipo="segnalazione", titolo="🚩 Nuova Segnalazione", messaggio=f"{session['username']} ha segnalato un contenuto", link="/admin#segnalazioni")
         return jsonify({"success": True, "message": "Segnalazione inviata"})
@@ -834,21 +1927,19 @@ def api_segnalazioni():
 def api_segnalazioni_gestisci(id):
     if not admin_required():
         return jsonify({"error": "Non autorizzato. Solo admin."}), 403
-    segnalazioni = leggi_json(FILE_SEGNALAZIONI)
-    indice = next((i for i, s in enumerate(segnalazioni) if s["id"] == id), None)
-    if indice is None:
+    if archivio.trova("segnalazioni", id=id) is None:
         return jsonify({"error": "Segnalazione non trovata"}), 404
     if request.method == "DELETE":
-        segnalazioni.pop(indice)
-        scrivi_json(FILE_SEGNALAZIONI, segnalazioni)
+        archivio.elimina("segnalazioni", id=id)
         return jsonify({"success": True, "message": "Segnalazione eliminata"})
     if request.method == "PUT":
         data = request.get_json()
         if "stato" in data and data["stato"] in ["pending", "resolved", "dismissed"]:
-            segnalazioni[indice]["stato"] = data["stato"]
-            segnalazioni[indice]["admin_note"] = data.get("admin_note", "")
-            segnalazioni[indice]["data_chiusura"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            scrivi_json(FILE_SEGNALAZIONI, segnalazioni)
+            archivio.modifica("segnalazioni", lambda s: s.update(
+                stato=data["stato"],
+                admin_note=data.get("admin_note", ""),
+                data_chiusura=datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            ), id=id)
             return jsonify({"success": True, "message": f"Segnalazione {data['stato']}"})
         return jsonify({"error": "Stato non valido"}), 400
 
@@ -858,20 +1949,20 @@ def api_segnalazioni_gestisci(id):
 # =====================================================
 
 @app.route("/api/utenti", methods=["GET"])
+@con_etag("utenti", "voti", "recensioni")
 def api_utenti_lista():
     if not admin_required():
         return jsonify({"error": "Non autorizzato. Solo admin."}), 403
-    utenti = leggi_json(FILE_UTENTI)
-    voti_list = leggi_json(FILE_VOTI)
-    recensioni_list = leggi_json(FILE_RECENSIONI)
+    voti = archivio.leggi_vista("voti", voti_per_utente)
+    recensioni = archivio.leggi_vista("recensioni", recensioni_per_utente)
     dati_utenti = []
-    for u in utenti:
+    for u in archivio.tutti("utenti", copia=False):
         dati_utenti.append({
             "username": u["username"],
             "role": u.get("role", "user"),
             "created_at": u.get("created_at", "N/A"),
-            "voti_count": len([v for v in voti_list if v.get("user") == u["username"]]),
-            "recensioni_count": len([r for r in recensioni_list if r.get("user") == u["username"]])
+            "voti_count": voti.get(u["username"], 0),
+            "recensioni_count": recensioni.get(u["username"], 0)
         })
     return jsonify(dati_utenti)
 
@@ -879,21 +1970,19 @@ def api_utenti_lista():
 def api_utenti_mod(index):
     if not admin_required():
         return jsonify({"error": "Non autorizzato. Solo admin."}), 403
-    utenti = leggi_json(FILE_UTENTI)
-    if index >= len(utenti):
+    utente = archivio.in_posizione("utenti", index)
+    if utente is None:
         return jsonify({"error": "Utente non trovato"}), 404
-    if utenti[index]["username"] == session["username"]:
+    if utente["username"] == session["username"]:
         return jsonify({"error": "Non puoi modificare il tuo stesso account"}), 403
     if request.method == "DELETE":
-        username_eliminato = utenti[index]["username"]
-        utenti.pop(index)
-        scrivi_json(FILE_UTENTI, utenti)
+        username_eliminato = utente["username"]
+        archivio.elimina("utenti", indice=index)
         return jsonify({"success": True, "message": f"Utente {username_eliminato} eliminato"})
     if request.method == "PUT":
         data = request.get_json()
         if "role" in data:
-            utenti[index]["role"] = data["role"]
-            scrivi_json(FILE_UTENTI, utenti)
+            archivio.modifica("utenti", lambda u: u.update(role=data["role"]), indice=index)
             return jsonify({"success": True, "message": f"Ruolo aggiornato a {data['role']}"})
         return jsonify({"error": "Dati non validi"}), 400
 
@@ -909,8 +1998,7 @@ def api_utenti_crea():
         return jsonify({"error": "Username e password richiesti"}), 400
     if role not in ["user", "admin"]:
         return jsonify({"error": "Ruolo non valido. Usa 'user' o 'admin'"}), 400
-    utenti = leggi_json(FILE_UTENTI)
-    if any(u["username"] == username for u in utenti):
+    if archivio.trova("utenti", username=username):
         return jsonify({"error": "Username già esistente"}), 400
     nuovo_utente = {
         "username": username,
@@ -925,30 +2013,30 @@ def api_utenti_crea():
         "admin_note": "",
         "account_status": "attivo"
     }
-    utenti.append(nuovo_utente)
-    scrivi_json(FILE_UTENTI, utenti)
+    archivio.inserisci("utenti", nuovo_utente)
     return jsonify({"success": True, "message": f"Utente {username} creato con ruolo {role}"})
 
 @app.route("/api/utenti/<int:index>/credenziali", methods=["PUT"])
 def api_utenti_modifica_credenziali(index):
     if not admin_required():
         return jsonify({"error": "Non autorizzato. Solo admin."}), 403
-    utenti = leggi_json(FILE_UTENTI)
-    if index >= len(utenti):
+    utente = archivio.in_posizione("utenti", index)
+    if utente is None:
         return jsonify({"error": "Utente non trovato"}), 404
-    if utenti[index]["username"] == session["username"]:
+    if utente["username"] == session["username"]:
         return jsonify({"error": "Non puoi modificare il tuo stesso account"}), 403
     data = request.get_json()
     nuovo_username = data.get("username", "").strip()
     nuova_password = data.get("password", "").strip()
-    if nuovo_username and nuovo_username != utenti[index]["username"]:
-        if any(u["username"] == nuovo_username for u in utenti):
+    campi = {}
+    if nuovo_username and nuovo_username != utente["username"]:
+        if archivio.trova("utenti", username=nuovo_username):
             return jsonify({"error": "Username già esistente"}), 400
-        utenti[index]["username"] = nuovo_username
+        campi["username"] = nuovo_username
     if nuova_password:
-        utenti[index]["password"] = nuova_password
-    scrivi_json(FILE_UTENTI, utenti)
-    return jsonify({"success": True, "message": "Credenziali aggiornate", "username": utenti[index]["username"]})
+        campi["password"] = nuova_password
+    utente = archivio.modifica("utenti", lambda u: u.update(campi), indice=index)
+    return jsonify({"success": True, "message": "Credenziali aggiornate", "username": utente["username"]})
 
 
 # =====================================================
@@ -956,41 +2044,40 @@ def api_utenti_modifica_credenziali(index):
 # =====================================================
 
 @app.route("/api/profilo", methods=["GET", "PUT"])
+@con_etag("utenti")
 def api_profilo():
     if not login_required():
         return jsonify({"error": "Non autorizzato"}), 403
     if request.method == "GET":
-        utenti = leggi_json(FILE_UTENTI)
-        for u in utenti:
-            if u["username"] == session["username"]:
-                return jsonify({
-                    "username": u["username"],
-                    "email": u.get("email", ""),
-                    "nome_cognome": u.get("nome_cognome", ""),
-                    "scuola": u.get("scuola", ""),
-                    "role": u.get("role", "user"),
-                    "created_at": u.get("created_at", "N/A")
-                })
+        u = archivio.trova("utenti", username=session["username"])
+        if u:
+            return jsonify({
+                "username": u["username"],
+                "email": u.get("email", ""),
+                "nome_cognome": u.get("nome_cognome", ""),
+                "scuola": u.get("scuola", ""),
+                "role": u.get("role", "user"),
+                "created_at": u.get("created_at", "N/A")
+            })
         return jsonify({"error": "Utente non trovato"}), 404
     elif request.method == "PUT":
         data = request.get_json()
-        utenti = leggi_json(FILE_UTENTI)
-        indice = next((i for i, u in enumerate(utenti) if u["username"] == session["username"]), None)
-        if indice is None:
+        if archivio.trova("utenti", username=session["username"]) is None:
             return jsonify({"error": "Utente non trovato"}), 404
+        campi = {}
         if "email" in data and data["email"]:
             if "@" not in data["email"]:
                 return jsonify({"error": "Email non valida"}), 400
-            utenti[indice]["email"] = data["email"]
+            campi["email"] = data["email"]
         if "nome_cognome" in data and data["nome_cognome"]:
-            utenti[indice]["nome_cognome"] = data["nome_cognome"]
+            campi["nome_cognome"] = data["nome_cognome"]
         if "scuola" in data and data["scuola"]:
-            utenti[indice]["scuola"] = data["scuola"]
+            campi["scuola"] = data["scuola"]
         if "password" in data and data["password"]:
             if len(data["password"]) < 4:
                 return jsonify({"error": "Password minima 4 caratteri"}), 400
-            utenti[indice]["password"] = data["password"]
-        scrivi_json(FILE_UTENTI, utenti)
+            campi["password"] = data["password"]
+        archivio.modifica("utenti", lambda u: u.update(campi), username=session["username"])
         return jsonify({"success": True, "message": "Profilo aggiornato"})
 
 
@@ -999,11 +2086,11 @@ def api_profilo():
 # =====================================================
 
 @app.route("/api/storico-voti", methods=["GET"])
+@con_etag("voti")
 def api_storico_voti():
     if not login_required():
         return jsonify({"error": "Non autorizzato"}), 403
-    voti = leggi_json(FILE_VOTI)
-    miei_voti = [v for v in voti if v.get("user") == session["username"]]
+    miei_voti = archivio.cerca("voti", user=session["username"])
     for i, v in enumerate(miei_voti):
         v["index"] = i
     return jsonify(miei_voti)
@@ -1014,180 +2101,233 @@ def api_storico_voti():
 # =====================================================
 
 @app.route("/api/voti", methods=["GET", "POST"])
+@con_etag("voti")
 def api_voti():
     if not login_required():
         return jsonify({"error": "Non autorizzato"}), 403
-    voti = leggi_json(FILE_VOTI)
+    if request.method == "GET":
+        if richiesta_paginata():
+            return risposta_paginata("voti")
+        return lista_in_streaming(archivio.scorri("voti"))
     if request.method == "POST":
         nuovo = request.json
+        # L'id lo assegna il contatore
+        nuovo.pop("id", None)
         nuovo["user"] = session["username"]
         nuovo["timestamp"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        voti.append(nuovo)
-        scrivi_json(FILE_VOTI, voti)
+        archivio.inserisci("voti", nuovo)
         return jsonify({"success": True})
-    return jsonify(voti)
 
-@app.route("/api/voti/<int:index>", methods=["PUT", "DELETE"])
-def api_voti_mod(index):
+@app.route("/api/statistiche/professori", methods=["GET"])
+@con_etag("voti")
+def api_statistiche_professori():
     if not login_required():
         return jsonify({"error": "Non autorizzato"}), 403
-    voti = leggi_json(FILE_VOTI)
-    if index >= len(voti):
-        return jsonify({"error": "Indice non valido"}), 400
-    if session["role"] != "admin" and voti[index]["user"] != session["username"]:
+    statistiche = archivio.leggi_vista("voti", statistiche_professori)
+    for campo in ("nomeProf", "materia", "scuola"):
+        if request.args.get(campo):
+            statistiche = [g for g in statistiche if g[campo] == request.args[campo]]
+    return jsonify(statistiche)
+
+@app.route("/api/voti/id/<int:id>", methods=["GET", "PUT", "DELETE"])
+@con_etag("voti")
+def api_voto(id):
+    if not login_required():
+        return jsonify({"error": "Non autorizzato"}), 403
+    voto = archivio.trova("voti", id=id)
+    if voto is None:
+        return jsonify({"error": "Voto non trovato"}), 404
+    if request.method == "GET":
+        return jsonify(voto)
+    if session["role"] != "admin" and voto["user"] != session["username"]:
         return jsonify({"error": "Non autorizzato. Puoi modificare solo i tuoi voti."}), 403
     if request.method == "DELETE":
-        voti.pop(index)
-        scrivi_json(FILE_VOTI, voti)
+        archivio.elimina("voti", id=id)
         return jsonify({"success": True})
     if request.method == "PUT":
         dati_modifica = request.json
-        voti[index]["voto"] = dati_modifica.get("voto", voti[index]["voto"])
-        voti[index]["nomeProf"] = dati_modifica.get("nomeProf", voti[index]["nomeProf"])
-        voti[index]["materia"] = dati_modifica.get("materia", voti[index]["materia"])
-        voti[index]["scuola"] = dati_modifica.get("scuola", voti[index]["scuola"])
-        scrivi_json(FILE_VOTI, voti)
+        campi = {k: dati_modifica[k] for k in ("voto", "nomeProf", "materia", "scuola") if k in dati_modifica}
+        archivio.modifica("voti", lambda v: v.update(campi), id=id)
         return jsonify({"success": True})
 
+@app.route("/api/voti/<int:index>", methods=["PUT", "DELETE"])
+def api_voti_mod(index):
+    # Compatibilità: posizione nella lista -> /api/voti/id/<id>
+    if not login_required():
+        return jsonify({"error": "Non autorizzato"}), 403
+    voto = archivio.in_posizione("voti", index)
+    if voto is None:
+        return jsonify({"error": "Indice non valido"}), 400
+    return api_voto(voto["id"])
+
 
 # =====================================================
 # ==================== RECENSIONI =====================
 # =====================================================
 
 @app.route("/api/recensioni", methods=["GET", "POST"])
+@con_etag("recensioni", "commenti", "reazioni", "utenti")
 def api_recensioni():
     if not login_required():
         return jsonify({"error": "Non autorizzato"}), 403
-    recensioni = leggi_json(FILE_RECENSIONI)
+    if request.method == "GET":
+        # ?per_utente=1: anche il ruolo dell'autore e liked_by_me/disliked_by_me
+        if richiesta_paginata():
+            return risposta_paginata("recensioni", trasforma=recensioni_per_utente_corrente)
+        return lista_in_streaming(archivio.scorri("recensioni"), trasforma=recensioni_per_utente_corrente)
     if request.method == "POST":
         nuovo = request.json
+        # L'id lo assegna il contatore
+        nuovo.pop("id", None)
         nuovo["user"] = session["username"]
         nuovo["timestamp"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        nuovo["likes"] = 0
-        nuovo["dislikes"] = 0
-        nuovo["user_likes"] = []
-        nuovo["user_dislikes"] = []
-        nuovo["commenti"] = []
-        recensioni.append(nuovo)
-        scrivi_json(FILE_RECENSIONI, recensioni)
+        archivio.inserisci("recensioni", nuovo)
         return jsonify({"success": True})
-    return jsonify(recensioni)
 
-@app.route("/api/recensioni/<int:index>", methods=["PUT", "DELETE"])
-def api_recensioni_mod(index):
+@app.route("/api/recensioni/id/<int:id>", methods=["GET", "PUT", "DELETE"])
+@con_etag("recensioni", "commenti", "reazioni", "utenti")
+def api_recensione(id):
     if not login_required():
         return jsonify({"error": "Non autorizzato"}), 403
-    recensioni = leggi_json(FILE_RECENSIONI)
-    if index >= len(recensioni):
-        return jsonify({"error": "Indice non valido"}), 400
-    if session["role"] != "admin" and recensioni[index]["user"] != session["username"]:
+    recensione = archivio.trova("recensioni", id=id)
+    if recensione is None:
+        return jsonify({"error": "Recensione non trovata"}), 404
+    if request.method == "GET":
+        return jsonify(recensioni_per_utente_corrente([recensione])[0])
+    if session["role"] != "admin" and recensione["user"] != session["username"]:
         return jsonify({"error": "Non autorizzato. Puoi modificare solo le tue recensioni."}), 403
     if request.method == "DELETE":
-        recensioni.pop(index)
-        scrivi_json(FILE_RECENSIONI, recensioni)
+        archivio.elimina("recensioni", id=id)
+        commenti = archivio.cerca("commenti", copia=False, recensione_id=id)
+        archivio.elimina("commenti", recensione_id=id)
+        elementi = [elemento_recensione(id)] + [elemento_commento(c["id"]) for c in commenti]
+        archivio.elimina("reazioni", elemento__in=elementi)
         return jsonify({"success": True})
     if request.method == "PUT":
         dati_modifica = request.json
-        recensioni[index]["recensione"] = dati_modifica.get("recensione", recensioni[index]["recensione"])
-        recensioni[index]["nomeProfRec"] = dati_modifica.get("nomeProfRec", recensioni[index]["nomeProfRec"])
-        recensioni[index]["scuola"] = dati_modifica.get("scuola", recensioni[index].get("scuola"))
-        scrivi_json(FILE_RECENSIONI, recensioni)
+
+        def aggiorna_recensione(r):
+            r["recensione"] = dati_modifica.get("recensione", r["recensione"])
+            r["nomeProfRec"] = dati_modifica.get("nomeProfRec", r["nomeProfRec"])
+            r["scuola"] = dati_modifica.get("scuola", r.get("scuola"))
+
+        archivio.modifica("recensioni", aggiorna_recensione, id=id)
         return jsonify({"success": True})
 
+@app.route("/api/recensioni/<int:index>", methods=["PUT", "DELETE"])
+def api_recensioni_mod(index):
+    # Compatibilità: posizione nella lista -> /api/recensioni/id/<id>
+    if not login_required():
+        return jsonify({"error": "Non autorizzato"}), 403
+    recensione = archivio.in_posizione("recensioni", index)
+    if recensione is None:
+        return jsonify({"error": "Indice non valido"}), 400
+    return api_recensione(recensione["id"])
+
+
+def con_reazioni(elementi, chiave, username=None):
+    """Copie degli elementi con i contatori di like/dislike dalla vista reazioni.
+
+    Con username anche liked_by_me/disliked_by_me.
+    """
+    reazioni = archivio.leggi_vista("reazioni", reazioni_elementi, [chiave(e.get("id")) for e in elementi], username)
+    return [dict(e, **reazioni[chiave(e.get("id"))]) for e in elementi]
+
+
+def recensioni_per_utente_corrente(recensioni):
+    # ?per_utente=1: anche il ruolo dell'autore e liked_by_me/disliked_by_me
+    username = session["username"] if request.args.get("per_utente") else None
+    recensioni = con_reazioni(recensioni, elemento_recensione, username)
+    ruoli = archivio.leggi_vista("utenti", ruoli_utenti) if username else None
+    num_commenti = archivio.leggi_vista("commenti", commenti_per_recensione)
+    for r in recensioni:
+        r["num_commenti"] = num_commenti.get(r.get("id"), 0)
+        if ruoli is not None:
+            r["user_role"] = ruoli.get(r.get("user"), "user")
+    return recensioni
+
+
+def commenti_per_utente_corrente(commenti):
+    username = session["username"] if request.args.get("per_utente") else None
+    return con_reazioni(commenti, elemento_commento, username)
+
+
+def id_recensione(index):
+    # Rotte di compatibilità: dalla posizione nella lista all'id della recensione
+    recensione = archivio.in_posizione("recensioni", index)
+    return recensione["id"] if recensione else None
+
+
+@app.route("/api/recensioni/id/<int:id>/like", methods=["POST"])
+def api_recensione_like(id):
+    if not login_required():
+        return jsonify({"error": "Non autorizzato"}), 403
+    if archivio.trova("recensioni", id=id) is None:
+        return jsonify({"error": "Recensione non trovata"}), 404
+    data = request.get_json()
+    reazioni = reagisci(elemento_recensione(id), session["username"], data.get("azione"))
+    return jsonify({"success": True, "likes": reazioni["likes"], "dislikes": reazioni["dislikes"]})
+
 @app.route("/api/recensioni/<int:id>/like", methods=["POST"])
 def api_recensioni_like(id):
     if not login_required():
         return jsonify({"error": "Non autorizzato"}), 403
-    recensioni = leggi_json(FILE_RECENSIONI)
-    if id >= len(recensioni):
+    rec_id = id_recensione(id)
+    if rec_id is None:
         return jsonify({"error": "Recensione non trovata"}), 404
-    data = request.get_json()
-    azione = data.get("azione")
-    username = session["username"]
-    if "likes" not in recensioni[id]:
-        recensioni[id]["likes"] = 0
-    if "dislikes" not in recensioni[id]:
-        recensioni[id]["dislikes"] = 0
-    if "user_likes" not in recensioni[id]:
-        recensioni[id]["user_likes"] = []
-    if "user_dislikes" not in recensioni[id]:
-        recensioni[id]["user_dislikes"] = []
-    if username in recensioni[id].get("user_likes", []):
-        recensioni[id]["user_likes"].remove(username)
-        recensioni[id]["likes"] = max(0, recensioni[id]["likes"] - 1)
-    if username in recensioni[id].get("user_dislikes", []):
-        recensioni[id]["user_dislikes"].remove(username)
-        recensioni[id]["dislikes"] = max(0, recensioni[id]["dislikes"] - 1)
-    if azione == "like":
-        if username not in recensioni[id]["user_likes"]:
-            recensioni[id]["user_likes"].append(username)
-            recensioni[id]["likes"] = recensioni[id]["likes"] + 1
-    elif azione == "dislike":
-        if username not in recensioni[id]["user_dislikes"]:
-            recensioni[id]["user_dislikes"].append(username)
-            recensioni[id]["dislikes"] = recensioni[id]["dislikes"] + 1
-    scrivi_json(FILE_RECENSIONI, recensioni)
-    return jsonify({"success": True, "likes": recensioni[id]["likes"], "dislikes": recensioni[id]["dislikes"]})
+    return api_recensione_like(rec_id)
 
-@app.route("/api/recensioni/<int:rec_id>/commenti", methods=["GET", "POST"])
-def api_recensioni_commenti(rec_id):
+@app.route("/api/recensioni/id/<int:id>/commenti", methods=["GET", "POST"])
+@con_etag("recensioni", "commenti", "reazioni")
+def api_recensione_commenti(id):
     if not login_required():
         return jsonify({"error": "Non autorizzato"}), 403
-    recensioni = leggi_json(FILE_RECENSIONI)
-    if rec_id >= len(recensioni):
+    if archivio.trova("recensioni", id=id) is None:
         return jsonify({"error": "Recensione non trovata"}), 404
     if request.method == "GET":
-        commenti = recensioni[rec_id].get("commenti", [])
-        return jsonify(commenti)
+        if richiesta_paginata():
+            return risposta_paginata("commenti", trasforma=commenti_per_utente_corrente, recensione_id=id)
+        return jsonify(commenti_per_utente_corrente(archivio.cerca("commenti", copia=False, recensione_id=id)))
     elif request.method == "POST":
         data = request.get_json()
         testo = data.get("testo", "").strip()
         if not testo:
             return jsonify({"error": "Commento vuoto"}), 400
-        if "commenti" not in recensioni[rec_id]:
-            recensioni[rec_id]["commenti"] = []
-        nuovo_commento = {"id": len(recensioni[rec_id]["commenti"]) + 1, "utente": session["username"], "ruolo": session.get("role", "user"), "testo": testo, "data": datetime.now().strftime("%Y-%m-%d %H:%M:%S"), "likes": 0, "dislikes": 0, "user_likes": [], "user_dislikes": []}
-        recensioni[rec_id]["commenti"].append(nuovo_commento)
-        scrivi_json(FILE_RECENSIONI, recensioni)
-        return jsonify({"success": True, "message": "Commento aggiunto"})
+        nuovo_commento = {"recensione_id": id, "utente": session["username"], "ruolo": session.get("role", "user"), "testo": testo, "data": datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
+        archivio.inserisci("commenti", nuovo_commento)
+        return jsonify({"success": True, "message": "Commento aggiunto", "id": nuovo_commento["id"]})
+
+@app.route("/api/recensioni/<int:rec_id>/commenti", methods=["GET", "POST"])
+def api_recensioni_commenti(rec_id):
+    if not login_required():
+        return jsonify({"error": "Non autorizzato"}), 403
+    id = id_recensione(rec_id)
+    if id is None:
+        return jsonify({"error": "Recensione non trovata"}), 404
+    return api_recensione_commenti(id)
+
+@app.route("/api/recensioni/id/<int:id>/commenti/<int:comm_id>/like", methods=["POST"])
+def api_recensione_commento_like(id, comm_id):
+    if not login_required():
+        return jsonify({"error": "Non autorizzato"}), 403
+    if archivio.trova("commenti", id=comm_id, recensione_id=id) is None:
+        return jsonify({"error": "Commento non trovato"}), 404
+    data = request.get_json()
+    reazioni = reagisci(elemento_commento(comm_id), session["username"], data.get("azione"))
+    return jsonify({"success": True, "likes": reazioni["likes"], "dislikes": reazioni["dislikes"]})
 
 @app.route("/api/recensioni/<int:rec_id>/commenti/<int:comm_id>/like", methods=["POST"])
 def api_recensioni_commenti_like(rec_id, comm_id):
+    # Compatibilità: recensione e commento per posizione
     if not login_required():
         return jsonify({"error": "Non autorizzato"}), 403
-    recensioni = leggi_json(FILE_RECENSIONI)
-    if rec_id >= len(recensioni):
+    id = id_recensione(rec_id)
+    if id is None:
         return jsonify({"error": "Recensione non trovata"}), 404
-    if "commenti" not in recensioni[rec_id] or comm_id >= len(recensioni[rec_id]["commenti"]):
+    commenti = archivio.cerca("commenti", copia=False, recensione_id=id)
+    if comm_id >= len(commenti):
         return jsonify({"error": "Commento non trovato"}), 404
-    commento = recensioni[rec_id]["commenti"][comm_id]
-    data = request.get_json()
-    azione = data.get("azione")
-    username = session["username"]
-    if "likes" not in commento:
-        commento["likes"] = 0
-    if "dislikes" not in commento:
-        commento["dislikes"] = 0
-    if "user_likes" not in commento:
-        commento["user_likes"] = []
-    if "user_dislikes" not in commento:
-        commento["user_dislikes"] = []
-    if username in commento.get("user_likes", []):
-        commento["user_likes"].remove(username)
-        commento["likes"] = max(0, commento["likes"] - 1)
-    if username in commento.get("user_dislikes", []):
-        commento["user_dislikes"].remove(username)
-        commento["dislikes"] = max(0, commento["dislikes"] - 1)
-    if azione == "like":
-        if username not in commento["user_likes"]:
-            commento["user_likes"].append(username)
-            commento["likes"] = commento["likes"] + 1
-    elif azione == "dislike":
-        if username not in commento["user_dislikes"]:
-            commento["user_dislikes"].append(username)
-            commento["dislikes"] = commento["dislikes"] + 1
-    scrivi_json(FILE_RECENSIONI, recensioni)
-    return jsonify({"success": True, "likes": commento["likes"], "dislikes": commento["dislikes"]})
+    return api_recensione_commento_like(id, commenti[comm_id]["id"])
 
 
 # =====================================================
@@ -1195,39 +2335,170 @@ def api_recensioni_commenti_like(rec_id, comm_id):
 # =====================================================
 
 @app.route("/api/professori", methods=["GET", "POST"])
+@con_etag("professori")
 def api_professori():
     if not login_required():
         return jsonify({"error": "Non autorizzato"}), 403
-    professori = leggi_json(FILE_PROFESSORI)
+    if request.method == "GET":
+        return jsonify(archivio.tutti("professori", copia=False))
     if request.method == "POST":
         nuovo = request.json
-        professori.append(nuovo)
-        scrivi_json(FILE_PROFESSORI, professori)
+        # L'id lo assegna il contatore
+        nuovo.pop("id", None)
+        archivio.inserisci("professori", nuovo)
         return jsonify({"success": True})
-    return jsonify(professori)
+
+@app.route("/api/professori/suggerisci", methods=["GET"])
+@con_etag("professori", "utenti")
+def api_professori_suggerisci():
+    """?prefix=...&campo=nome,materia|scuola[&limit=N][&tutte=1]
+
+    Per nome/materia i professori della scuola dell'utente (di tutte se non
+    ne ha, se è admin, con tutte=1 o se nella sua non ce ne sono); per
+    scuola i nomi delle scuole.
+    """
+    if not login_required():
+        return jsonify({"error": "Non autorizzato"}), 403
+    prefisso = request.args.get("prefix", "")
+    limite = max(1, min(request.args.get("limit", 10, type=int), 50))
+    campi = [c for c in request.args.get("campo", "nome,materia").split(",") if c in ("nome", "materia", "scuola")]
+    if campi == ["scuola"]:
+        return jsonify([{"scuola": s} for s in archivio.leggi_vista("professori", scuole_professori, prefisso, limite)])
+    campi = [c for c in campi if c != "scuola"] or ["nome", "materia"]
+    scuola = None
+    if session["role"] != "admin" and not request.args.get("tutte"):
+        scuola = archivio.leggi_vista("utenti", scuole_utenti, session["username"])
+    suggerimenti = []
+    if scuola:
+        suggerimenti = archivio.leggi_vista("professori", suggerimenti_professori, prefisso, campi, scuola, limite)
+    if not suggerimenti:
+        suggerimenti = archivio.leggi_vista("professori", suggerimenti_professori, prefisso, campi, None, limite)
+    return jsonify(suggerimenti)
 
 @app.route('/api/professori/<int:index>', methods=['PUT','DELETE'])
 def api_professori_mod(index):
     if not login_required():
         return jsonify({"error": "Non autorizzato"}), 403
-    professori = leggi_json(FILE_PROFESSORI)
-    if index >= len(professori):
+    if archivio.in_posizione("professori", index) is None:
         return jsonify({"error": "Indice non valido"}), 400
     if request.method == "DELETE":
-        professori.pop(index)
-        scrivi_json(FILE_PROFESSORI, professori)
+        archivio.elimina("professori", indice=index)
         return jsonify({"success": True})
     if request.method == "PUT":
-        professori[index].update(request.json)
-        scrivi_json(FILE_PROFESSORI, professori)
+        dati_modifica = request.json
+        # Mai l'id: ci si appoggiano l'indice per id e quelli di ricerca
+        campi = {k: dati_modifica[k] for k in ("nome", "materia", "scuola") if k in dati_modifica}
+        archivio.modifica("professori", lambda p: p.update(campi), indice=index)
         return jsonify({"success": True})
 
+
+# =====================================================
+# ================= IMPORT / EXPORT ===================
+# =====================================================
+
+@app.route("/api/export/<collezione>", methods=["GET"])
+def api_export(collezione):
+    """?formato=ndjson|csv e filtri per uguaglianza (es. ?scuola=...): i record in streaming."""
+    if not admin_required():
+        return jsonify({"error": "Non autorizzato"}), 403
+    schema = COLLEZIONI_ESPORTABILI.get(collezione)
+    if schema is None:
+        return jsonify({"error": "Collezione non esportabile"}), 404
+    formato = request.args.get("formato", "ndjson")
+    if formato not in TIPI_FORMATO:
+        return jsonify({"error": "Formato non valido (ndjson o csv)"}), 400
+    filtri = {k: v for k, v in request.args.items() if k in schema["filtri"]}
+    record = archivio.scorri(collezione, **filtri)
+    corpo = esporta_csv(record, schema["campi"]) if formato == "csv" else esporta_ndjson(record)
+    nome_file = f"{collezione}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.{formato}"
+    return Response(stream_with_context(corpo), mimetype=TIPI_FORMATO[formato],
+                    headers={"Content-Disposition": f'attachment; filename="{nome_file}"'})
+
+@app.route("/api/import/<collezione>", methods=["POST"])
+def api_import(collezione):
+    """Corpo NDJSON (un record per riga) o CSV con intestazione, come quelli di /api/export.
+
+    Il formato viene da ?formato= o dal Content-Type (text/csv). L'id non viene
+    importato; user e timestamp, se mancano, sono l'admin e l'ora corrente.
+    Le righe non valide vengono scartate e riportate in "errori"; con
+    ?verifica=1 si valida il file senza scrivere niente.
+    """
+    if not admin_required():
+        return jsonify({"error": "Non autorizzato"}), 403
+    schema = COLLEZIONI_ESPORTABILI.get(collezione)
+    if schema is None:
+        return jsonify({"error": "Collezione non importabile"}), 404
+    formato = request.args.get("formato") or ("csv" if request.mimetype == "text/csv" else "ndjson")
+    if formato not in TIPI_FORMATO:
+        return jsonify({"error": "Formato non valido (ndjson o csv)"}), 400
+    verifica = bool(request.args.get("verifica"))
+    adesso = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    lotto, importati, scartati, errori = [], 0, 0, []
+
+    def scrivi_lotto():
+        if not verifica:
+            archivio.inserisci_molti(collezione, lotto)
+        return len(lotto)
+
+    try:
+        for numero, record in righe_importazione(request.stream, formato):
+            try:
+                if not isinstance(record, dict):
+                    raise ValueError("riga non valida")
+                nuovo = schema["valida"](record)
+                nuovo["user"] = testo_facoltativo(record, "user") or session["username"]
+                nuovo["timestamp"] = testo_facoltativo(record, "timestamp") or adesso
+            except ValueError as e:
+                scartati += 1
+                if len(errori) < MAX_ERRORI_IMPORTAZIONE:
+                    errori.append({"riga": numero, "errore": str(e)})
+                continue
+            lotto.append(nuovo)
+            if len(lotto) == LOTTO_IMPORTAZIONE:
+                importati += scrivi_lotto()
+                lotto = []
+    except (UnicodeDecodeError, csv.Error) as e:
+        return jsonify({"error": f"File non leggibile: {e}", "importati": importati}), 400
+    if lotto:
+        importati += scrivi_lotto()
+    return jsonify({"success": True, "verifica": verifica, "importati": importati, "scartati": scartati,
+                    "errori": errori})
+
+
+# =====================================================
+# ======================= CERCA =======================
+# =====================================================
+
+@app.route("/api/cerca", methods=["GET"])
+@con_etag("recensioni", "commenti", "reazioni", "utenti", "professori", "ticket")
+def api_cerca():
+    """?q=testo[&tipo=recensioni,professori,ticket][&limit=N]: risultati per tipo, dal più pertinente."""
+    if not login_required():
+        return jsonify({"error": "Non autorizzato"}), 403
+    testo = request.args.get("q", "").strip()
+    tipi = [t for t in request.args.get("tipo", ",".join(INDICI_RICERCA)).split(",") if t in INDICI_RICERCA]
+    limite = max(1, min(request.args.get("limit", LIMITE_PAGINA, type=int), LIMITE_PAGINA_MASSIMO))
+    risposta = {}
+    for nome in tipi:
+        proprietario = None
+        if nome == "ticket" and session["role"] != "admin":
+            proprietario = session["username"]
+        trovati = archivio.leggi_vista(nome, INDICI_RICERCA[nome], testo, limite, proprietario) if testo else []
+        elementi = []
+        for id_record, punteggio in trovati:
+            record = archivio.trova(nome, id=id_record)
+            if record is not None:
+                record["punteggio"] = round(punteggio, 4)
+                elementi.append(record)
+        risposta[nome] = recensioni_per_utente_corrente(elementi) if nome == "recensioni" else elementi
+    return jsonify(risposta)
+
 # ═══════════════════════════════════════════════════════════
 # ROUTE DEBUG: CREA UTENTI DI TEST (accessibile solo da admin)
 # ═══════════════════════════════════════════════════════════
 @app.route("/debug-crea-utenti")
 def debug_crea_utenti():
-    """Crea utenti di test nel database - SOLO PER DEBUG"""
+    """Crea utenti di test nell'archivio - SOLO PER DEBUG"""
     
     # 🔧 TEMPORANEO: Commenta questa riga per creare utenti senza login
     # if not admin_required():
@@ -1236,37 +2507,33 @@ def debug_crea_utenti():
     try:
         with app.app_context():
             # Crea admin di test se non esiste
-            if not User.query.filter_by(username="admin").first():
-                admin = User(
-                    username="admin",
-                    password="admin123",
-                    email="admin@test.com",
-                    nome_cognome="Admin Test",
-                    scuola="Test School",
-                    role="admin",
-                    stato="attivo",
-                    account_status="attivo"
-                )
-                db.session.add(admin)
-                db.session.commit()
+            if not archivio.trova("utenti", username="admin"):
+                archivio.inserisci("utenti", {
+                    "username": "admin",
+                    "password": "admin123",
+                    "email": "admin@test.com",
+                    "nome_cognome": "Admin Test",
+                    "scuola": "Test School",
+                    "role": "admin",
+                    "stato": "attivo",
+                    "account_status": "attivo"
+                })
                 msg_admin = "✅ Admin creato: admin / admin123<br>"
             else:
                 msg_admin = "⚠️ Admin già esiste<br>"
             
             # Crea utente normale di test se non esiste
-            if not User.query.filter_by(username="testuser").first():
-                user = User(
-                    username="testuser",
-                    password="test123",
-                    email="test@test.com",
-                    nome_cognome="Test User",
-                    scuola="Test School",
-                    role="user",
-                    stato="attivo",
-                    account_status="attivo"
-                )
-                db.session.add(user)
-                db.session.commit()
+            if not archivio.trova("utenti", username="testuser"):
+                archivio.inserisci("utenti", {
+                    "username": "testuser",
+                    "password": "test123",
+                    "email": "test@test.com",
+                    "nome_cognome": "Test User",
+                    "scuola": "Test School",
+                    "role": "user",
+                    "stato": "attivo",
+                    "account_status": "attivo"
+                })
                 msg_user = "✅ Utente creato: testuser / test123<br>"
             else:
                 msg_user = "⚠️ Utente test già esiste<br>"
@@ -1296,20 +2563,8 @@ def test_route():
 # =====================================================
 
 if __name__ == "__main__":
-    if not os.path.exists(FILE_SESSIONI):
-        scrivi_json(FILE_SESSIONI, [])
-    if not os.path.exists(FILE_SEGNALAZIONI):
-        scrivi_json(FILE_SEGNALAZIONI, [])
-    if not os.path.exists(FILE_REGISTRAZIONI):
-        scrivi_json(FILE_REGISTRAZIONI, [])
-    if not os.path.exists(FILE_AVVISI):
-        scrivi_json(FILE_AVVISI, [])
-    if not os.path.exists(FILE_TICKET):
-        scrivi_json(FILE_TICKET, [])
-    if not os.path.exists(FILE_NOTIFICHE):
-        scrivi_json(FILE_NOTIFICHE, [])
-    if not os.path.exists(FILE_RECUPERO):
-        scrivi_json(FILE_RECUPERO, [])
+    with app.app_context():
+        archivio.inizializza()
 if __name__ == "__main__":
     # Crea le tabelle se non esistono
     with app.app_context():